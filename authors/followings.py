@@ -0,0 +1,132 @@
+"""
+Verification of the followings of local authors by foreign authors.
+
+Whether a foreign author accepted a follow request (or removed the follower since) is only known
+by asking the foreign author's server. The reconcile_followings worker asks every server concurrently,
+with a deadline per pass, so listing the followings is only a database query.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import exceptions
+
+from posts.utils import try_get
+from .models import Follow
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_follower_check_urls(following: Follow):
+    # foreign servers identify the follower either by its url or its id
+    foreign_author_url = following.object.url.rstrip('/')
+    return [f"{foreign_author_url}/followers/{follower}" for follower in (following.actor.url, following.actor.id)]
+
+
+def check_following(following: Follow):
+    """
+    ask the foreign author's server whether the actor is a follower.
+    returns True or False, or None if the server could not tell
+    """
+    try:
+        for request_url in get_follower_check_urls(following):
+            response = try_get(request_url)
+            if response.status_code <= 204:
+                break
+
+        if response.status_code == 200:
+            try:
+                if not response.json()['result']:
+                    return False
+            except Exception as e:
+                logger.debug("following check %s: unexpected response body: %s", following.id, e)
+        if response.status_code >= 500:
+            return None
+        return response.status_code < 400
+    except (requests.exceptions.RequestException, exceptions.APIException) as e:
+        logger.warning("cannot verify the following %s: %s", following.id, e)
+        return None
+    finally:
+        # the worker thread's own connection, used by try_get to find the node
+        connection.close()
+
+
+def apply_following_check(following: Follow, is_follower, now):
+    if is_follower is False and following.status == Follow.FollowStatus.ACCEPTED:
+        # foreign author removed the author as a follower
+        following.delete()
+        return
+    if is_follower:
+        # foreign author accepted the follow request
+        following.status = Follow.FollowStatus.ACCEPTED
+    if is_follower is not None:
+        following.verified_at = now
+    following.checked_at = now
+    # an update, not a save, as the following may have been deleted (unfollowed) during the check
+    Follow.objects.filter(pk=following.pk).update(
+        status=following.status, verified_at=following.verified_at, checked_at=following.checked_at
+    )
+
+
+def verify_followings(followings, deadline=None, max_workers=None):
+    """
+    check the followings against the foreign servers concurrently and update them.
+    checks not done by the deadline (seconds) are left for the next pass, returns the number of followings verified
+    """
+    followings = list(followings)
+    if not followings:
+        return 0
+    deadline = settings.FOLLOWING_VERIFY_DEADLINE if deadline is None else deadline
+    max_workers = max_workers or settings.FOLLOWING_VERIFY_WORKERS
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='following-check')
+    futures = {executor.submit(check_following, following): following for following in followings}
+    done, not_done = wait(futures, timeout=deadline)
+    # don't wait for slow servers, the unfinished checks are dropped
+    for future in not_done:
+        future.cancel()
+    executor.shutdown(wait=False)
+
+    now = timezone.now()
+    verified = 0
+    for future, following in futures.items():
+        # followings of servers that did not answer in time are checked again after the interval
+        try:
+            is_follower = future.result() if future in done else None
+        except Exception as e:
+            logger.warning("cannot verify the following %s: %r", following.id, e)
+            is_follower = None
+        # one following failing doesn't stop the others
+        try:
+            apply_following_check(following, is_follower, now)
+        except Exception:
+            logger.exception("cannot update the following %s", following.id)
+            continue
+        verified += is_follower is not None
+    return verified
+
+
+def get_due_followings():
+    """
+    followings of local authors by foreign authors, never checked or checked more than FOLLOWING_VERIFY_INTERVAL seconds ago
+    """
+    checked_before = timezone.now() - timedelta(seconds=settings.FOLLOWING_VERIFY_INTERVAL)
+    return Follow.objects.filter(
+        actor__is_internal=True, object__is_internal=False
+    ).filter(
+        Q(checked_at__isnull=True) | Q(checked_at__lt=checked_before)
+    ).select_related('actor', 'object').order_by(F('checked_at').asc(nulls_first=True))
+
+
+def reconcile_due_followings(limit=200):
+    """
+    run one pass of the reconciler, returns the number of followings checked
+    """
+    followings = list(get_due_followings()[:limit])
+    verify_followings(followings)
+    return len(followings)
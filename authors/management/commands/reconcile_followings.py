@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from authors.followings import reconcile_due_followings
+
+
+class Command(BaseCommand):
+    help = "Check the follow requests of local authors with the foreign authors' servers (see authors/followings.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="check the due followings once and exit")
+        parser.add_argument('--interval', type=float, default=30.0, help="seconds to sleep when no following is due")
+
+    def handle(self, *args, **options):
+        while True:
+            checked = reconcile_due_followings()
+            if checked:
+                self.stdout.write(f"checked {checked} following(s)")
+            if options['once']:
+                break
+            if not checked:
+                time.sleep(options['interval'])
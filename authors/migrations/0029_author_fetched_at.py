@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authors', '0028_author_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='author',
+            name='url',
+            field=models.URLField(db_index=True, editable=False, max_length=500),
+        ),
+    ]
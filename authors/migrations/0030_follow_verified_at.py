@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authors', '0029_author_fetched_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='follow',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authors', '0030_follow_verified_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['object', 'status'], name='follow_object_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inboxobject',
+            index=models.Index(fields=['author', 'content_type', 'object_id'], name='inbox_author_object_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authors', '0031_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='follow',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='inboxobject',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['actor', '-created_at', '-id'], name='follow_actor_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inboxobject',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='inbox_author_created_idx'),
+        ),
+    ]
@@ -20,13 +20,17 @@ class Author(models.Model):
 
     display_name = models.CharField(max_length=30, blank=True) # maximum 30 chars for display name
     github_url = models.URLField(null=True, blank=True) # the url to the author github profile
-    url = models.URLField(editable=False, max_length=500) # the url to the author profile
+    url = models.URLField(editable=False, max_length=500, db_index=True) # the url to the author profile
     host = models.URLField(editable=False, max_length=500) # the host server node url, ours is https://social-distance-api.herokuapp.com/
 
     profile_image = models.URLField(max_length=500, null=True, blank=True)
     profile_color = models.CharField(max_length=10, null=True, blank=True, default=random_profile_color())
 
     is_internal = models.BooleanField(default=False)
+    # last time the author was saved, used for HTTP caching
+    updated = models.DateTimeField(auto_now=True)
+    # last time a foreign author was fetched from its server, see authors/remote.py
+    fetched_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     # following: Authors, added by related name, see AuthorFollowingRelation
     # followers: Authors, added by related name, see AuthorFollowingRelation
@@ -90,6 +94,13 @@ class Follow(models.Model):
     # needed so we can query InboxObject with follow=this_follow
     inbox_object = GenericRelation('InboxObject', related_query_name='follow')
 
+    # last time the foreign object author's server confirmed the status, and last time it was asked.
+    # set by the reconcile_followings worker, see authors/followings.py
+    verified_at = models.DateTimeField(null=True, blank=True, editable=False)
+    checked_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # the order of the followers and followings lists, the ids are random
+    created_at = models.DateTimeField(auto_now_add=True)
+
     @staticmethod
     def get_api_type():
         return 'Follow'
@@ -101,6 +112,12 @@ class Follow(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['object', 'actor'], name='unique_follower')
         ]
+        indexes = [
+            # the followers (FollowerList) and friends of an author
+            models.Index(fields=['object', 'status'], name='follow_object_status_idx'),
+            # an author's followings, newest first, see FollowingsPagination
+            models.Index(fields=['actor', '-created_at', '-id'], name='follow_actor_created_idx'),
+        ]
 
 
 class InboxObject(models.Model):
@@ -111,3 +128,13 @@ class InboxObject(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True)
     object_id = models.CharField(max_length=500, null=True)
     content_object = GenericForeignKey('content_type', 'object_id')
+    # the inbox is listed newest first, the ids are random
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # an author's inbox objects of one type, and the inbox object of a given object (e.g. InboxObject.objects.filter(follow=...))
+            models.Index(fields=['author', 'content_type', 'object_id'], name='inbox_author_object_idx'),
+            # an author's inbox, newest first, see InboxObjectsPagination
+            models.Index(fields=['author', '-created_at', '-id'], name='inbox_author_created_idx'),
+        ]
@@ -5,8 +5,12 @@ class AuthorsPagination(PageSizePagination):
 
 class FollowingsPagination(PageSizePagination):
     type = 'followings'
+    cursor_ordering = ('-created_at', '-id')
 class FollowersPagination(PageSizePagination):
     type = 'followers'
+    # annotated by FollowerList, when the follow was created
+    cursor_ordering = ('-followed_at', '-id')
 
 class InboxObjectsPagination(PageSizePagination):
-    type = 'inbox_objects'
\ No newline at end of file
+    type = 'inbox_objects'
+    cursor_ordering = ('-created_at', '-id')
@@ -0,0 +1,101 @@
+"""
+Cache of foreign authors.
+
+Foreign authors are kept as Author rows. They are fetched from their server when first needed,
+and served from the database afterwards. Once they are older than REMOTE_AUTHOR_TTL seconds
+they are still served, and refreshed in the background (stale-while-revalidate).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from rest_framework import exceptions
+
+from posts.utils import try_get
+from social_distance.utils import get_url_variants
+from .models import Author
+from .serializers import AuthorSerializer
+
+import logging
+logger = logging.getLogger(__name__)
+
+refresh_executor = ThreadPoolExecutor(max_workers=settings.REMOTE_AUTHOR_REFRESH_WORKERS, thread_name_prefix='remote-author')
+# urls being refreshed, so a popular author is only fetched once at a time
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_cached_author(url):
+    return Author.objects.filter(url__in=get_url_variants(url)).first()
+
+
+def is_stale(author):
+    return author.fetched_at is None or author.fetched_at < timezone.now() - timedelta(seconds=settings.REMOTE_AUTHOR_TTL)
+
+
+def cache_remote_author(data):
+    """
+    update the cached author with the json of the author fetched from its server
+    """
+    serializer = AuthorSerializer(data=data)
+    if not serializer.is_valid():
+        raise exceptions.ParseError({'parsing foreign author': serializer.errors})
+    author = serializer.save()
+    author.fetched_at = timezone.now()
+    # not a save(), the author's data (and its ETag) did not change
+    Author.objects.filter(pk=author.pk).update(fetched_at=author.fetched_at)
+    return author
+
+
+def fetch_remote_author(url):
+    """
+    fetch the author from its server and update the cached one
+    """
+    return cache_remote_author(try_get(url).json())
+
+
+def refresh_in_background(url):
+    with _refreshing_lock:
+        if url in _refreshing:
+            return
+        _refreshing.add(url)
+    refresh_executor.submit(_refresh, url)
+
+
+def _refresh(url):
+    try:
+        fetch_remote_author(url)
+    except Exception as e:
+        logger.warning("cannot refresh the foreign author %s: %s", url, e)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(url)
+        # the thread's own connections
+        connections.close_all()
+
+
+def get_cached_remote_author(url):
+    """
+    the cached foreign author at the url, None if it was never fetched.
+    a stale author is returned as is, and refreshed in the background.
+    """
+    author = get_cached_author(url)
+    if author is None or author.is_internal or author.fetched_at is None:
+        return None
+    if is_stale(author):
+        refresh_in_background(url)
+    return author
+
+
+def get_remote_author(url):
+    """
+    the author at the url: local authors as is, foreign authors from the cache.
+    a foreign author is only fetched synchronously the first time, stale ones are refreshed in the background.
+    """
+    author = get_cached_author(url)
+    if author and author.is_internal:
+        return author
+    return get_cached_remote_author(url) or fetch_remote_author(url)
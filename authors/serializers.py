@@ -2,13 +2,25 @@ import uuid
 from django.forms.models import model_to_dict
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
+from django.db import models
 from django.db.models import Q
+from django.contrib.contenttypes.models import ContentType
 
 from rest_framework import exceptions, serializers
 
 from .models import Author, Follow, InboxObject
 
 
+class FastListSerializer(serializers.ListSerializer):
+    """
+    read only list serializer building each item with the child's fast_representation,
+    which returns the same output as its to_representation without going through every field
+    """
+    def to_representation(self, data):
+        items = data.all() if isinstance(data, models.Manager) else data
+        return [self.child.fast_representation(item) for item in items]
+
+
 class AuthorSerializer(serializers.ModelSerializer):
     # type is only provided to satisfy API format
     type = serializers.CharField(default="author", read_only=True)
@@ -32,6 +44,23 @@ class AuthorSerializer(serializers.ModelSerializer):
             'id': id
         }
 
+    @staticmethod
+    def fast_representation(instance):
+        """
+        to_representation built directly from the instance, also used for the authors nested in posts, comments and likes
+        """
+        id = instance.get_public_id()
+        return {
+            'type': 'author',
+            'id': id[:-1] if id.endswith('/') else id,
+            'host': instance.host,
+            'displayName': instance.display_name,
+            'url': instance.url,
+            'github': instance.github_url,
+            'profileImage': instance.profile_image,
+            'profileColor': instance.profile_color,
+        }
+
     def update(self, instance, validated_data):
         return AuthorSerializer._update(instance, validated_data)
 
@@ -46,32 +75,31 @@ class AuthorSerializer(serializers.ModelSerializer):
         use static method to avoid creating a serializer when data is already valid,
         which happens often in other objects like Post, Like where Author is nested inside.
         """
-        instance.github_url = validated_data.get(
-            'github_url', instance.github_url)
-        instance.display_name = validated_data.get(
-            'display_name', instance.display_name)
-        instance.profile_image = validated_data.get(
-            'profile_image', instance.profile_image)
-        instance.save()
+        changed = False
+        for field in ['github_url', 'display_name', 'profile_image']:
+            if field in validated_data and getattr(instance, field) != validated_data[field]:
+                setattr(instance, field, validated_data[field])
+                changed = True
+        # foreign authors are upcreated with every object they send, most of the times unchanged
+        if changed:
+            instance.save()
         return instance
 
     @staticmethod
     def _upcreate(validated_data):
         """
-        update or create Author from validated data, based on url OR id.
+        update or create Author from validated data, based on id, then url.
         """
-        try:
-            author = Author.objects.get(
-                Q(id=validated_data['id']) | Q(url=validated_data['url']))
-            updated_author = AuthorSerializer._update(author, validated_data)
-        except Author.MultipleObjectsReturned:
-            raise exceptions.ParseError(
-                "multiple author objects with the same id or url is detected. How did you do that?")
-        except:
-            validated_data['id'] = str(uuid.uuid4())
-            updated_author = Author.objects.create(**validated_data)
+        # two indexed lookups instead of an OR'd one, which can't use both indexes
+        author = Author.objects.filter(id=validated_data['id']).first()
+        if author is None and validated_data.get('url'):
+            author = Author.objects.filter(url=validated_data['url']).first()
 
-        return updated_author
+        if author:
+            return AuthorSerializer._update(author, validated_data)
+
+        validated_data['id'] = str(uuid.uuid4())
+        return Author.objects.create(**validated_data)
 
     @staticmethod
     def extract_and_upcreate_author(validated_data, author_id=None):
@@ -96,6 +124,7 @@ class AuthorSerializer(serializers.ModelSerializer):
         model = Author
         # show these fields in response
         fields = ['type', 'id', 'host', 'displayName', 'url', 'github', 'profileImage', 'profileColor']
+        list_serializer_class = FastListSerializer
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -119,14 +148,31 @@ class FollowSerializer(serializers.ModelSerializer):
         object = Author.objects.get(url=object_data['url'])
         return Follow.objects.create(summary=validated_data['summary'], actor=actor, object=object)
     
+    @staticmethod
+    def get_inbox_object_ids(follows):
+        """
+        {follow id: id of the follow's inbox object in the followed author's inbox}, in a single query
+        """
+        follows = {follow.id: follow for follow in follows}
+        inbox_objects = InboxObject.objects.filter(
+            content_type=ContentType.objects.get_for_model(Follow), object_id__in=follows.keys()
+        ).values_list('object_id', 'author_id', 'id')
+        return {
+            follow_id: inbox_object_id for follow_id, author_id, inbox_object_id in inbox_objects
+            if follows[follow_id].object_id == author_id
+        }
+
     def to_representation(self, instance):
-        try:
-            inbox_object = InboxObject.objects.get(follow=instance, author=instance.object)
-        except:
-            inbox_object = None
+        # {follow id: inbox object id} is given when a whole inbox page is serialized
+        inbox_object_ids = self.context.get('inbox_object_ids')
+        if inbox_object_ids is not None:
+            inbox_object_id = inbox_object_ids.get(instance.id)
+        else:
+            inbox_object = InboxObject.objects.filter(follow=instance, author=instance.object).first()
+            inbox_object_id = inbox_object.id if inbox_object else None
         return {
             **super().to_representation(instance),
-            'inbox_object': inbox_object.id if inbox_object else None
+            'inbox_object': inbox_object_id
         }
 
     def validate_object(self, data):
@@ -147,6 +193,15 @@ class FollowSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ['summary', 'actor', 'object', 'type', 'status']
 
+class FollowingSerializer(FollowSerializer):
+    """
+    a following of a local author, with the last time its status was confirmed by the foreign server (null if never)
+    """
+    verifiedAt = serializers.DateTimeField(source='verified_at', read_only=True)
+
+    class Meta(FollowSerializer.Meta):
+        fields = FollowSerializer.Meta.fields + ['verifiedAt']
+
 
 class InboxObjectSerializer(serializers.ModelSerializer):
     author = AuthorSerializer()
@@ -1,12 +1,22 @@
 import json
+import time
 from copy import deepcopy
+from datetime import timedelta
+from unittest import mock
+from django.utils import timezone
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from django.contrib.auth.models import User
+from authors.followings import reconcile_due_followings, verify_followings
 from authors.models import Author, Follow, InboxObject
+from authors.remote import get_remote_author
 from authors.serializers import AuthorSerializer, FollowSerializer
+from authors.views import BatchInboxView
+from posts.models import Post, Like, StreamItem
 
 # Create your tests here.
 
@@ -97,6 +107,279 @@ class FollowTestCase(TestCase):
         self.assertEqual(len(local_author.inbox_objects.all()), 1)
 
 
+class InboxListTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('inbox_user', 'test_email', 'test_pass')
+        self.author = Author.objects.create(id='inbox_author', url='http://testserver/author/inbox_author',
+                                            display_name='inbox author', user=self.user, is_internal=True)
+        self.client = client_with_auth(self.user, APIClient())
+
+    def add_inbox_items(self, n):
+        for i in range(n):
+            sender = Author.objects.create(display_name=f'sender {i}', url=f'http://foreign.example/author/{Author.objects.count()}')
+            post = Post.objects.create(author=sender, title='title', content='content', url=f'{sender.url}/posts/1')
+            like = Like.objects.create(author=sender, summary='like', object=f'{self.author.url}/posts/1')
+            follow = Follow.objects.create(actor=sender, object=self.author, summary='follow')
+            for item in [post, like, follow]:
+                InboxObject.objects.create(author=self.author, content_object=item)
+
+    def get_inbox(self):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(f'/author/{self.author.id}/inbox/?size=100', format='json')
+        self.assertEqual(res.status_code, 200)
+        return res.data['items'], len(queries)
+
+    def test_inbox_queries_do_not_grow_with_items(self):
+        self.add_inbox_items(2)
+        items, num_queries = self.get_inbox()
+        self.assertEqual(len(items), 6)
+
+        self.add_inbox_items(3)
+        items, more_num_queries = self.get_inbox()
+        self.assertEqual(len(items), 15)
+        self.assertEqual(num_queries, more_num_queries)
+
+        self.assertEqual(sorted(item['type'] for item in items), ['Follow'] * 5 + ['Like'] * 5 + ['post'] * 5)
+        for item in items:
+            if item['type'] == 'Follow':
+                self.assertEqual(InboxObject.objects.get(id=item['inbox_object']).content_object.actor.display_name,
+                                 item['actor']['displayName'])
+            elif item['type'] == 'post':
+                self.assertEqual(item['count'], 0)
+
+
+    def test_inbox_cursor_is_newest_first(self):
+        self.add_inbox_items(1)
+        # the post, like and follow were sent in that order
+        for age, type in enumerate(['follow', 'like', 'post']):
+            InboxObject.objects.filter(author=self.author, content_type__model=type).update(
+                created_at=timezone.now() - timedelta(minutes=age)
+            )
+
+        res = self.client.get(f'/author/{self.author.id}/inbox/?cursor=&size=2', format='json')
+        self.assertEqual([item['type'] for item in res.data['items']], ['Follow', 'Like'])
+        res = self.client.get(res.data['next'], format='json')
+        self.assertEqual([item['type'] for item in res.data['items']], ['post'])
+        self.assertIsNone(res.data['next'])
+
+
+class FollowingsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('following_user', 'test_email', 'test_pass')
+        self.author = Author.objects.create(id='following_author', url='http://testserver/author/following_author',
+                                            display_name='following author', user=self.user, is_internal=True)
+        self.pending = self.follow('pending', Follow.FollowStatus.PENDING)
+        self.accepted = self.follow('accepted', Follow.FollowStatus.ACCEPTED)
+
+    def follow(self, name, status):
+        foreign_author = Author.objects.create(id=f'http://foreign.example/author/{name}', url=f'http://foreign.example/author/{name}',
+                                               display_name=name, host='http://foreign.example/')
+        return Follow.objects.create(actor=self.author, object=foreign_author, status=status, summary=name)
+
+    def mock_response(self, status_code, data=None):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.json.return_value = data
+        return response
+
+    def test_followings_are_listed_without_remote_requests(self):
+        with mock.patch('authors.followings.try_get') as remote_get:
+            res = client_with_auth(self.user, APIClient()).get(f'/author/{self.author.id}/followings/', format='json')
+        remote_get.assert_not_called()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data['items']), 2)
+        self.assertIsNone(res.data['items'][0]['verifiedAt'])
+
+    def test_followings_are_reconciled(self):
+        def remote_get(url):
+            if '/author/pending/' in url:
+                return self.mock_response(200, {'result': True})
+            return self.mock_response(404)
+
+        with mock.patch('authors.followings.try_get', side_effect=remote_get):
+            self.assertEqual(reconcile_due_followings(), 2)
+
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, Follow.FollowStatus.ACCEPTED)
+        self.assertIsNotNone(self.pending.verified_at)
+        self.assertFalse(Follow.objects.filter(id=self.accepted.id).exists())
+
+        # not due until FOLLOWING_VERIFY_INTERVAL passed
+        with mock.patch('authors.followings.try_get') as remote_get:
+            self.assertEqual(reconcile_due_followings(), 0)
+        remote_get.assert_not_called()
+
+    def test_unreachable_server_keeps_status(self):
+        with mock.patch('authors.followings.try_get', return_value=self.mock_response(503)):
+            verify_followings([self.accepted])
+        self.accepted.refresh_from_db()
+        self.assertEqual(self.accepted.status, Follow.FollowStatus.ACCEPTED)
+        self.assertIsNone(self.accepted.verified_at)
+        self.assertIsNotNone(self.accepted.checked_at)
+
+    def test_failing_followings_do_not_stop_the_others(self):
+        def check(following):
+            if following.id == self.pending.id:
+                raise ValueError('unexpected')
+            return True
+
+        other = self.follow('other', Follow.FollowStatus.PENDING)
+        # unfollowed after the pass listed it
+        Follow.objects.filter(id=self.accepted.id).delete()
+        with mock.patch('authors.followings.check_following', side_effect=check):
+            self.assertEqual(verify_followings([self.pending, self.accepted, other]), 2)
+
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, Follow.FollowStatus.PENDING)
+        self.assertIsNotNone(self.pending.checked_at)
+        self.assertFalse(Follow.objects.filter(id=self.accepted.id).exists())
+        other.refresh_from_db()
+        self.assertEqual(other.status, Follow.FollowStatus.ACCEPTED)
+
+    def test_slow_servers_are_left_for_next_pass(self):
+        def slow_get(url):
+            time.sleep(0.5)
+            return self.mock_response(200, {'result': False})
+
+        with mock.patch('authors.followings.try_get', side_effect=slow_get):
+            started = time.monotonic()
+            self.assertEqual(verify_followings([self.pending, self.accepted], deadline=0.1), 0)
+            self.assertLess(time.monotonic() - started, 0.5)
+        self.assertTrue(Follow.objects.filter(id=self.accepted.id, status=Follow.FollowStatus.ACCEPTED).exists())
+
+
+class BatchInboxTestCase(TestCase):
+    POST = {
+        'type': 'post',
+        'title': 'shared post',
+        'description': '',
+        'contentType': 'text/plain',
+        'content': 'hello',
+        'visibility': 'PUBLIC',
+        'unlisted': False,
+        'author': {
+            'type': 'author',
+            'id': 'http://foreign.example/author/sender',
+            'url': 'http://foreign.example/author/sender',
+            'host': 'http://foreign.example/',
+            'displayName': 'Sender',
+        },
+    }
+
+    def setUp(self):
+        self.authors = [
+            Author.objects.create(id=f'batch_author_{i}', url=f'http://testserver/author/batch_author_{i}',
+                                  display_name=f'batch author {i}', is_internal=True)
+            for i in range(3)
+        ]
+
+    def post_batch(self, items):
+        return APIClient().post('/inbox/', {'type': 'inboxes', 'items': items}, format='json')
+
+    def test_shared_post_is_saved_once(self):
+        items = [{'author': author.url + '/', 'object': self.POST} for author in self.authors]
+        items.append({'author': 'http://testserver/author/missing/', 'object': self.POST})
+        items.append({'author': self.authors[0].url, 'object': {'type': 'unknown'}})
+
+        res = self.post_batch(items)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([item['status'] for item in res.data['items']], [201, 201, 201, 404, 400])
+
+        self.assertEqual(Post.objects.filter(title='shared post').count(), 1)
+        post = Post.objects.get(title='shared post')
+        for author, result in zip(self.authors, res.data['items']):
+            inbox_object = InboxObject.objects.get(id=result['inbox_object'])
+            self.assertEqual(inbox_object.author, author)
+            self.assertEqual(str(inbox_object.object_id), str(post.id))
+            self.assertTrue(StreamItem.objects.filter(author=author, kind=StreamItem.Kind.INBOX, post=post).exists())
+
+    def test_queries_do_not_grow_with_targets(self):
+        # creates the sender and caches the content types
+        self.post_batch([{'author': self.authors[0].url, 'object': {**self.POST, 'title': 'first'}}])
+        with CaptureQueriesContext(connection) as queries:
+            self.post_batch([{'author': author.url, 'object': self.POST} for author in self.authors[:1]])
+        with CaptureQueriesContext(connection) as more_queries:
+            self.post_batch([{'author': author.url, 'object': {**self.POST, 'title': 'other'}} for author in self.authors])
+        self.assertEqual(len(queries), len(more_queries))
+
+    def test_shared_object(self):
+        items = [{'author': author.url} for author in self.authors]
+        res = APIClient().post('/inbox/', {'type': 'inboxes', 'object': self.POST, 'items': items}, format='json')
+        self.assertEqual([item['status'] for item in res.data['items']], [201, 201, 201])
+        self.assertEqual(Post.objects.filter(title='shared post').count(), 1)
+        self.assertEqual(InboxObject.objects.count(), 3)
+
+    def test_failing_item_does_not_fail_the_batch(self):
+        deserialize = BatchInboxView.deserialize_inbox_data
+        def failing_deserialize(view, data, *args):
+            if data['title'] == 'broken':
+                raise ValueError('unexpected')
+            return deserialize(view, data, *args)
+
+        items = [
+            {'author': self.authors[0].url, 'object': {**self.POST, 'title': 'broken'}},
+            {'author': self.authors[1].url, 'object': self.POST},
+        ]
+        with mock.patch.object(BatchInboxView, 'deserialize_inbox_data', failing_deserialize):
+            res = self.post_batch(items)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([item['status'] for item in res.data['items']], [400, 201])
+        self.assertEqual(Post.objects.filter(title='shared post').count(), 1)
+
+    def test_invalid_body(self):
+        self.assertEqual(APIClient().post('/inbox/', {'type': 'inboxes'}, format='json').status_code, 400)
+
+
+class RemoteAuthorTestCase(TestCase):
+    URL = 'http://foreign.example/author/remote'
+    DATA = {
+        'type': 'author',
+        'id': URL,
+        'url': URL,
+        'host': 'http://foreign.example/',
+        'displayName': 'Remote Author',
+    }
+
+    def mock_response(self, data):
+        response = mock.Mock()
+        response.status_code = 200
+        response.json.return_value = data
+        return response
+
+    def test_remote_author_is_cached(self):
+        with mock.patch('authors.remote.try_get', return_value=self.mock_response(self.DATA)) as remote_get:
+            author = get_remote_author(self.URL)
+            self.assertEqual(author.display_name, 'Remote Author')
+            self.assertIsNotNone(author.fetched_at)
+
+            self.assertEqual(get_remote_author(self.URL + '/').pk, author.pk)
+            res = APIClient().get(f'/proxy/{self.URL}/', format='json')
+            self.assertEqual(json.loads(res.content)['displayName'], 'Remote Author')
+        remote_get.assert_called_once()
+
+    def test_stale_remote_author_is_refreshed_in_background(self):
+        with mock.patch('authors.remote.try_get', return_value=self.mock_response(self.DATA)):
+            author = get_remote_author(self.URL)
+        Author.objects.filter(pk=author.pk).update(fetched_at=timezone.now() - timedelta(days=1))
+
+        with mock.patch('authors.remote.try_get') as remote_get, \
+             mock.patch('authors.remote.refresh_executor.submit') as submit:
+            self.assertEqual(get_remote_author(self.URL).pk, author.pk)
+        remote_get.assert_not_called()
+        submit.assert_called_once()
+
+    def test_upcreate_unchanged_author_is_not_saved(self):
+        serializer = AuthorSerializer(data=self.DATA)
+        self.assertTrue(serializer.is_valid())
+        author = serializer.save()
+
+        serializer = AuthorSerializer(data=self.DATA)
+        self.assertTrue(serializer.is_valid())
+        # looked up by id, then url, and no UPDATE
+        with self.assertNumQueries(2):
+            self.assertEqual(serializer.save().pk, author.pk)
+
+
 class AuthorSerializerTestCase(TestCase):
     # mock the raw requests.data['actor'] dict, not validated yet.
     FOREIGN_AUTHOR_A_DATA = {
@@ -183,6 +466,32 @@ class AuthorTestCase(TestCase):
         self.assertEqual(content[0]['id'], str(self.author.id))
         self.assertEqual(res.status_code, 200)
 
+    def test_get_author_list_cursor_paginated(self):
+        for i in range(3):
+            user = User.objects.create_user(f'test_username_{i}', 'test_email', 'test_pass')
+            Author.objects.create(id=f'author_{i}', user=user, display_name=user.username, is_internal=True)
+        res = client.get('/authors/?cursor=&size=2', format='json')
+        content = json.loads(res.content)
+        self.assertNotIn("count", content)
+        self.assertEqual([author['id'] for author in content['items']], ['author_2', 'author_1'])
+
+        res = client.get(content['next'], format='json')
+        content = json.loads(res.content)
+        self.assertEqual([author['id'] for author in content['items']], ['author_0'])
+        self.assertIsNone(content['next'])
+
+    def test_get_followers_cursor_paginated(self):
+        self.setup_single_user_and_author()
+        for i in range(3):
+            follower = Author.objects.create(id=f'follower_{i}', display_name=f'follower {i}')
+            Follow.objects.create(actor=follower, object=self.author, status=Follow.FollowStatus.ACCEPTED)
+        res = client.get(f'/author/{self.author.id}/followers/?cursor=&size=2', format='json')
+        content = json.loads(res.content)
+        self.assertEqual([author['displayName'] for author in content['items']], ['follower 2', 'follower 1'])
+
+        res = client.get(content['next'], format='json')
+        self.assertEqual([author['displayName'] for author in json.loads(res.content)['items']], ['follower 0'])
+
     def test_get_author_detail(self):
         self.setup_single_user_and_author()
         res = client.get(f'/author/{self.author.id}/', format='json')
@@ -193,6 +502,18 @@ class AuthorTestCase(TestCase):
         self.assertEqual(content['id'], str(self.author.id))
         self.assertEqual(res.status_code, 200)
 
+    def test_get_author_detail_not_modified(self):
+        self.setup_single_user_and_author()
+        res = client.get(f'/author/{self.author.id}/', format='json')
+        res = client.get(f'/author/{self.author.id}/', format='json', HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+
+        self.author.display_name = 'new name'
+        self.author.save()
+        res = client.get(f'/author/{self.author.id}/', format='json', HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.content)['displayName'], 'new name')
+
     def test_update_author_detail(self):
         # first register a user
         register_payload = {
@@ -1,3 +1,5 @@
+import json
+from collections import defaultdict
 from drf_spectacular.types import OpenApiTypes
 from urllib.parse import unquote
 import requests
@@ -9,18 +11,29 @@ from rest_framework import exceptions, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes
 from drf_spectacular.utils import OpenApiExample, extend_schema
 from django.forms.models import model_to_dict
+from django.db.models import F
 from django.db.models.query_utils import Q
+from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+from django.db import transaction
 
-from posts.models import Post, Like
-from posts.serializers import LikeSerializer, PostSerializer
+from posts.models import Post, Like, StreamItem
+from posts.serializers import LikeSerializer, PostSerializer, count_likes
 from nodes.models import connector_service, Node
+from nodes.client import node_client
+from nodes.proxy import get_proxied_object
+from social_distance.utils import add_cache_headers, get_not_modified_response, get_url_variants, make_etag
 from posts.utils import *
 from posts.utils import try_get
 
-from .serializers import AuthorSerializer, FollowSerializer, InboxObjectSerializer
+from .serializers import AuthorSerializer, FollowSerializer, FollowingSerializer, InboxObjectSerializer
+from .remote import cache_remote_author, get_cached_remote_author, get_remote_author
 from .pagination import *
 from .models import Author, Follow, Follow, InboxObject
 
+import logging
+logger = logging.getLogger(__name__)
+
 # https://www.django-rest-framework.org/tutorial/3-class-based-views/
 
 @api_view(['GET'])
@@ -31,13 +44,23 @@ def proxy(request, object_url):
 
     get any json from that url (use node auth) and return to frontend
     """
-    print("proxying object: url: ", object_url)
-    res = try_get(unquote(object_url))
-    try:
-        data = res.json()
-        return Response(data)
-    except:
-        raise exceptions.ParseError("remote server response is not valid json")
+    object_url = unquote(object_url)
+    # foreign authors are served from the cache, see authors/remote.py
+    author = get_cached_remote_author(object_url)
+    if author:
+        return Response(AuthorSerializer(author).data)
+
+    status_code, data = get_proxied_object(object_url, request.user)
+    if status_code >= 400:
+        return Response(data, status=status_code)
+
+    if isinstance(data, dict) and data.get('type') == 'author':
+        try:
+            cache_remote_author(data)
+        except exceptions.ParseError:
+            # not an author we can cache, still show it
+            pass
+    return Response(data)
     
 class AuthorList(ListAPIView):
     serializer_class = AuthorSerializer
@@ -45,8 +68,7 @@ class AuthorList(ListAPIView):
 
     # used by the ListCreateAPIView super class 
     def get_queryset(self):
-        all_authors = Author.objects.all()
-        return [author for author in all_authors if author.is_internal]
+        return Author.objects.filter(is_internal=True).order_by('id')
 
     @extend_schema(
         # specify response format for list: https://drf-spectacular.readthedocs.io/en/latest/faq.html?highlight=list#i-m-using-action-detail-false-but-the-response-schema-is-not-a-list
@@ -81,8 +103,14 @@ class AuthorDetail(APIView):
             author = Author.objects.get(pk=author_id)
         except Author.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
+
+        etag = make_etag(author.id, author.updated)
+        not_modified = get_not_modified_response(request, etag, author.updated, public=True)
+        if not_modified:
+            return not_modified
+
         serializer = AuthorSerializer(author, many=False)
-        return Response(serializer.data)
+        return add_cache_headers(Response(serializer.data), etag, author.updated, public=True)
 
     def post(self, request, author_id):
         """
@@ -108,15 +136,65 @@ class AuthorDetail(APIView):
 
 
 class InboxSerializerMixin:
-    def serialize_inbox_item(self, item, context={}):
-        model_class = item.content_type.model_class()
+    def get_inbox_object_queryset(self, model_class):
         if model_class is Follow:
-            serializer = FollowSerializer
+            return Follow.objects.select_related('actor', 'object')
         elif model_class is Post:
-            serializer = PostSerializer
+            return Post.objects.select_related('author')
         elif model_class is Like:
-            serializer = LikeSerializer
-        return serializer(item.content_object, context=context).data
+            return Like.objects.select_related('author')
+
+    def get_inbox_serializer_class(self, model_class):
+        if model_class is Follow:
+            return FollowSerializer
+        elif model_class is Post:
+            return PostSerializer
+        elif model_class is Like:
+            return LikeSerializer
+
+    def serialize_inbox_items(self, items, context={}):
+        """
+        serialize a page of inbox items in a constant number of queries:
+        the objects are fetched in bulk (with their authors) once per content type.
+        items whose object no longer exists are skipped.
+        """
+        object_ids = defaultdict(list)
+        for item in items:
+            object_ids[item.content_type_id].append(item.object_id)
+
+        objects = {}
+        for content_type_id, ids in object_ids.items():
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+            # object_id is a string, but Like uses an integer pk
+            objects[content_type_id] = {
+                str(pk): obj for pk, obj in self.get_inbox_object_queryset(model_class).in_bulk(ids).items()
+            }
+
+        inbox_object_ids = {
+            item.object_id: item.id for item in items
+            if ContentType.objects.get_for_id(item.content_type_id).model_class() is Follow
+        }
+        posts = [obj for type_objects in objects.values() for obj in type_objects.values() if isinstance(obj, Post)]
+        context = {
+            **context,
+            'inbox_object_ids': inbox_object_ids,
+            'like_counts': count_likes(posts, context.get('request'))
+        }
+
+        data = []
+        for item in items:
+            obj = objects[item.content_type_id].get(item.object_id)
+            if obj is None:
+                continue
+            serializer = self.get_inbox_serializer_class(type(obj))
+            data.append(serializer(obj, context=context).data)
+        return data
+
+    def serialize_inbox_item(self, item, context={}):
+        data = self.serialize_inbox_items([item], context)
+        if not data:
+            raise exceptions.NotFound('inbox object not found')
+        return data[0]
 
     def deserialize_inbox_data(self, data, context={}):
         if not data.get('type'):
@@ -128,6 +206,8 @@ class InboxSerializerMixin:
             serializer = PostSerializer
         elif type == Like.get_api_type():
             serializer = LikeSerializer
+        else:
+            raise exceptions.ParseError(f"unsupported inbox object type: {type}")
 
         return serializer(data=data, context=context)
 
@@ -156,9 +236,9 @@ class InboxListView(ListCreateAPIView, InboxSerializerMixin):
         if not author.user or request.user != author.user:
             raise exceptions.AuthenticationFailed
 
-        inbox_objects = author.inbox_objects.all()
+        inbox_objects = author.inbox_objects.order_by('-created_at', '-id')
         paginated_inbox_objects = self.paginate_queryset(inbox_objects)
-        return self.get_paginated_response([self.serialize_inbox_item(obj) for obj in paginated_inbox_objects])
+        return self.get_paginated_response(self.serialize_inbox_items(paginated_inbox_objects, context={'request': request}))
 
     # TODO put somewhere else
     @extend_schema(
@@ -252,6 +332,123 @@ class InboxListView(ListCreateAPIView, InboxSerializerMixin):
 
 
 
+class BatchInboxView(APIView, InboxSerializerMixin):
+    """
+    the inbox of many local authors at once, for foreign servers sending the same objects to many of our authors.
+    see nodes/delivery.py for the sending side
+    """
+    def get_target_authors(self, author_urls):
+        """
+        {author url: Author} of the local authors, in a single query
+        """
+        variants = {url: get_url_variants(url) for url in author_urls}
+        author_ids = {url: url.rstrip('/').split('/')[-1] for url in author_urls}
+        authors = Author.objects.filter(
+            Q(url__in=[variant for url_variants in variants.values() for variant in url_variants]) | Q(id__in=author_ids.values())
+        )
+        by_url = {author.url: author for author in authors}
+        by_id = {author.id: author for author in authors}
+        return {
+            url: next((by_url[variant] for variant in variants[url] if variant in by_url), None) or by_id.get(author_ids[url])
+            for url in author_urls
+        }
+
+    def save_inbox_object(self, data, request):
+        """
+        deserialize and save an object sent to the inbox, returns (object, errors)
+        """
+        try:
+            serializer = self.deserialize_inbox_data(data)
+            if not serializer.is_valid():
+                return None, serializer.errors
+            # a savepoint, so a failing object doesn't roll back the others
+            with transaction.atomic():
+                item = serializer.save()
+                if hasattr(item, 'update_fields_with_request'):
+                    item.update_fields_with_request(request)
+        except exceptions.APIException as e:
+            return None, e.detail
+        except Exception as e:
+            # only this item fails, not the whole batch
+            logger.warning("cannot save an object sent to the batch inbox: %r", e)
+            return None, str(e)
+        return item, None
+
+    @extend_schema(
+        examples=[
+            OpenApiExample('A post sent to two authors', value={
+                "type": "inboxes",
+                "object": {"type": "post"},
+                "items": [
+                    {"author": "http://127.0.0.1:8000/author/51914b9c-98c6-4a5c-91bf-fb55a53a92fe/"},
+                    {"author": "http://127.0.0.1:8000/author/d8fb48fe-a014-49d9-ac4c-bfbdf94b097f/", "object": {"type": "Like"}},
+                ]
+            }),
+        ],
+        request={
+            'application/json': OpenApiTypes.OBJECT
+        },
+    )
+    def post(self, request):
+        """
+        ## Description:
+        A foreign server sends json objects to the inboxes of many authors. server basic auth required <br>
+        body: {"type": "inboxes", "object": post, like or follow, "items": [{"author": author url}, ...]} <br>
+        an item can also have its own "object". an object sent to many authors is only saved once.
+        ## Responses:
+        **200**: with the result of each item, in order: {"author", "status", and "inbox_object" or "errors"} <br>
+        **400**: if the body is not a list of items
+        """
+        items = request.data.get('items') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise exceptions.ParseError('expected {"type": "inboxes", "items": [{"author": ..., "object": ...}]}')
+        if len(items) > settings.BATCH_INBOX_MAX_ITEMS:
+            raise exceptions.ParseError(f"at most {settings.BATCH_INBOX_MAX_ITEMS} items are accepted at once")
+
+        authors = self.get_target_authors({str(item.get('author', '')) for item in items})
+        # the object sent to every item that doesn't have its own
+        shared_object = request.data.get('object')
+
+        results = []
+        # the same object is usually sent to many authors, save it once
+        saved_objects = {}
+        inbox_objects = {}
+        with transaction.atomic():
+            for item in items:
+                author_url = str(item.get('author', ''))
+                author = authors.get(author_url)
+                if author is None:
+                    results.append({'author': author_url, 'status': status.HTTP_404_NOT_FOUND, 'errors': 'author not found'})
+                    continue
+                object_data = item.get('object', shared_object)
+                if not isinstance(object_data, dict):
+                    results.append({'author': author_url, 'status': status.HTTP_400_BAD_REQUEST, 'errors': 'object is missing'})
+                    continue
+
+                object_key = json.dumps(object_data, sort_keys=True)
+                if object_key not in saved_objects:
+                    saved_objects[object_key] = self.save_inbox_object(object_data, request)
+                obj, errors = saved_objects[object_key]
+                if errors is not None:
+                    results.append({'author': author_url, 'status': status.HTTP_400_BAD_REQUEST, 'errors': errors})
+                    continue
+
+                inbox_key = (author.id, object_key)
+                if inbox_key not in inbox_objects:
+                    inbox_objects[inbox_key] = (InboxObject(content_object=obj, author=author), obj)
+                results.append({'author': author_url, 'status': status.HTTP_201_CREATED, 'inbox_object': str(inbox_objects[inbox_key][0].id)})
+
+            # bulk_create doesn't send post_save, so the stream rows are added here too
+            InboxObject.objects.bulk_create([inbox_object for inbox_object, _ in inbox_objects.values()])
+            # the saved objects, inbox_object.content_object would fetch each of them again
+            StreamItem.objects.bulk_create([
+                StreamItem(author=inbox_object.author, kind=StreamItem.Kind.INBOX, post=obj, published=obj.published)
+                for inbox_object, obj in inbox_objects.values() if isinstance(obj, Post)
+            ], ignore_conflicts=True)
+
+        return Response({'type': 'inboxes', 'items': results})
+
+
 class InboxDetailView(RetrieveDestroyAPIView, InboxSerializerMixin):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -275,14 +472,14 @@ class InboxDetailView(RetrieveDestroyAPIView, InboxSerializerMixin):
 
         # has to be the current user
         # and author without a user is a foreign author
-        if not author.user or request.user != author.user:
+        if not author.user_id or request.user.id != author.user_id:
             raise exceptions.AuthenticationFailed
 
         # can only see your own inbox items!
         if inbox_item.author != author:
             raise exceptions.NotFound('inbox object not found')
 
-        return Response(self.serialize_inbox_item(inbox_item))
+        return Response(self.serialize_inbox_item(inbox_item, context={'request': request}))
     
     def delete(self, request, author_id, inbox_id):
         """
@@ -328,8 +525,10 @@ class FollowerList(ListAPIView):
             author = Author.objects.get(id=author_id)
         except:
             raise exceptions.NotFound
-        # find all author following this author
-        return Author.objects.filter(followings__object=author, followings__status=Follow.FollowStatus.ACCEPTED)
+        # find all author following this author, most recent first
+        return Author.objects.filter(
+            followings__object=author, followings__status=Follow.FollowStatus.ACCEPTED
+        ).annotate(followed_at=F('followings__created_at')).order_by('-followed_at', '-id')
 
     def get(self, request, *args, **kwargs):
         """
@@ -434,18 +633,18 @@ class FollowerDetail(APIView):
         if existing_follower_set and existing_follower_set.get().is_internal:
             # internal author: do nothing
             follower = existing_follower_set.get()
-        else:
-            # external author: upcreate it first
-            follower_serializer = self.get_follower_serializer_from_request(
-                request, foreign_author_url)
-            print("foreign author url: ", foreign_author_url)
-            print("follow serializer: ", follower_serializer)
+        elif request.data:
+            # external author in the payload: upcreate it first
+            follower_serializer = AuthorSerializer(data=request.data)
             if follower_serializer.is_valid():
                 if foreign_author_url != follower_serializer.validated_data['url']:
                     return Response("payload author's url does not match that in request url", status=status.HTTP_400_BAD_REQUEST)
                 follower = follower_serializer.save()
             else:
                 return Response(follower_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            # external author: fetch it from its server, or the cache
+            follower = get_remote_author(foreign_author_url)
 
         # accept the follow request (activate the relationship), or create it if not exist already
         try:
@@ -459,79 +658,29 @@ class FollowerDetail(APIView):
             raise exceptions.ParseError("There exists multiple Follow objects. Please report how you reached this error")
         return Response()
 
-    def get_follower_serializer_from_request(self, request, foreign_author_url):
-        if request.data:
-            follower_serializer = AuthorSerializer(data=request.data)
-        else:
-            # try fetch the foreign user first, upcreate it locally and do it again.
-            # TODO server2server basic auth, refactor into server2server connection pool/service
-            res = try_get(foreign_author_url)
-            follower_serializer = AuthorSerializer(data=res.json())
-        return follower_serializer
-
 class FollowingList(ListAPIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    serializer_class = FollowSerializer
+    serializer_class = FollowingSerializer
     pagination_class = FollowingsPagination
 
-
     def get_queryset(self):
         try:
             author = Author.objects.get(id=self.kwargs.get('author_id'))
         except Author.DoesNotExist:
             raise exceptions.NotFound
-    
-        followings = author.followings.all()
 
-        followings_to_delete = []
-        for following in followings:
-            if following.object.is_internal:
-                continue
-            foreign_author_url = following.object.url
-
-            if foreign_author_url.endswith("/"):
-                request_url = foreign_author_url + "followers/" + author.url
-            else:
-                request_url = foreign_author_url + "/followers/" + author.url
-            print("following: request_url: ", request_url)
-            response = try_get(request_url)
+        # the status of foreign followings is kept up to date by the reconcile_followings worker (authors/followings.py),
+        # verifiedAt tells how recent it is
+        return author.followings.select_related('actor', 'object').order_by('-created_at', '-id')
 
-            print("following: response: ", response)
-
-            if response.status_code > 204:
-                # try again but with author.id instead of author.url
-                if foreign_author_url.endswith("/"):
-                    request_url = foreign_author_url + "followers/" + author.id
-                else:
-                    request_url = foreign_author_url + "/followers/" + author.id
-                print("following: request_url: ", request_url)
-                response = try_get(request_url)
-
-            if response.status_code == 200:
-                try:
-                    possible_body = response.json()
-                    if not possible_body['result']:
-                        response.status_code = 404
-                except Exception as e:
-                    print("following list get: weird things happen when response was 200: ", e) 
-            print("following: response: ", response)
-
-            # any status code < 400 indicate success
-            if response.status_code < 400 and following.status == Follow.FollowStatus.PENDING:
-                # foreign author accepted the follow request
-                following.status = Follow.FollowStatus.ACCEPTED
-                following.save()
-            elif response.status_code >= 400 and following.status == Follow.FollowStatus.ACCEPTED:
-                # foreign author removed the author as a follower 
-                followings_to_delete.append(following.id)
-
-        # https://stackoverflow.com/a/34890230
-        followings.filter(id__in=followings_to_delete).delete()
-       
-        return followings.exclude(id__in=followings_to_delete)
+    def get_serializer(self, *args, **kwargs):
+        if args:
+            kwargs.setdefault('context', self.get_serializer_context())
+            kwargs['context']['inbox_object_ids'] = FollowSerializer.get_inbox_object_ids(args[0])
+        return super().get_serializer(*args, **kwargs)
 
     @extend_schema(
-        responses=FollowSerializer(many=True)
+        responses=FollowingSerializer(many=True)
     )
     def get(self, request, *args, **kwargs):
         """
@@ -569,44 +718,21 @@ class FollowingDetail(APIView):
         except:
             return Response(status=status.HTTP_404_NOT_FOUND)
             
-        # get that foreign author's json object first
-        print("following: foreign author url: ", foreign_author_url)
-
-        # try without the auth
-        # can either be a local author being followed or foreign server does not require auth
-        response = requests.get(foreign_author_url)
-        
-        if response.status_code != 200:
-            nodes = [x for x in Node.objects.all() if x.host_url in foreign_author_url]
-            if len(nodes) != 1:
-                raise exceptions.NotFound("cannot find the node from foreign author url")
-
-            node = nodes[0]
-            response = requests.get(foreign_author_url, auth=node.get_basic_auth_tuple())
-        
-        foreign_author_json = response.json()
-        print("following: foreign author: ", foreign_author_json)
-
-        # check for foreign author validity
-        foreign_author_ser = AuthorSerializer(data=foreign_author_json)
-
-        if foreign_author_ser.is_valid():
-            foreign_author = foreign_author_ser.save()
-
-            if Follow.objects.filter(actor=author, object=foreign_author):
-                raise exceptions.PermissionDenied("duplicate follow object exists for the authors")
+        # get that foreign author's json object first, or the cached one
+        foreign_author = get_remote_author(foreign_author_url)
 
-            follow = Follow(
-                summary=f"{author.display_name} wants to follow {foreign_author.display_name}",
-                actor=author,
-                object=foreign_author
-            )
+        if Follow.objects.filter(actor=author, object=foreign_author):
+            raise exceptions.PermissionDenied("duplicate follow object exists for the authors")
 
-            follow.save()
-            connector_service.notify_follow(follow, request=request)
-            return Response(FollowSerializer(follow).data)
+        follow = Follow(
+            summary=f"{author.display_name} wants to follow {foreign_author.display_name}",
+            actor=author,
+            object=foreign_author
+        )
 
-        return Response({'parsing foreign author': foreign_author_ser.errors}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        follow.save()
+        connector_service.notify_follow(follow, request=request)
+        return Response(FollowSerializer(follow).data)
 
     def delete(self, request, author_id, foreign_author_url):
         """
@@ -643,7 +769,7 @@ class FollowingDetail(APIView):
         request_url = request_url + '/' if not request_url.endswith('/') else request_url
         
         # try without the auth
-        response = requests.delete(request_url)
+        response = node_client.delete(request_url)
 
         if response.status_code > 204:
             try:
@@ -695,7 +821,7 @@ class ForeignAuthorList(ListAPIView):
         request_url += "authors/?page=" + str(page) + "&size=" + str(size)
 
         try:
-            response = requests.get(request_url, auth=node.get_basic_auth_tuple())
+            response = node_client.get(request_url, node=node)
         except requests.exceptions.RequestException as err:
             return Response(err, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from .models import GithubEvent
+from .models import GithubEvent, GithubFeed
 
 admin.site.register(GithubEvent)
+admin.site.register(GithubFeed)
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from github.utils import poll_due_github_feeds
+
+
+class Command(BaseCommand):
+    help = "Fetch new github events of local authors into their streams (see github/utils.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="poll the due feeds once and exit")
+        parser.add_argument('--interval', type=float, default=10.0, help="seconds to sleep when no feed is due")
+
+    def handle(self, *args, **options):
+        while True:
+            polled = poll_due_github_feeds()
+            if polled:
+                self.stdout.write(f"polled {polled} github feed(s)")
+            if options['once']:
+                break
+            if not polled:
+                time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authors', '0027_merge_20211203_0255'),
+        ('github', '0004_alter_githubevent_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GithubFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('github_url', models.URLField()),
+                ('etag', models.CharField(blank=True, default='', max_length=200)),
+                ('last_polled_at', models.DateTimeField(blank=True, null=True)),
+                ('next_poll_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='github_feed', to='authors.author')),
+            ],
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from authors.models import Author
 from authors.serializers import AuthorSerializer
 from posts.models import Post
@@ -29,8 +30,8 @@ class GithubEvent(models.Model):
     def __str__(self):
         return f"{self.username} | {self.type} | {str(self.id)}"
 
-    # create the event content based on type
-    def create_event_content(self, github_event):
+    # set event_content from the github api event, without saving. returns whether the content is set
+    def build_event_content(self, github_event):
         try:
             repo_name = github_event["repo"]["name"]
             repo_url = "https://github.com/" + repo_name
@@ -63,9 +64,10 @@ class GithubEvent(models.Model):
 
             if 'content' in locals():
                 self.event_content = content
-                self.save()
+                return True
         except:
             pass
+        return False
 
     
     # here we are creating a fake Post object to return to the front end
@@ -88,4 +90,17 @@ class GithubEvent(models.Model):
         return fake_post
 
 
+class GithubFeed(models.Model):
+    """
+    polling state of an author's github events, see github/utils.py poll_github_feed
+    """
+    author = models.OneToOneField(Author, related_name="github_feed", on_delete=models.CASCADE)
+    # the github_url the feed is polled for, the feed is reset when the author changes it
+    github_url = models.URLField()
+    # ETag of the last response, sent back as If-None-Match so unchanged events cost nothing
+    etag = models.CharField(max_length=200, blank=True, default="")
+    last_polled_at = models.DateTimeField(null=True, blank=True)
+    next_poll_at = models.DateTimeField(default=timezone.now)
 
+    def __str__(self):
+        return f"{self.author} | {self.github_url}"
@@ -1,5 +1,11 @@
 from django.test import TestCase
-from .utils import extract_username_from_url
+from django.utils import timezone
+
+from authors.models import Author
+from posts.models import StreamItem
+from social_distance.stub_peer import StubPeer
+from .models import GithubEvent, GithubFeed
+from .utils import extract_username_from_url, poll_due_github_feeds
 
 # Create your tests here.
 class GitHubTestCase(TestCase):
@@ -23,4 +29,101 @@ class GitHubTestCase(TestCase):
 
     def test_regex_with_full_path(self):
         extracted_username = extract_username_from_url(f"https://www.github.com/{self.username}/")
-        self.assertEqual(self.username, extracted_username)
\ No newline at end of file
+        self.assertEqual(self.username, extracted_username)
+
+
+class GithubFeedTestCase(TestCase):
+    EVENTS = [
+        {
+            "id": "1001",
+            "type": "WatchEvent",
+            "actor": {"login": "zhpeng811"},
+            "repo": {"name": "zhpeng811/social-distance"},
+            "payload": {},
+            "created_at": "2021-12-01T00:00:00Z"
+        },
+        {
+            "id": "1002",
+            "type": "IssuesEvent",
+            "actor": {"login": "zhpeng811"},
+            "repo": {"name": "zhpeng811/social-distance"},
+            "payload": {},
+            "created_at": "2021-12-02T00:00:00Z"
+        }
+    ]
+
+    def setUp(self):
+        self.author = Author.objects.create(id='github_author', display_name='github author',
+                                            github_url='https://github.com/zhpeng811', is_internal=True)
+        # a fake github api
+        self.github = StubPeer().start()
+        self.addCleanup(self.github.stop)
+        github_settings = self.settings(GITHUB_API_URL=self.github.url.rstrip('/'))
+        github_settings.enable()
+        self.addCleanup(github_settings.disable)
+
+    def make_due(self):
+        GithubFeed.objects.update(next_poll_at=timezone.now())
+
+    def github_requests(self):
+        return self.github.requests[('GET', 'github events')]
+
+    def test_poll_saves_events_to_stream(self):
+        self.github.github_events['zhpeng811'] = self.EVENTS
+        self.assertEqual(poll_due_github_feeds(), 1)
+
+        # unsupported event types are skipped
+        self.assertEqual(list(GithubEvent.objects.values_list('id', flat=True)), ['1001'])
+        stream_item = StreamItem.objects.get(author=self.author)
+        self.assertEqual(stream_item.kind, StreamItem.Kind.GITHUB)
+        self.assertIn('starred repo', stream_item.to_post().content)
+
+        feed = GithubFeed.objects.get(author=self.author)
+        self.assertTrue(feed.etag)
+        self.assertGreater(feed.next_poll_at, timezone.now())
+
+        # not due yet
+        self.assertEqual(poll_due_github_feeds(), 0)
+        self.assertEqual(self.github_requests(), 1)
+
+    def test_poll_sends_etag(self):
+        self.github.github_events['zhpeng811'] = self.EVENTS
+        poll_due_github_feeds()
+        etag = GithubFeed.objects.get(author=self.author).etag
+        StreamItem.objects.all().delete()
+
+        # the stub answers 304 to the etag of the same events
+        self.make_due()
+        poll_due_github_feeds()
+        self.assertEqual(self.github_requests(), 2)
+        self.assertFalse(StreamItem.objects.filter(author=self.author).exists())
+        self.assertEqual(GithubFeed.objects.get(author=self.author).etag, etag)
+
+    def test_poll_waits_for_rate_limit_reset(self):
+        self.github.github_rate_limit_reset = int(timezone.now().timestamp()) + 3600
+        poll_due_github_feeds()
+        self.assertEqual(int(GithubFeed.objects.get(author=self.author).next_poll_at.timestamp()), self.github.github_rate_limit_reset)
+
+    def test_changed_github_url_resets_feed(self):
+        self.github.github_events['zhpeng811'] = self.EVENTS
+        poll_due_github_feeds()
+        # the same events, so the etag of the old feed would get a 304
+        self.github.github_events['someone'] = self.EVENTS
+        Author.objects.filter(pk=self.author.pk).update(github_url='https://github.com/someone')
+        StreamItem.objects.all().delete()
+
+        # polled right away, without the etag of the old feed
+        poll_due_github_feeds()
+        self.assertEqual(self.github_requests(), 2)
+        self.assertTrue(StreamItem.objects.filter(author=self.author).exists())
+
+    def test_failing_feed_does_not_stop_the_others(self):
+        other = Author.objects.create(id='other_github_author', display_name='other', github_url='https://github.com/other', is_internal=True)
+        self.github.github_events['other'] = self.EVENTS
+        # not a list of events
+        self.github.github_events['zhpeng811'] = {'message': 'unexpected'}
+
+        self.assertEqual(poll_due_github_feeds(), 2)
+        self.assertTrue(StreamItem.objects.filter(author=other).exists())
+        self.assertGreater(GithubFeed.objects.get(author=self.author).next_poll_at, timezone.now())
+        self.assertEqual(poll_due_github_feeds(), 0)
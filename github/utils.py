@@ -1,8 +1,19 @@
-import requests
 import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import requests
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.db.models import F
+from django.utils import timezone
 
-from dateutil import parser
-from .models import GithubEvent
+from authors.models import Author
+from nodes.client import node_client
+from posts.models import StreamItem
+from .models import GithubEvent, GithubFeed
+
+import logging
+logger = logging.getLogger(__name__)
 
 # using the regex to extract the username part
 def extract_username_from_url(github_url):
@@ -10,55 +21,130 @@ def extract_username_from_url(github_url):
     # match object is None if no match is found
     return match.group("username") if match else ""
 
-def github_event_to_post_adapter(github_events, github_url, author):
-    objects = []
+def save_github_events(github_events, github_url):
+    """
+    save the supported events from the github api response in bulk, returns the GithubEvent objects
+    """
+    # we only support certain events
+    github_events = [event for event in github_events if event["type"] in GithubEvent.EventType]
+    existing_events = GithubEvent.objects.in_bulk([event["id"] for event in github_events])
+
+    new_events = []
     for event in github_events:
-        # we only support certain events
-        if event["type"] not in GithubEvent.EventType:
+        if event["id"] in existing_events:
             continue
+        github_event = GithubEvent(
+            id = event["id"],
+            type = event["type"],
+            username = event["actor"]["login"],
+            url = github_url,
+            time = parse_datetime(event["created_at"])
+        )
+        github_event.build_event_content(event)
+        new_events.append(github_event)
 
-        try:
-            github_event = GithubEvent.objects.get(pk=event["id"])
-        except:
-            github_event = GithubEvent.objects.create(
-                id = event["id"],
-                type = event["type"],
-                username = event["actor"]["login"],
-                url = github_url,
-                time = parser.parse(event["created_at"])
-            )
-            github_event.create_event_content(event)
-            github_event.save()
-    
-        github_event_post = github_event.event_to_post(author)
-        if github_event_post:
-            objects.append(github_event_post)
+    # events never change on github, so saving the new ones is enough
+    GithubEvent.objects.bulk_create(new_events, ignore_conflicts=True)
+    return [*existing_events.values(), *new_events]
 
-    return objects
+def add_github_events_to_stream(author, github_events):
+    StreamItem.objects.bulk_create([
+        StreamItem(author=author, kind=StreamItem.Kind.GITHUB, github_event=github_event, published=github_event.time)
+        for github_event in github_events
+    ], ignore_conflicts=True)
 
-def get_github_activity(github_url, author):
-    if github_url is None or "github.com/" not in github_url:
-        return []
-    
-    # using the regex to extract the username part
-    username = extract_username_from_url(github_url)
-    if len(username) == 0:
+def get_next_poll_time(response, now):
+    """
+    when to poll the feed again: after our poll interval or github's X-Poll-Interval, whichever is longer,
+    and not before the rate limit resets if we used it up.
+    """
+    interval = max(settings.GITHUB_POLL_INTERVAL, int(response.headers.get('X-Poll-Interval', 0)))
+    next_poll_at = now + timedelta(seconds=interval)
+
+    if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+        rate_limit_reset = datetime.fromtimestamp(int(response.headers['X-RateLimit-Reset']), tz=dt_timezone.utc)
+        next_poll_at = max(next_poll_at, rate_limit_reset)
+    return next_poll_at
+
+def poll_github_feed(feed: GithubFeed):
+    """
+    fetch the new github events of the feed's author and add them to the author's stream.
+    returns the events in the response, or an empty list if nothing changed since the last poll.
+    """
+    username = extract_username_from_url(feed.github_url)
+    now = timezone.now()
+    feed.last_polled_at = now
+    feed.next_poll_at = now + timedelta(seconds=settings.GITHUB_POLL_INTERVAL)
+
+    headers = {'Accept': 'application/vnd.github.v3+json'}
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+    if settings.GITHUB_TOKEN:
+        headers['Authorization'] = f"token {settings.GITHUB_TOKEN}"
+
+    try:
+        # Using the GitHub API to fetch the events
+        # https://docs.github.com/en/rest/reference/activity#list-public-events-for-a-user
+        # this will return the newest 30 activities by default without "per_page"
+        response = node_client.get(
+            url = f"{settings.GITHUB_API_URL}/users/{username}/events",
+            params = {"per_page": 10},
+            headers = headers
+        )
+    except requests.exceptions.RequestException as e:
+        logger.warning("cannot fetch github activity for user %s: %s", username, e)
+        feed.save()
         return []
 
-    # Using the GitHub API to fetch the events
-    # https://docs.github.com/en/rest/reference/activity#list-public-events-for-a-user
-    # this will return the newest 30 activities by default without "per_page"
-    response = requests.get(
-        url = f"https://api.github.com/users/{username}/events",
-        params = {"per_page": 10}
-    )
+    feed.next_poll_at = get_next_poll_time(response, now)
 
+    # 304: nothing changed since the ETag we sent, and it doesn't count against the rate limit
     if response.status_code != 200:
-        print(f"Cannot fetch github activity for user {username}")
-        print(f"Request returned a status code of {response.status_code}")
-        print(f"Request returned body: {response.text}")
+        if response.status_code != 304:
+            logger.warning("cannot fetch github activity for user %s: %s %s", username, response.status_code, response.text[:500])
+        feed.save()
         return []
 
-    return github_event_to_post_adapter(response.json(), github_url, author)
+    github_events = save_github_events(response.json(), feed.github_url)
+    add_github_events_to_stream(feed.author, github_events)
+
+    feed.etag = response.headers.get('ETag', '')
+    feed.save()
+    return github_events
 
-    
+def sync_github_feeds():
+    """
+    make sure every local author with a github url has a feed, and that feeds follow github url changes
+    """
+    GithubFeed.objects.exclude(author__github_url__contains="github.com/").delete()
+    for feed in GithubFeed.objects.exclude(github_url=F('author__github_url')).select_related('author'):
+        feed.github_url = feed.author.github_url
+        feed.etag = ""
+        feed.next_poll_at = timezone.now()
+        feed.save()
+
+    authors = Author.objects.filter(
+        is_internal=True, github_url__contains="github.com/", github_feed__isnull=True
+    ).values_list('id', 'github_url')
+    GithubFeed.objects.bulk_create([
+        GithubFeed(author_id=author_id, github_url=github_url) for author_id, github_url in authors
+    ], ignore_conflicts=True)
+
+def poll_due_github_feeds(limit=100):
+    """
+    run one pass of the poller, returns the number of feeds polled
+    """
+    sync_github_feeds()
+    feeds = list(GithubFeed.objects.filter(next_poll_at__lte=timezone.now()).select_related('author').order_by('next_poll_at')[:limit])
+    for feed in feeds:
+        try:
+            poll_github_feed(feed)
+        except Exception:
+            # e.g. an unexpected response body: the other feeds are still polled,
+            # and this one is retried after the interval instead of first in every pass
+            logger.exception("cannot poll the github feed of author %s", feed.author_id)
+            now = timezone.now()
+            GithubFeed.objects.filter(pk=feed.pk).update(
+                last_polled_at=now, next_poll_at=now + timedelta(seconds=settings.GITHUB_POLL_INTERVAL)
+            )
+    return len(feeds)
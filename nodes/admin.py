@@ -2,4 +2,6 @@ from django.contrib import admin
 
 from .models import *
 # Register your models here.
-admin.site.register(Node)
\ No newline at end of file
+admin.site.register(Node)
+admin.site.register(DeliveryJob)
+admin.site.register(InboxDelivery)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NodesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'nodes'
+
+    def ready(self):
+        # register the signal receivers
+        from . import signals
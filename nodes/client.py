@@ -0,0 +1,74 @@
+"""
+HTTP client for every request we make to other servers (foreign nodes, GitHub...).
+
+Each (host, node) pair gets its own requests.Session, so connections are pooled and kept alive
+between requests, the node's basic auth is attached once, and every request has a timeout.
+"""
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from social_distance.metrics import track_outbound_request
+
+
+class NodeClient:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _create_session(self):
+        retry = Retry(
+            total=settings.NODE_CLIENT_RETRIES,
+            backoff_factor=settings.NODE_CLIENT_BACKOFF_FACTOR,
+            status_forcelist=[502, 503, 504],
+            # POST is not idempotent, failed inbox POSTs are retried by the delivery queue instead
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.NODE_CLIENT_POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_session(self, url, node=None):
+        """
+        get the session for the host of the url, authenticated as us on the node if it's given.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc, node.pk if node else None)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = self._create_session()
+        if node:
+            # credentials could have been changed in the admin page since the session is created
+            session.auth = node.get_basic_auth_tuple()
+        return session
+
+    def request(self, method, url, node=None, **kwargs):
+        kwargs.setdefault('timeout', (settings.NODE_CLIENT_CONNECT_TIMEOUT, settings.NODE_CLIENT_READ_TIMEOUT))
+        session = self.get_session(url, node)
+        with track_outbound_request():
+            return session.request(method, url, **kwargs)
+
+    def get(self, url, node=None, **kwargs):
+        return self.request('GET', url, node=node, **kwargs)
+
+    def post(self, url, node=None, **kwargs):
+        return self.request('POST', url, node=node, **kwargs)
+
+    def delete(self, url, node=None, **kwargs):
+        return self.request('DELETE', url, node=node, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+node_client = NodeClient()
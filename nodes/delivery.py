@@ -0,0 +1,236 @@
+"""
+worker side of the post delivery queue.
+
+ConnectorService.notify_post only records a DeliveryJob. This module picks the jobs up
+(see the `deliver_posts` management command), expands each of them into one InboxDelivery
+per foreign inbox, and sends the deliveries concurrently, one request per node where the node
+accepts batches.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from posts.serializers import PostSerializer
+
+from .client import node_client
+from .models import ConnectorService, DeliveryJob, InboxDelivery, Node, connector_service
+from .resolver import resolve_node
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def expand_job(job: DeliveryJob):
+    """
+    create the InboxDelivery objects of a pending job.
+    local targets are saved to their inbox right away, since it is only a database write.
+    """
+    target_users = job.targets.all() or connector_service.get_target_users_for_post(job.post)
+
+    deliveries = []
+    for follower in target_users:
+        try:
+            inbox_url, host_url, author_url = ConnectorService.get_inbox_and_host_from_url(follower.url)
+        except APIException as e:
+            # e.g. a foreign author url without author/<id>/, the other targets still get the post
+            logger.warning("delivery job %s: skipping %s: %s", job.pk, follower.url, e)
+            continue
+        if not ConnectorService._same_domain_and_save_to_inbox(job.local_host, host_url, inbox_item=job.post, inbox_author=follower):
+            deliveries.append(InboxDelivery(job=job, author_url=author_url, inbox_url=inbox_url, host_url=host_url))
+
+    with transaction.atomic():
+        InboxDelivery.objects.bulk_create(deliveries)
+        job.status = DeliveryJob.Status.EXPANDED if deliveries else DeliveryJob.Status.DONE
+        job.save()
+
+
+def get_nodes_for_hosts(host_urls):
+    """
+    find the nodes of all the given host urls. returns {host_url: Node or None}
+    """
+    return {host_url: resolve_node(host_url) for host_url in host_urls}
+
+
+def group_deliveries(deliveries, nodes):
+    """
+    split deliveries into the requests that will be sent: a node with a batch inbox gets one request
+    per batch_inbox_max_items of its inboxes, every other inbox gets its own request.
+    returns a list of (deliveries, node)
+    """
+    deliveries_by_host = {}
+    for delivery in deliveries:
+        deliveries_by_host.setdefault(delivery.host_url, []).append(delivery)
+
+    groups = []
+    for host_url, host_deliveries in deliveries_by_host.items():
+        node = nodes.get(host_url)
+        if node is not None and node.batch_inbox_url and len(host_deliveries) > 1:
+            max_items = node.batch_inbox_max_items or settings.BATCH_INBOX_MAX_ITEMS
+            groups.extend((host_deliveries[i:i + max_items], node) for i in range(0, len(host_deliveries), max_items))
+        else:
+            groups.extend(([delivery], node) for delivery in host_deliveries)
+    return groups
+
+
+def send_deliveries(deliveries, node: Node, data):
+    """
+    POST the serialized post to the deliveries' inboxes, in a single request when there are many.
+    Runs on a worker thread, so it must not touch the database.
+
+    The batched request body is {"type": "inboxes", "object": <post>, "items": [{"author": <author url>}, ...]},
+    see authors.views.BatchInboxView for the receiving side.
+
+    returns the error message of each delivery, None where the foreign server accepted the post.
+    """
+    if node is None:
+        return [f"cannot find the node for host {deliveries[0].host_url}"] * len(deliveries)
+
+    if len(deliveries) == 1:
+        request_url, body = deliveries[0].inbox_url, data
+    else:
+        request_url = node.batch_inbox_url
+        body = {
+            'type': 'inboxes',
+            'object': data,
+            'items': [{'author': delivery.author_url} for delivery in deliveries]
+        }
+
+    try:
+        response = node_client.post(request_url, node=node, json=body)
+    except requests.exceptions.RequestException as e:
+        return [str(e)] * len(deliveries)
+    if response.status_code >= 400:
+        return [f"{response.status_code}: {response.text[:500]}"] * len(deliveries)
+    if len(deliveries) == 1:
+        return [None]
+    return get_batch_errors(response, deliveries)
+
+
+def get_batch_errors(response, deliveries):
+    """
+    the error of each delivery from the per item results of a batch inbox response:
+    {"items": [{"author", "status", "errors"}, ...]} in the order of the request
+    """
+    try:
+        results = response.json().get('items')
+    except (ValueError, AttributeError):
+        results = None
+    if not isinstance(results, list) or len(results) != len(deliveries):
+        # no per item results, the whole batch was accepted
+        return [None] * len(deliveries)
+
+    errors = []
+    for result in results:
+        item_status = result.get('status') if isinstance(result, dict) else None
+        if isinstance(item_status, int) and item_status >= 400:
+            errors.append(f"{item_status}: {str(result.get('errors', ''))[:500]}")
+        else:
+            errors.append(None)
+    return errors
+
+
+def record_attempt(delivery: InboxDelivery, error, now):
+    delivery.attempts += 1
+    if error is None:
+        delivery.status = InboxDelivery.Status.SENT
+        delivery.last_error = ""
+        return
+
+    logger.warning("delivery to %s failed: %s", delivery.inbox_url, error)
+    delivery.last_error = error
+    if delivery.attempts >= settings.DELIVERY_MAX_ATTEMPTS:
+        delivery.status = InboxDelivery.Status.FAILED
+    else:
+        # exponential backoff: 1, 2, 4, 8... minutes
+        delivery.next_attempt_at = now + timedelta(minutes=2 ** (delivery.attempts - 1))
+
+
+def claim_deliveries(job: DeliveryJob, now):
+    """
+    the deliveries of the job that are due, leased for DELIVERY_CLAIM_TIMEOUT seconds
+    so that concurrent workers skip them while they are being sent.
+    must be called inside the transaction that claimed the job.
+    """
+    deliveries = list(job.deliveries.filter(status=InboxDelivery.Status.PENDING, next_attempt_at__lte=now))
+    lease = now + timedelta(seconds=settings.DELIVERY_CLAIM_TIMEOUT)
+    InboxDelivery.objects.filter(pk__in=[delivery.pk for delivery in deliveries]).update(next_attempt_at=lease)
+    return deliveries
+
+
+def send_pending_deliveries(job: DeliveryJob, deliveries, executor: ThreadPoolExecutor):
+    """
+    send the claimed deliveries of an expanded job, save their results, and mark the job done once nothing is left to send.
+    runs outside of the claiming transaction, so no row is locked during the requests.
+
+    the post is serialized once and each node is looked up once, no matter how many followers are on it.
+    """
+    now = timezone.now()
+    data = ConnectorService._clean_inbox_data(PostSerializer(job.post, context={'inline_images': True}).data)
+
+    nodes = get_nodes_for_hosts({delivery.host_url for delivery in deliveries})
+    groups = group_deliveries(deliveries, nodes)
+    group_errors = executor.map(lambda group: send_deliveries(*group, data), groups)
+
+    for (requested_deliveries, _), errors in zip(groups, group_errors):
+        for delivery, error in zip(requested_deliveries, errors):
+            record_attempt(delivery, error, now)
+
+    with transaction.atomic():
+        InboxDelivery.objects.bulk_update(deliveries, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+        if not job.deliveries.filter(status=InboxDelivery.Status.PENDING).exists():
+            job.status = DeliveryJob.Status.DONE
+            job.save()
+
+
+def claim_jobs(status, limit):
+    """
+    lock a batch of jobs so that concurrent workers do not process the same ones,
+    only the ones with a delivery that is due for expanded jobs.
+    must be called inside a transaction.
+    """
+    jobs = DeliveryJob.objects.select_for_update(skip_locked=True).filter(status=status)
+    if status == DeliveryJob.Status.EXPANDED:
+        due_deliveries = InboxDelivery.objects.filter(
+            job=OuterRef('pk'), status=InboxDelivery.Status.PENDING, next_attempt_at__lte=timezone.now()
+        )
+        jobs = jobs.filter(Exists(due_deliveries))
+    return list(jobs.select_related('post__author').order_by('created_at')[:limit])
+
+
+def process_jobs(batch_size=None, max_workers=None):
+    """
+    run one pass of the worker: expand pending jobs, then send what is due.
+    returns the number of jobs expanded plus the number of deliveries sent, 0 when nothing was due.
+    """
+    batch_size = batch_size or settings.DELIVERY_BATCH_SIZE
+    max_workers = max_workers or settings.DELIVERY_WORKERS
+
+    with transaction.atomic():
+        pending_jobs = claim_jobs(DeliveryJob.Status.PENDING, batch_size)
+        for job in pending_jobs:
+            try:
+                # a savepoint per job, so one job that can't be expanded does not stop the queue
+                with transaction.atomic():
+                    expand_job(job)
+            except Exception:
+                logger.exception("delivery job %s could not be expanded", job.pk)
+                DeliveryJob.objects.filter(pk=job.pk).update(status=DeliveryJob.Status.FAILED)
+
+    # a short transaction to claim the due deliveries, the requests are sent after it commits
+    with transaction.atomic():
+        now = timezone.now()
+        claimed = [(job, claim_deliveries(job, now)) for job in claim_jobs(DeliveryJob.Status.EXPANDED, batch_size)]
+
+    sent = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for job, deliveries in claimed:
+            send_pending_deliveries(job, deliveries, executor)
+            sent += len(deliveries)
+
+    return len(pending_jobs) + sent
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from nodes.delivery import process_jobs
+
+
+class Command(BaseCommand):
+    help = "Send queued posts to the inboxes of their receivers (see nodes/delivery.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="process the queue once and exit")
+        parser.add_argument('--interval', type=float, default=2.0, help="seconds to sleep when nothing is due")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_jobs()
+            if processed:
+                self.stdout.write(f"expanded or sent {processed} job(s) and deliveries")
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_is_github'),
+        ('authors', '0027_merge_20211203_0255'),
+        ('nodes', '0003_alter_node_host_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('local_host', models.CharField(max_length=500)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('EXPANDED', 'Expanded'), ('DONE', 'Done')], default='PENDING', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_jobs', to='posts.post')),
+                ('targets', models.ManyToManyField(blank=True, related_name='_nodes_deliveryjob_targets_+', to='authors.Author')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InboxDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inbox_url', models.URLField(max_length=500)),
+                ('host_url', models.URLField(max_length=500)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='PENDING', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='nodes.deliveryjob')),
+            ],
+        ),
+    ]
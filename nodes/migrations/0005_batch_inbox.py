@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0004_delivery_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxdelivery',
+            name='author_url',
+            field=models.URLField(default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='batch_inbox_url',
+            field=models.URLField(blank=True, default='', max_length=500),
+        ),
+    ]
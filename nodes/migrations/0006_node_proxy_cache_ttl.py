@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0005_batch_inbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='proxy_cache_ttl',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
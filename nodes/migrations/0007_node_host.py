@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:48
+
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+
+
+def set_node_hosts(apps, schema_editor):
+    Node = apps.get_model('nodes', 'Node')
+    for node in Node.objects.all():
+        node.host = urlsplit(node.host_url.strip()).netloc.lower()
+        node.save(update_fields=['host'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0006_node_proxy_cache_ttl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='host',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(set_node_hosts, migrations.RunPython.noop),
+    ]
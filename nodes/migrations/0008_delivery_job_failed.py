@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0007_node_host'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryjob',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('EXPANDED', 'Expanded'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=20),
+        ),
+    ]
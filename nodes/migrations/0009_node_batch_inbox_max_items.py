@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nodes', '0008_delivery_job_failed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='batch_inbox_max_items',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,10 @@
 import functools
 import re
-from django.db import models
+from urllib.parse import urlsplit
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.db.models.query_utils import Q
+from django.utils import timezone
 from typing import List
 
 import requests
@@ -10,6 +12,7 @@ from requests.models import HTTPBasicAuth, Response
 from requests import Request
 from rest_framework import exceptions
 from authors.models import Author, Follow, InboxObject
+from nodes.client import node_client
 from authors.serializers import FollowSerializer
 
 from posts.models import Comment, Like, Post
@@ -18,7 +21,8 @@ from posts.serializers import LikeSerializer, PostSerializer
 import logging
 logger = logging.getLogger(__name__)
 
-global_session = requests.Session()
+# matches the host and author part of any url under an author, e.g. http://host/author/<id>/posts/<id>/
+AUTHOR_URL_PATTERN = re.compile(r'(http[s]?:\/\/[^/]+.*)(author\/[^/]+\/)')
     
 # Create your models here.
 class Node(models.Model):
@@ -26,6 +30,8 @@ class Node(models.Model):
     name = models.CharField(max_length=200, default="foreign_server")
 
     host_url = models.URLField(max_length=500)
+    # host of host_url, lowercased (e.g. "example.com:8000"), used to find the node of a url. see nodes/resolver.py
+    host = models.CharField(max_length=255, db_index=True, editable=False, default="")
     # username and password that they use, as a client, to be authenticated in our server
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True) # one2one with django user
 
@@ -33,6 +39,14 @@ class Node(models.Model):
     username = models.CharField(max_length=200) 
     password = models.CharField(max_length=200) 
 
+    # if the node accepts objects for many of its inboxes in a single request, the url to send them to.
+    # see nodes/delivery.py for the payload format
+    batch_inbox_url = models.URLField(max_length=500, blank=True, default="")
+    # most inboxes sent to batch_inbox_url in a single request, BATCH_INBOX_MAX_ITEMS if not set
+    batch_inbox_max_items = models.PositiveIntegerField(null=True, blank=True)
+    # seconds the proxy caches objects fetched from the node, PROXY_CACHE_TTL if not set. see nodes/proxy.py
+    proxy_cache_ttl = models.PositiveIntegerField(null=True, blank=True)
+
     def __str__(self):
         return self.name + " (" + str(self.id) + ")"
 
@@ -42,6 +56,60 @@ class Node(models.Model):
     def get_basic_auth_tuple(self):
         return (self.username, self.password)
 
+    @staticmethod
+    def get_host(url):
+        return urlsplit(url.strip()).netloc.lower()
+
+    def save(self, *args, **kwargs):
+        self.host = Node.get_host(self.host_url)
+        super().save(*args, **kwargs)
+
+class DeliveryJob(models.Model):
+    """
+    A post waiting to be sent to the inboxes of its target authors.
+
+    Created by ConnectorService.notify_post while handling the request, and expanded into
+    InboxDelivery objects by the delivery worker (see nodes/delivery.py).
+    """
+    class Status(models.TextChoices):
+        PENDING = "PENDING"
+        EXPANDED = "EXPANDED"
+        DONE = "DONE"
+        # could not be expanded, see the worker's log
+        FAILED = "FAILED"
+
+    post = models.ForeignKey(Post, related_name="delivery_jobs", on_delete=models.CASCADE)
+    # domain of the request that created the job, used to tell local inboxes from foreign ones
+    local_host = models.CharField(max_length=500)
+    # explicit receivers of the post, the post's followers/friends are used if empty
+    targets = models.ManyToManyField(Author, blank=True, related_name="+")
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.post} | {self.status} | {self.created_at}"
+
+class InboxDelivery(models.Model):
+    """
+    A single POST of a DeliveryJob's post to a foreign inbox.
+    """
+    class Status(models.TextChoices):
+        PENDING = "PENDING"
+        SENT = "SENT"
+        FAILED = "FAILED"
+
+    job = models.ForeignKey(DeliveryJob, related_name="deliveries", on_delete=models.CASCADE)
+    author_url = models.URLField(max_length=500, default="")
+    inbox_url = models.URLField(max_length=500)
+    host_url = models.URLField(max_length=500)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"{self.inbox_url} | {self.status} | {self.attempts}"
+
 # https://stackoverflow.com/a/24025175
 # catch all request error and just print them out instead
 def silent_500(fn):
@@ -75,7 +143,7 @@ class ConnectorService:
     def get_inbox_and_host_from_url(url):
         if url and url[-1] != '/':
             url = url + '/'
-        url_results = re.findall(r'(http[s]?:\/\/[^/]+.*)(author\/[^/]+\/)', url)
+        url_results = AUTHOR_URL_PATTERN.findall(url)
         if len(url_results) != 1:
             raise exceptions.APIException(f"cannot match the author endpoint from the url: {url}")
         host, author_path = url_results[0]
@@ -103,7 +171,12 @@ class ConnectorService:
             # get the actual url of the author
             return cached_author.url
 
-        if 'comment' in like.object:
+        # the liked object is resolved when the like is saved, the urls are only parsed for older likes
+        if like.comment:
+            author_some_url = like.comment.post.author.url
+        elif like.post:
+            author_some_url = like.post.source
+        elif 'comment' in like.object:
             author_some_url = get_commenter_url(like)
         else:
             author_some_url = get_poster_url(like)
@@ -117,14 +190,15 @@ class ConnectorService:
 
     @silent_500
     def notify_post(self, post: Post, request: Request = None, targets: List[Author] = None):
-        # get all follwers and their endpoints
-        target_users = targets or self.get_target_users_for_post(post)
-
-        # post the post to each of the followers' inboxes
-        for follower in target_users:
-            inbox_url, host_url, _ = self.get_inbox_and_host_from_url(follower.url)
-            if not self._same_host_and_save_to_inbox(request, host_url, inbox_item=post, inbox_author=follower):
-                self._find_node_and_post_to_inbox(inbox_url, host_url, PostSerializer(post).data)
+        """
+        queue the post for delivery to the followers' (or the given targets') inboxes.
+        the actual sending is done by the delivery worker, see nodes/delivery.py
+        """
+        with transaction.atomic():
+            job = DeliveryJob.objects.create(post=post, local_host=request.get_host())
+            if targets:
+                job.targets.set(targets)
+        return job
 
     @silent_500
     def notify_follow(self, follow: Follow, request=None):
@@ -144,6 +218,14 @@ class ConnectorService:
         If inbox_author_url is given, we grab that local author if needed. Use it as inbox_author instead.
         """
         domain = request.get_host() # points to the server root
+        return ConnectorService._same_domain_and_save_to_inbox(domain, host_url, inbox_author_url, inbox_item, inbox_author)
+
+    @staticmethod
+    def _same_domain_and_save_to_inbox(domain, host_url, inbox_author_url=None, inbox_item=None, inbox_author=None):
+        """
+        same as _same_host_and_save_to_inbox, but with the domain given directly,
+        for callers outside of a request like the delivery worker.
+        """
         if domain in host_url:
             # find the local inbox author
             local_inbox_author = Author.objects.get(Q(url=inbox_author_url) | Q(url=inbox_author_url[:-1])) if inbox_author_url else None
@@ -154,20 +236,30 @@ class ConnectorService:
         else:
             return False
 
+    @staticmethod
+    def _clean_inbox_data(data):
+        """
+        strip the fields that are only meaningful to us before sending an object to a foreign inbox
+        """
+        # likeCount and liked are the counts of our request user, the foreign server counts its own likes
+        for field in ('inbox_object', 'status', 'likeCount', 'liked'):
+            data.pop(field, None)
+        if data.get('type', '').lower() == 'post':
+            data['categories'] = ['post']
+        return data
+
     @staticmethod
     @silent_500
     def _find_node_and_post_to_inbox(inbox_url, host_url, data):
         # find the node that matches the url
-        node: Node = Node.objects.get(Q(host_url=host_url) | Q(host_url=host_url[:-1]))
+        from .resolver import resolve_node
+        node = resolve_node(host_url)
+        if node is None:
+            raise Node.DoesNotExist(f"no node for {host_url}")
         # post the data to the inbox on the node
-        if "inbox_object" in data:
-            del data["inbox_object"]
-        if "status" in data:
-            del data["status"]    
-        if data.get('type', '').lower() == 'post':
-            data['categories'] = ['post']
+        data = ConnectorService._clean_inbox_data(data)
 
-        response = global_session.post(inbox_url, json=data, auth=node.get_basic_auth())
+        response = node_client.post(inbox_url, node=node, json=data)
         print("request_url: ", inbox_url)
         print("data:", data)
         print("response: ", response)
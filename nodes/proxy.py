@@ -0,0 +1,121 @@
+"""
+Cache in front of the proxy view (authors.views.proxy), which fetches objects from other servers for the frontend.
+
+- responses are cached by url and requesting user, for the node's proxy_cache_ttl (PROXY_CACHE_TTL by default)
+- 404 and 5xx responses and unreachable servers are cached too, for PROXY_NEGATIVE_CACHE_TTL
+- identical requests made at the same time share a single fetch
+"""
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import exceptions
+
+from posts.utils import try_get
+from .resolver import resolve_node
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    collapse concurrent calls with the same key into one, the other callers wait for its result
+    """
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = SingleFlight.Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+proxy_flight = SingleFlight()
+
+
+def normalize_url(url):
+    # same object for e.g. HTTP://Host/author/1/ and http://host/author/1
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+
+def get_cache_key(url, user):
+    identity = user.pk if user and user.is_authenticated else 'anonymous'
+    return 'proxy:' + hashlib.sha256(f"{identity}:{normalize_url(url)}".encode()).hexdigest()
+
+
+def get_cache_ttl(url):
+    node = resolve_node(url)
+    if node is None or node.proxy_cache_ttl is None:
+        return settings.PROXY_CACHE_TTL
+    return node.proxy_cache_ttl
+
+
+def fetch(url):
+    """
+    (status code, json) of the object at the url, errors included
+    """
+    try:
+        response = try_get(url)
+    except requests.exceptions.RequestException as e:
+        logger.warning("proxy: cannot reach %s: %s", url, e)
+        return 504, {'detail': 'the remote server did not respond'}
+    except exceptions.NotFound as e:
+        # the server did not answer without auth, and it's not a node we have credentials for
+        return 404, {'detail': str(e.detail)}
+
+    try:
+        return response.status_code, response.json()
+    except ValueError:
+        if response.status_code >= 400:
+            return response.status_code, {'detail': response.text[:500]}
+        raise exceptions.ParseError("remote server response is not valid json")
+
+
+def get_proxied_object(url, user=None):
+    """
+    (status code, json) of the object at the url, from the cache if possible
+    """
+    key = get_cache_key(url, user)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    def fetch_and_cache():
+        status_code, data = fetch(url)
+        if status_code == 404 or status_code >= 500:
+            cache.set(key, (status_code, data), settings.PROXY_NEGATIVE_CACHE_TTL)
+        elif status_code < 300:
+            cache.set(key, (status_code, data), get_cache_ttl(url))
+        return status_code, data
+
+    return proxy_flight.do(key, fetch_and_cache)
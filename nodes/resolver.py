@@ -0,0 +1,54 @@
+"""
+In-process cache finding the node of a url, shared by every request to other nodes.
+
+Nodes are looked up by their normalized host (Node.host, indexed) and kept in memory per host,
+found or not. The cache is cleared when a node is saved or deleted (see nodes/signals.py), and
+every NODE_RESOLVER_TTL seconds to pick up changes made by other processes.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Node
+
+
+class NodeResolver:
+    def __init__(self):
+        self._nodes_by_host = {}
+        self._loaded_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._nodes_by_host = {}
+            self._loaded_at = time.monotonic()
+
+    def get_host_nodes(self, host):
+        if time.monotonic() - self._loaded_at > settings.NODE_RESOLVER_TTL:
+            self.clear()
+        nodes_by_host = self._nodes_by_host
+        nodes = nodes_by_host.get(host)
+        if nodes is None:
+            # the longest host url first, for nodes sharing a host under different paths
+            nodes = sorted(Node.objects.filter(host=host), key=lambda node: len(node.host_url), reverse=True)
+            nodes_by_host[host] = nodes
+        return nodes
+
+    def resolve(self, url):
+        """
+        the node serving the url, None if it's not a node's url
+        """
+        nodes = self.get_host_nodes(Node.get_host(url))
+        url = url.strip().lower()
+        for node in nodes:
+            if url.startswith(node.host_url.lower().rstrip('/')):
+                return node
+        # e.g. http vs https, still the node's host
+        return nodes[0] if len(nodes) == 1 else None
+
+node_resolver = NodeResolver()
+
+
+def resolve_node(url):
+    return node_resolver.resolve(url)
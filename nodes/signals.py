@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Node
+from .resolver import node_resolver
+
+
+# nodes are cached by the resolver, forget them when they change
+
+@receiver(post_save, sender=Node)
+@receiver(post_delete, sender=Node)
+def clear_node_resolver(sender, **kwargs):
+    node_resolver.clear()
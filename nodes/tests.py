@@ -1,13 +1,24 @@
 
 import json
+import threading
+import time
 import uuid
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase, Client
-from rest_framework.test import APIClient
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
 from django.db.utils import IntegrityError
 
 from django.contrib.auth.models import User
-from authors.models import Author
-from nodes.models import ConnectorService, connector_service
+from authors.models import Author, Follow, InboxObject
+from nodes.client import NodeClient
+from nodes import delivery
+from nodes.delivery import process_jobs
+from nodes.proxy import get_proxied_object
+from nodes.resolver import node_resolver, resolve_node
+from nodes.models import ConnectorService, DeliveryJob, InboxDelivery, Node, connector_service
 from posts.models import Post, Comment, Like
 
 # Create your tests here.
@@ -26,4 +37,296 @@ class NodeTestCase(TestCase):
     def test_get_host_url_from_longer_url(self):
         host_url = "http://somehost/"
         post = host_url + "author/9de17f29c12e8f97bcbbd34cc908f1baba40658e/posts/764efa883dda1e11db47671c4a3bbd9e/"
-        self.assertEqual(ConnectorService.get_inbox_and_host_from_url(post)[1], host_url)
\ No newline at end of file
+        self.assertEqual(ConnectorService.get_inbox_and_host_from_url(post)[1], host_url)
+
+    def test_clean_inbox_data(self):
+        data = ConnectorService._clean_inbox_data({
+            'type': 'post', 'title': 'title', 'inbox_object': 'id', 'status': 'PENDING', 'likeCount': 2, 'liked': True
+        })
+        self.assertEqual(data, {'type': 'post', 'title': 'title', 'categories': ['post']})
+
+class DeliveryQueueTestCase(TestCase):
+    def setUp(self):
+        self.author = Author.objects.create(id='poster', url='http://testserver/author/poster', host='http://testserver/', display_name='poster', is_internal=True)
+        self.local_follower = Author.objects.create(id='local', url='http://testserver/author/local', host='http://testserver/', display_name='local', is_internal=True)
+        self.foreign_follower = Author.objects.create(id='foreign', url='http://foreign.example/author/foreign', host='http://foreign.example/', display_name='foreign')
+        for follower in [self.local_follower, self.foreign_follower]:
+            Follow.objects.create(object=self.author, actor=follower, status=Follow.FollowStatus.ACCEPTED)
+        self.node = Node.objects.create(host_url='http://foreign.example/', username='user', password='pass')
+        self.post = Post.objects.create(author=self.author, title='title', content='content', url='http://testserver/author/poster/posts/1')
+        self.request = APIRequestFactory().get('/')
+
+    def mock_response(self, status_code):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.text = ''
+        return response
+
+    def test_notify_post_only_queues(self):
+        with mock.patch('nodes.delivery.node_client.post') as session_post:
+            job = connector_service.notify_post(self.post, request=self.request)
+            session_post.assert_not_called()
+        self.assertEqual(job.status, DeliveryJob.Status.PENDING)
+        self.assertEqual(InboxObject.objects.count(), 0)
+
+    def test_process_jobs_delivers_to_all_followers(self):
+        job = connector_service.notify_post(self.post, request=self.request)
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            process_jobs()
+        session_post.assert_called_once()
+        self.assertEqual(session_post.call_args[0][0], 'http://foreign.example/author/foreign/inbox/')
+
+        self.assertEqual(InboxObject.objects.get().author, self.local_follower)
+        self.assertEqual(InboxDelivery.objects.get().status, InboxDelivery.Status.SENT)
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJob.Status.DONE)
+
+    def test_process_jobs_retries_failed_delivery(self):
+        job = connector_service.notify_post(self.post, request=self.request, targets=[self.foreign_follower])
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(500)):
+            process_jobs()
+        delivery = InboxDelivery.objects.get()
+        self.assertEqual(delivery.status, InboxDelivery.Status.PENDING)
+        self.assertEqual(delivery.attempts, 1)
+        self.assertGreater(delivery.next_attempt_at, timezone.now())
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJob.Status.EXPANDED)
+
+    def test_process_jobs_skips_jobs_in_backoff(self):
+        connector_service.notify_post(self.post, request=self.request, targets=[self.foreign_follower])
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(500)) as session_post:
+            self.assertEqual(process_jobs(), 2)
+            # nothing is due until the backoff is over, so the worker can sleep
+            self.assertEqual(process_jobs(), 0)
+        session_post.assert_called_once()
+
+        InboxDelivery.objects.update(next_attempt_at=timezone.now())
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            self.assertEqual(process_jobs(), 1)
+        session_post.assert_called_once()
+        self.assertEqual(InboxDelivery.objects.get().status, InboxDelivery.Status.SENT)
+
+    def test_unparsable_target_is_skipped(self):
+        bad_follower = Author.objects.create(id='bad', url='http://foreign.example/people/bad', host='http://foreign.example/', display_name='bad')
+        job = connector_service.notify_post(self.post, request=self.request, targets=[bad_follower, self.foreign_follower])
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            process_jobs()
+        session_post.assert_called_once()
+        self.assertEqual(session_post.call_args[0][0], 'http://foreign.example/author/foreign/inbox/')
+        job.refresh_from_db()
+        self.assertEqual(job.status, DeliveryJob.Status.DONE)
+
+    def test_failed_job_does_not_stop_the_queue(self):
+        broken_job = connector_service.notify_post(self.post, request=self.request, targets=[self.foreign_follower])
+        job = connector_service.notify_post(self.post, request=self.request, targets=[self.foreign_follower])
+        expand_job = delivery.expand_job
+
+        def expand_or_fail(claimed_job):
+            if claimed_job.pk == broken_job.pk:
+                raise ValueError('broken')
+            return expand_job(claimed_job)
+
+        with mock.patch('nodes.delivery.expand_job', side_effect=expand_or_fail), \
+                mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            process_jobs()
+        session_post.assert_called_once()
+        broken_job.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual(broken_job.status, DeliveryJob.Status.FAILED)
+        self.assertEqual(job.status, DeliveryJob.Status.DONE)
+
+    def test_claimed_deliveries_are_skipped_by_other_workers(self):
+        connector_service.notify_post(self.post, request=self.request, targets=[self.foreign_follower])
+        send_pending_deliveries = delivery.send_pending_deliveries
+
+        def send_while_claimed(*args):
+            # another pass while the claimed deliveries are being sent finds nothing due
+            self.assertEqual(process_jobs(), 0)
+            return send_pending_deliveries(*args)
+
+        with mock.patch('nodes.delivery.send_pending_deliveries', side_effect=send_while_claimed), \
+                mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            process_jobs()
+        session_post.assert_called_once()
+        self.assertEqual(InboxDelivery.objects.get().status, InboxDelivery.Status.SENT)
+
+    def test_process_jobs_batches_inboxes_on_same_node(self):
+        second_foreign_follower = Author.objects.create(id='foreign2', url='http://foreign.example/author/foreign2', host='http://foreign.example/', display_name='foreign2')
+        Follow.objects.create(object=self.author, actor=second_foreign_follower, status=Follow.FollowStatus.ACCEPTED)
+        self.node.batch_inbox_url = 'http://foreign.example/inbox/'
+        self.node.save()
+
+        connector_service.notify_post(self.post, request=self.request)
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            process_jobs()
+        session_post.assert_called_once()
+        request_url, = session_post.call_args[0]
+        body = session_post.call_args[1]['json']
+        self.assertEqual(request_url, 'http://foreign.example/inbox/')
+        self.assertEqual(body['type'], 'inboxes')
+        # the post is sent once for all the inboxes
+        self.assertEqual(body['object']['title'], 'title')
+        self.assertEqual(
+            sorted(item['author'] for item in body['items']),
+            ['http://foreign.example/author/foreign/', 'http://foreign.example/author/foreign2/']
+        )
+        self.assertFalse(InboxDelivery.objects.exclude(status=InboxDelivery.Status.SENT).exists())
+
+    def add_foreign_followers(self, count):
+        for i in range(count):
+            follower = Author.objects.create(id=f'extra{i}', url=f'http://foreign.example/author/extra{i}', host='http://foreign.example/', display_name=f'extra{i}')
+            Follow.objects.create(object=self.author, actor=follower, status=Follow.FollowStatus.ACCEPTED)
+
+    def test_batches_are_split_at_the_node_limit(self):
+        self.add_foreign_followers(4)
+        self.node.batch_inbox_url = 'http://foreign.example/inbox/'
+        self.node.batch_inbox_max_items = 2
+        self.node.save()
+
+        connector_service.notify_post(self.post, request=self.request)
+        with mock.patch('nodes.delivery.node_client.post', return_value=self.mock_response(200)) as session_post:
+            process_jobs()
+        # 5 foreign followers: 2 batches of 2, and the last one on its own inbox
+        batch_sizes = sorted(len(call[1]['json'].get('items', [None])) for call in session_post.call_args_list)
+        self.assertEqual(batch_sizes, [1, 2, 2])
+        self.assertFalse(InboxDelivery.objects.exclude(status=InboxDelivery.Status.SENT).exists())
+
+    def test_batch_item_errors_are_retried(self):
+        self.add_foreign_followers(1)
+        self.node.batch_inbox_url = 'http://foreign.example/inbox/'
+        self.node.save()
+
+        def post_batch(url, node=None, json=None):
+            response = self.mock_response(200)
+            response.json.return_value = {'type': 'inboxes', 'items': [
+                {'author': item['author'], 'status': 404 if 'extra' in item['author'] else 201, 'errors': 'author not found'}
+                for item in json['items']
+            ]}
+            return response
+
+        connector_service.notify_post(self.post, request=self.request)
+        with mock.patch('nodes.delivery.node_client.post', side_effect=post_batch):
+            process_jobs()
+        self.assertEqual(InboxDelivery.objects.get(author_url='http://foreign.example/author/foreign/').status, InboxDelivery.Status.SENT)
+        failed = InboxDelivery.objects.get(author_url='http://foreign.example/author/extra0/')
+        self.assertEqual(failed.status, InboxDelivery.Status.PENDING)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('404', failed.last_error)
+
+
+class NodeClientTestCase(TestCase):
+    def setUp(self):
+        self.client = NodeClient()
+        self.node = Node.objects.create(host_url='http://foreign.example/', username='user', password='pass')
+
+    def test_session_is_reused_per_host(self):
+        session = self.client.get_session('http://foreign.example/author/1/')
+        self.assertIs(session, self.client.get_session('http://foreign.example/author/2/inbox/'))
+        self.assertIsNot(session, self.client.get_session('http://other.example/author/1/'))
+
+    def test_node_session_is_authenticated(self):
+        session = self.client.get_session('http://foreign.example/author/1/', node=self.node)
+        self.assertEqual(session.auth, ('user', 'pass'))
+        self.assertIsNot(session, self.client.get_session('http://foreign.example/author/1/'))
+
+    def test_request_has_default_timeout(self):
+        session = self.client.get_session('http://foreign.example/author/1/')
+        with mock.patch.object(session, 'request') as session_request:
+            self.client.get('http://foreign.example/author/1/')
+        self.assertEqual(session_request.call_args[1]['timeout'], (settings.NODE_CLIENT_CONNECT_TIMEOUT, settings.NODE_CLIENT_READ_TIMEOUT))
+
+
+class ProxyCacheTestCase(TestCase):
+    URL = 'http://foreign.example/author/1/posts/1'
+
+    def setUp(self):
+        cache.clear()
+        # nodes of the previous tests were rolled back without signals
+        node_resolver.clear()
+        self.user = User.objects.create_user('proxy-user', password='pass')
+
+    def mock_response(self, status_code, data):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.json.return_value = data
+        return response
+
+    def test_object_is_cached(self):
+        with mock.patch('nodes.proxy.try_get', return_value=self.mock_response(200, {'type': 'post'})) as remote_get:
+            self.assertEqual(get_proxied_object(self.URL), (200, {'type': 'post'}))
+            self.assertEqual(get_proxied_object('HTTP://Foreign.example/author/1/posts/1/'), (200, {'type': 'post'}))
+            # cached per requesting user
+            get_proxied_object(self.URL, self.user)
+        self.assertEqual(remote_get.call_count, 2)
+
+    def test_node_cache_ttl(self):
+        Node.objects.create(host_url='http://foreign.example/', proxy_cache_ttl=0)
+        with mock.patch('nodes.proxy.try_get', return_value=self.mock_response(200, {'type': 'post'})) as remote_get:
+            get_proxied_object(self.URL)
+            get_proxied_object(self.URL)
+        self.assertEqual(remote_get.call_count, 2)
+
+    def test_not_found_is_cached(self):
+        with mock.patch('nodes.proxy.try_get', return_value=self.mock_response(404, {'detail': 'Not found.'})) as remote_get:
+            res = APIClient().get(f'/proxy/{self.URL}/', format='json')
+            self.assertEqual(res.status_code, 404)
+            res = APIClient().get(f'/proxy/{self.URL}/', format='json')
+            self.assertEqual(res.status_code, 404)
+        remote_get.assert_called_once()
+
+    def test_unknown_node_is_cached(self):
+        # no Node for the host, so try_get gives up after the request without auth
+        with mock.patch('posts.utils.node_client.get', return_value=self.mock_response(503, {})) as remote_get:
+            status_code, data = get_proxied_object(self.URL)
+            self.assertEqual(status_code, 404)
+            self.assertEqual(get_proxied_object(self.URL), (status_code, data))
+        remote_get.assert_called_once()
+
+    def test_concurrent_requests_share_a_fetch(self):
+        def slow_get(url):
+            time.sleep(0.2)
+            return self.mock_response(200, {'type': 'post'})
+
+        results = []
+        with mock.patch('nodes.proxy.try_get', side_effect=slow_get) as remote_get, \
+             mock.patch('nodes.proxy.get_cache_ttl', return_value=30):
+            threads = [threading.Thread(target=lambda: results.append(get_proxied_object(self.URL))) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        remote_get.assert_called_once()
+        self.assertEqual(results, [(200, {'type': 'post'})] * 5)
+
+
+class NodeResolverTestCase(TestCase):
+    def setUp(self):
+        node_resolver.clear()
+        self.node = Node.objects.create(host_url='http://Foreign.example/', username='user', password='pass')
+
+    def test_node_is_resolved_by_host(self):
+        self.assertEqual(self.node.host, 'foreign.example')
+        self.assertEqual(resolve_node('http://foreign.example/author/1/posts/2'), self.node)
+        self.assertEqual(resolve_node('https://foreign.example/author/1/'), self.node)
+        self.assertIsNone(resolve_node('http://other.example/author/1/'))
+
+    def test_nodes_are_cached(self):
+        resolve_node('http://foreign.example/author/1/')
+        resolve_node('http://other.example/author/1/')
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_node('http://foreign.example/author/2/'), self.node)
+            self.assertIsNone(resolve_node('http://other.example/author/2/'))
+
+    def test_cache_is_cleared_on_node_change(self):
+        self.assertIsNone(resolve_node('http://other.example/author/1/'))
+        other = Node.objects.create(host_url='http://other.example/api/')
+        self.assertEqual(resolve_node('http://other.example/api/author/1/'), other)
+
+        # the longest matching host url wins
+        api_v2 = Node.objects.create(host_url='http://other.example/api/v2')
+        self.assertEqual(resolve_node('http://other.example/api/v2/author/1/'), api_v2)
+        self.assertEqual(resolve_node('http://other.example/api/author/1/'), other)
+
+        other.delete()
+        api_v2.delete()
+        self.assertIsNone(resolve_node('http://other.example/api/author/1/'))
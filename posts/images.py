@@ -0,0 +1,88 @@
+"""
+Resized copies (derivatives) of the image posts, so feeds don't have to load the originals.
+
+Derivatives are created in the background by the process_images command, and served by
+get_image with ?size=<name of a size in settings.POST_IMAGE_SIZES>.
+"""
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Count
+from PIL import Image, ImageOps
+
+from .models import ImageDerivative, Post
+
+import logging
+logger = logging.getLogger(__name__)
+
+# re-encoding options of each format
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+}
+
+
+def resize_image(image, max_size):
+    """
+    a copy of the image that fits in a max_size x max_size box, keeping its aspect ratio. images are never enlarged
+    """
+    resized = ImageOps.exif_transpose(image)
+    resized.thumbnail((max_size, max_size), Image.LANCZOS)
+    return resized
+
+
+def encode_image(image, format):
+    if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, format=format, **SAVE_OPTIONS.get(format, {}))
+    return output.getvalue()
+
+
+def create_image_derivatives(post):
+    """
+    create the missing derivatives of the image post, returns the created ones
+    """
+    existing_sizes = set(post.image_derivatives.values_list('size', flat=True))
+    sizes = {size: max_size for size, max_size in settings.POST_IMAGE_SIZES.items() if size not in existing_sizes}
+    if not sizes:
+        return []
+
+    with post.image.open('rb') as image_file:
+        image = Image.open(image_file)
+        image.load()
+
+    derivatives = []
+    for size, max_size in sizes.items():
+        resized = resize_image(image, max_size)
+        derivative = ImageDerivative(post=post, size=size, width=resized.width, height=resized.height)
+        derivative.image.save(size, ContentFile(encode_image(resized, image.format)), save=False)
+        derivative.save()
+        derivatives.append(derivative)
+    return derivatives
+
+
+def get_posts_missing_derivatives():
+    return Post.objects.exclude(image='').annotate(
+        derivative_count=Count('image_derivatives')
+    ).filter(derivative_count__lt=len(settings.POST_IMAGE_SIZES))
+
+
+def process_pending_images(limit=20):
+    """
+    create the derivatives of the image posts that are missing some, returns the number of posts processed
+    """
+    posts = list(get_posts_missing_derivatives().order_by('published')[:limit])
+    for post in posts:
+        try:
+            create_image_derivatives(post)
+        except Exception as e:
+            # not a valid image, the file is gone, or pillow fails on it: serve the original only,
+            # and don't let this post stop the others or be picked again every pass
+            logger.warning("cannot create the derivatives of image post %s: %r", post.id, e)
+            ImageDerivative.objects.bulk_create([
+                ImageDerivative(post=post, size=size, image=post.image.name, width=0, height=0)
+                for size in settings.POST_IMAGE_SIZES
+            ], ignore_conflicts=True)
+    return len(posts)
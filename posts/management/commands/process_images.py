@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = "Create the resized copies of uploaded images (see posts/images.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="process the pending images once and exit")
+        parser.add_argument('--interval', type=float, default=5.0, help="seconds to sleep when no image is pending")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending_images()
+            if processed:
+                self.stdout.write(f"processed {processed} image(s)")
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
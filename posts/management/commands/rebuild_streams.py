@@ -0,0 +1,43 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from authors.models import Author, InboxObject
+from github.models import GithubEvent
+from posts.models import Post, StreamItem
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized streams (StreamItem) from posts, inboxes and github events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('author_ids', nargs='*', help="only rebuild the streams of these authors")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        authors = Author.objects.all()
+        if options['author_ids']:
+            authors = authors.filter(id__in=options['author_ids'])
+
+        for author in authors.iterator():
+            with transaction.atomic():
+                StreamItem.objects.filter(author=author).delete()
+                StreamItem.objects.bulk_create(self.get_stream_items(author), batch_size=options['batch_size'])
+            self.stdout.write(f"rebuilt stream of {author}")
+
+    def get_stream_items(self, author):
+        own_posts = Post.objects.filter(author=author, unlisted=False, is_github=False).values_list('id', 'published')
+        for post_id, published in own_posts.iterator():
+            yield StreamItem(author=author, kind=StreamItem.Kind.OWN, post_id=post_id, published=published)
+
+        inbox_post_ids = InboxObject.objects.filter(
+            author=author, content_type=ContentType.objects.get_for_model(Post)
+        ).values('object_id')
+        inbox_posts = Post.objects.filter(id__in=inbox_post_ids).values_list('id', 'published')
+        for post_id, published in inbox_posts.iterator():
+            yield StreamItem(author=author, kind=StreamItem.Kind.INBOX, post_id=post_id, published=published)
+
+        if author.github_url:
+            github_events = GithubEvent.objects.filter(url=author.github_url).values_list('id', 'time')
+            for github_event_id, time in github_events.iterator():
+                yield StreamItem(author=author, kind=StreamItem.Kind.GITHUB, github_event_id=github_event_id, published=time)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recount Post.comment_count from the comments, in case the counters drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('post_ids', nargs='*', help="only recount the comments of these posts")
+
+    def handle(self, *args, **options):
+        posts = Post.objects.all()
+        if options['post_ids']:
+            posts = posts.filter(id__in=options['post_ids'])
+
+        fixed = Post.reconcile_comment_counts(posts)
+        self.stdout.write(f"fixed the comment count of {fixed} post(s)")
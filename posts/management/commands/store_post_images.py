@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = "Move the base64 content of image posts to the image storage (see posts/storage.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.filter(content_type__startswith='image', image='').exclude(content='')
+
+        moved = 0
+        for post in posts.iterator(chunk_size=options['batch_size']):
+            if post.store_image_content():
+                post.save(update_fields=['image', 'content'])
+                moved += 1
+        self.stdout.write(f"moved {moved} image(s) to the image storage")
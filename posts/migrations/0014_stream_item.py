@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authors', '0027_merge_20211203_0255'),
+        ('github', '0004_alter_githubevent_type'),
+        ('posts', '0013_post_is_github'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OWN', 'Own'), ('INBOX', 'Inbox'), ('GITHUB', 'Github')], max_length=10)),
+                ('published', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stream_items', to='authors.author')),
+                ('github_event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='github.githubevent')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='posts.post')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='streamitem',
+            index=models.Index(fields=['author', '-published', '-id'], name='stream_author_published_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='streamitem',
+            constraint=models.UniqueConstraint(fields=('author', 'kind', 'post'), name='unique_stream_post'),
+        ),
+        migrations.AddConstraint(
+            model_name='streamitem',
+            constraint=models.UniqueConstraint(fields=('author', 'github_event'), name='unique_stream_github_event'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:34
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+LIKE_OBJECT_PATTERN = re.compile(r'\/posts\/(?P<post_id>[^\/]+)(\/comments\/(?P<comment_id>[^\/]+))?$')
+
+
+def resolve_like_targets(apps, schema_editor):
+    Like = apps.get_model('posts', 'Like')
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    post_ids = set(Post.objects.values_list('id', flat=True))
+    comment_ids = set(Comment.objects.values_list('id', flat=True))
+
+    likes = list(Like.objects.all())
+    for like in likes:
+        like.target = like.object.strip().rstrip('/')
+        match = LIKE_OBJECT_PATTERN.search(like.target)
+        if match and match.group('comment_id'):
+            like.comment_id = match.group('comment_id') if match.group('comment_id') in comment_ids else None
+        elif match:
+            like.post_id = match.group('post_id') if match.group('post_id') in post_ids else None
+    Like.objects.bulk_update(likes, ['target', 'post', 'comment'], batch_size=1000)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='like',
+            name='comment',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='likes', to='posts.comment'),
+        ),
+        migrations.AddField(
+            model_name='like',
+            name='post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='likes', to='posts.post'),
+        ),
+        migrations.AddField(
+            model_name='like',
+            name='target',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(resolve_like_targets, migrations.RunPython.noop),
+    ]
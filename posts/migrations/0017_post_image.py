@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-17 02:37
+
+from django.db import migrations, models
+import posts.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_like_target'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image',
+            field=models.FileField(blank=True, editable=False, max_length=500, storage=posts.storage.get_post_image_storage, upload_to=posts.storage.get_post_image_path),
+        ),
+    ]
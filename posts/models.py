@@ -1,12 +1,22 @@
+import base64
+import binascii
+import re
 import uuid
 from django.contrib.contenttypes.fields import GenericRelation
+from django.core.files.base import ContentFile
 from django.db import models
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from authors.models import Author
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse 
 from django.contrib.postgres import fields
 
 from authors.models import InboxObject
+from .storage import get_image_derivative_path, get_post_image_storage, get_post_image_path
+
+# matches the post id and the optional comment id of a liked object url, e.g. http://host/author/<id>/posts/<id>/comments/<id>
+LIKE_OBJECT_PATTERN = re.compile(r'\/posts\/(?P<post_id>[^\/]+)(\/comments\/(?P<comment_id>[^\/]+))?$')
 
 class Post(models.Model):
     # https://docs.djangoproject.com/en/3.2/ref/models/fields/#enumeration-types
@@ -33,16 +43,49 @@ class Post(models.Model):
     content_type = models.CharField(max_length=30, choices=ContentType.choices, default=ContentType.PLAIN)
     content = models.TextField()
     published = models.DateTimeField(auto_now_add=True)
+    # last time the post was saved, used for HTTP caching
+    updated = models.DateTimeField(auto_now=True)
     unlisted = models.BooleanField(default=False)
     visibility = models.CharField(max_length=10, choices=Visibility.choices, default=Visibility.PUBLIC)
 
     inbox_object = GenericRelation(InboxObject, related_query_name='post')
     is_github = models.BooleanField(default=False)
+    # denormalized number of comments, kept up to date by posts/signals.py
+    # and fixed by the reconcile_comment_counts command if it ever drifts
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # the file of an image post, content is left empty for those
+    image = models.FileField(upload_to=get_post_image_path, storage=get_post_image_storage, max_length=500, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # an author's listed posts, newest first (PostList). partial, since unlisted=False doesn't compile to an equality
+            models.Index(fields=['author', '-published'], condition=Q(unlisted=False), name='post_author_listed_idx'),
+            # newest posts first (/posts/)
+            models.Index(fields=['-published'], name='post_published_idx'),
+        ]
 
     # make the admin page looks pretty
     def __str__(self):
         return self.title + " (" + str(self.id) + ")"
 
+    def save(self, *args, **kwargs):
+        # comment_count is only changed with UPDATEs (see posts/signals.py), so saving a stale post must not overwrite it
+        if self.pk is not None and not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'comment_count'
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def reconcile_comment_counts(posts=None):
+        """
+        recount the comments of the posts (all posts by default), returns the number of posts that were wrong
+        """
+        posts = Post.objects.all() if posts is None else posts
+        counts = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(count=Count('id')).values('count')
+        actual_count = Coalesce(Subquery(counts), 0)
+        return posts.annotate(actual_count=actual_count).exclude(comment_count=F('actual_count')).update(comment_count=actual_count)
+
     # This will return the label of the enum (e.g. "PUBLIC")
     # instead of the value of the enum (e.g. "PUB")
     def get_visilibility_label(self):
@@ -67,15 +110,53 @@ class Post(models.Model):
     def get_image_url(self):
         return self.url.replace('/posts/', '/images/')
 
+    def is_image(self):
+        return 'image' in self.content_type
+
+    def get_image_mime_type(self):
+        # e.g. 'image/png' for 'image/png;base64'
+        return self.content_type.split(';')[0]
+
+    def store_image(self, file):
+        """
+        save the image file (e.g. an upload) to the image storage, the post itself is not saved
+        """
+        # the name is generated by get_post_image_path
+        self.image.save(file.name or 'image', file, save=False)
+        self.content = ""
+
+    def store_image_content(self):
+        """
+        move the base64 content of an image post to the image storage, e.g. for images received from other servers.
+        returns True if the content was moved, the post itself is not saved
+        """
+        if not self.is_image() or self.image or not self.content:
+            return False
+        # some servers send a data url, e.g. "data:image/png;base64,iVBOR..."
+        content = self.content.split(',', 1)[1] if self.content.startswith('data:') else self.content
+        try:
+            image = base64.b64decode(content)
+        except (binascii.Error, ValueError):
+            # not valid base64, kept in the content as it was received
+            return False
+        self.store_image(ContentFile(image))
+        return True
+
+    def get_image_content(self):
+        """
+        the base64 content of an image post, the format other servers expect
+        """
+        if not self.image:
+            return self.content
+        with self.image.open('rb') as image:
+            return base64.b64encode(image.read()).decode('ascii')
+
     def build_comments_url(self):
         if (self.url.endswith("/")):
             return self.url + "comments/"
         else:
             return self.url + "/comments/"
 
-    def count_comments(self):
-        return self.comment_set.count()
-
     # used by serializer
     def update_fields_with_request(self, request=None):
         if not request:
@@ -98,6 +179,12 @@ class Comment(models.Model):
 
     content_type = models.CharField(max_length=30, choices=Post.ContentType.choices, default=Post.ContentType.PLAIN)
 
+    class Meta:
+        indexes = [
+            # a post's comments, newest first (CommentList)
+            models.Index(fields=['post', '-published'], name='comment_post_published_idx'),
+        ]
+
     # used by serializer
     def get_public_id(self):
         return self.url or self.id
@@ -128,6 +215,11 @@ class Like(models.Model):
     author = models.ForeignKey(Author, related_name = "likes", on_delete=models.CASCADE)
     # object can either be a post or comment
     object = models.URLField(max_length=500)
+    # object in a canonical form (see get_target), so likes of a post or comment are found with an index lookup
+    target = models.CharField(max_length=500, db_index=True, editable=False, default="")
+    # the liked local post or comment, if the object is one of them
+    post = models.ForeignKey(Post, related_name="likes", null=True, blank=True, editable=False, on_delete=models.SET_NULL)
+    comment = models.ForeignKey(Comment, related_name="likes", null=True, blank=True, editable=False, on_delete=models.SET_NULL)
 
     inbox_object = GenericRelation(InboxObject, related_query_name='like')
 
@@ -135,9 +227,127 @@ class Like(models.Model):
     def get_api_type():
         return 'Like'
 
+    @staticmethod
+    def get_target(object_url):
+        """
+        canonical form of a liked object url, e.g. for both http://host/author/a/posts/p/ and http://host/author/a/posts/p
+        """
+        return object_url.strip().rstrip('/')
+
+    def resolve_target(self):
+        """
+        set the target and the liked local post or comment from the object url
+        """
+        self.target = Like.get_target(self.object)
+        self.post = self.comment = None
+        match = LIKE_OBJECT_PATTERN.search(self.target)
+        if not match:
+            return
+        if match.group('comment_id'):
+            self.comment = Comment.objects.select_related('post__author').filter(id=match.group('comment_id')).first()
+        else:
+            self.post = Post.objects.filter(id=match.group('post_id')).first()
+
+    def save(self, *args, **kwargs):
+        self.resolve_target()
+        super().save(*args, **kwargs)
+
     # https://docs.djangoproject.com/en/3.2/ref/models/constraints/#django.db.models.UniqueConstraint
     class Meta:
         # ensure one author can only like a post or comment once
         constraints = [
             models.UniqueConstraint(fields=['author', 'object'], name='unique_like')
         ]
+
+
+class ImageDerivative(models.Model):
+    """
+    A resized copy of an image post's file, one per size in settings.POST_IMAGE_SIZES.
+    Created in the background by the process_images command, see posts/images.py
+    """
+    post = models.ForeignKey(Post, related_name="image_derivatives", on_delete=models.CASCADE)
+    size = models.CharField(max_length=20)
+    image = models.FileField(upload_to=get_image_derivative_path, storage=get_post_image_storage, max_length=500)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'size'], name='unique_image_derivative')
+        ]
+
+    def __str__(self):
+        return f"{self.post} | {self.size} | {self.width}x{self.height}"
+
+
+class StreamItem(models.Model):
+    """
+    A row in an author's stream: one of the author's own posts, a post sent to the author's inbox,
+    or one of the author's github events.
+
+    Rows are written when the post is created or received (see posts/signals.py), so that
+    reading the stream is a single indexed query.
+    """
+    class Kind(models.TextChoices):
+        OWN = 'OWN'
+        INBOX = 'INBOX'
+        GITHUB = 'GITHUB'
+
+    author = models.ForeignKey(Author, related_name="stream_items", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    post = models.ForeignKey(Post, null=True, blank=True, on_delete=models.CASCADE)
+    github_event = models.ForeignKey('github.GithubEvent', null=True, blank=True, on_delete=models.CASCADE)
+    # copied from the post or event, so the stream can be sorted without a join
+    published = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', '-published', '-id'], name='stream_author_published_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['author', 'kind', 'post'], name='unique_stream_post'),
+            models.UniqueConstraint(fields=['author', 'github_event'], name='unique_stream_github_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.author} | {self.kind} | {self.post or self.github_event}"
+
+    def to_post(self):
+        """
+        the post to show in the stream, github events are converted to a fake (unsaved) post
+        """
+        if self.github_event:
+            return self.github_event.event_to_post(self.author)
+        return self.post
+
+    @staticmethod
+    def sync_own_post(post: Post, created=False):
+        """
+        keep the author's stream row of the post in sync with it: listed posts are in the stream, unlisted ones are not
+        """
+        if not created:
+            # the post could have been moved to another author, e.g. when it's shared
+            StreamItem.objects.filter(post=post, kind=StreamItem.Kind.OWN).exclude(author_id=post.author_id).delete()
+
+        if post.unlisted or post.is_github:
+            if not created:
+                StreamItem.objects.filter(post=post, kind=StreamItem.Kind.OWN).delete()
+        elif created:
+            StreamItem.objects.create(author_id=post.author_id, kind=StreamItem.Kind.OWN, post=post, published=post.published)
+        else:
+            StreamItem.objects.update_or_create(
+                author_id=post.author_id, kind=StreamItem.Kind.OWN, post=post,
+                defaults={'published': post.published}
+            )
+
+    @staticmethod
+    def add_inbox_post(author_id, post: Post):
+        StreamItem.objects.get_or_create(
+            author_id=author_id, kind=StreamItem.Kind.INBOX, post=post,
+            defaults={'published': post.published}
+        )
+
+    @staticmethod
+    def remove_inbox_post(author_id, post_id):
+        StreamItem.objects.filter(author_id=author_id, kind=StreamItem.Kind.INBOX, post_id=post_id).delete()
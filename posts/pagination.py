@@ -1,8 +1,11 @@
-from social_distance.pagination import PageSizePagination
+from social_distance.pagination import KeysetPagination, PageSizePagination
 
 class CommentsPagination(PageSizePagination):
     key = 'comments'
     type = 'comments'
 
 class PostsPagination(PageSizePagination):
-    type = 'posts'
\ No newline at end of file
+    type = 'posts'
+
+class StreamPagination(KeysetPagination):
+    type = 'posts'
@@ -2,14 +2,73 @@ from django.forms.models import model_to_dict
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
 from rest_framework import exceptions, serializers
 
 from authors.models import Author
 
 from .models import Post, Comment, Like
-from authors.serializers import AuthorSerializer
+from authors.serializers import AuthorSerializer, FastListSerializer
+
+def count_likes(objects, request=None):
+    """
+    {like target: (number of likes, liked by the requesting user)} of the posts or comments, in one query
+    """
+    targets = {Like.get_target(obj.url) for obj in objects if obj.url}
+    if not targets:
+        return {}
+    user = request.user if request and request.user.is_authenticated else None
+    likes = Like.objects.filter(target__in=targets).values('target').annotate(count=Count('id'))
+    if user:
+        likes = likes.annotate(liked=Count('id', filter=Q(author__user=user)))
+    like_counts = {target: (0, False) for target in targets}
+    like_counts.update({like['target']: (like['count'], like.get('liked', 0) > 0) for like in likes})
+    return like_counts
+
+
+class LikeCountListSerializer(FastListSerializer):
+    """
+    counts the likes of the whole page at once, instead of once per post or comment
+    """
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        self.context['like_counts'] = {
+            **self.context.get('like_counts', {}),
+            **count_likes(items, self.context.get('request'))
+        }
+        return super().to_representation(items)
+
+
+class LikeCountMixin(serializers.Serializer):
+    likeCount = serializers.SerializerMethodField()
+    liked = serializers.SerializerMethodField()
+
+    def get_like_count(self, instance):
+        target = Like.get_target(instance.url or "")
+        like_counts = self.context.setdefault('like_counts', {})
+        if target not in like_counts:
+            like_counts.update(count_likes([instance], self.context.get('request')))
+        return like_counts.get(target, (0, False))
+
+    def get_likeCount(self, instance) -> int:
+        return self.get_like_count(instance)[0]
+
+    def get_liked(self, instance) -> bool:
+        # whether the requesting user has liked it
+        return self.get_like_count(instance)[1]
 
-class PostSerializer(serializers.ModelSerializer):
+
+class PublishedFieldMixin:
+    @cached_property
+    def published_field(self):
+        # the published field with the current timezone looked up once, instead of for every item of a list
+        return serializers.DateTimeField(default_timezone=timezone.get_current_timezone())
+
+
+class PostSerializer(PublishedFieldMixin, LikeCountMixin, serializers.ModelSerializer):
     # type is only provided to satisfy API format
     type = serializers.CharField(default="post", source="get_api_type", read_only=True)
     # public id should be the full url
@@ -19,7 +78,7 @@ class PostSerializer(serializers.ModelSerializer):
 
     description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
 
-    count = serializers.IntegerField(source="count_comments", read_only=True)
+    count = serializers.IntegerField(source="comment_count", read_only=True)
     published = serializers.DateTimeField(required=False)
     author = AuthorSerializer(required=False)
     comments = serializers.URLField(source="build_comments_url", read_only=True)
@@ -31,7 +90,57 @@ class PostSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         updated_author = AuthorSerializer.extract_and_upcreate_author(validated_data, author_id=self.context.get('author_id'))
-        return Post.objects.create(**validated_data, author=updated_author)
+        post = Post(**validated_data, author=updated_author)
+        # base64 images are kept in the image storage, not in the content
+        post.store_image_content()
+        post.save()
+        return post
+
+    @cached_property
+    def inline_images(self):
+        """
+        whether image posts have their base64 content, which other servers expect (deliveries, or requests by a node).
+        local clients get the url of the image instead, so pages don't load every image.
+        """
+        if 'inline_images' in self.context:
+            return self.context['inline_images']
+        request = self.context.get('request')
+        return bool(request and request.user.is_authenticated and hasattr(request.user, 'node'))
+
+    def get_content(self, instance):
+        if not instance.image:
+            return instance.content
+        return instance.get_image_content() if self.inline_images else instance.get_image_url()
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.image:
+            data['content'] = self.get_content(instance)
+        return data
+
+    def fast_representation(self, instance):
+        # to_representation built directly from the instance, for lists
+        like_count, liked = self.get_like_count(instance)
+        return {
+            'type': instance.get_api_type(),
+            'title': instance.title,
+            'id': instance.get_public_id(),
+            'url': instance.url,
+            'source': instance.source,
+            'origin': instance.origin,
+            'description': instance.description,
+            'contentType': instance.content_type,
+            'content': self.get_content(instance),
+            'author': AuthorSerializer.fast_representation(instance.author),
+            'count': instance.comment_count,
+            'comments': instance.build_comments_url(),
+            'published': self.published_field.to_representation(instance.published),
+            'visibility': instance.visibility,
+            'unlisted': instance.unlisted,
+            'is_github': instance.is_github,
+            'likeCount': like_count,
+            'liked': liked,
+        }
 
     # TODO: missing the following fields
     # categories, size, comments (url), comments (Array of JSON)
@@ -55,10 +164,13 @@ class PostSerializer(serializers.ModelSerializer):
             'published',
             'visibility',
             'unlisted',
-            'is_github'
+            'is_github',
+            'likeCount',
+            'liked'
         ]
+        list_serializer_class = LikeCountListSerializer
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(PublishedFieldMixin, LikeCountMixin, serializers.ModelSerializer):
     # type is only provided to satisfy API format
     type = serializers.CharField(default="comment", source="get_api_type", read_only=True)
     # public id should be the full url
@@ -69,6 +181,20 @@ class CommentSerializer(serializers.ModelSerializer):
 
     contentType = serializers.ChoiceField(choices=Post.ContentType.choices, source='content_type')
 
+    def fast_representation(self, instance):
+        # to_representation built directly from the instance, for lists
+        like_count, liked = self.get_like_count(instance)
+        return {
+            'type': instance.get_api_type(),
+            'author': AuthorSerializer.fast_representation(instance.author),
+            'comment': instance.comment,
+            'contentType': instance.content_type,
+            'published': self.published_field.to_representation(instance.published),
+            'id': instance.get_public_id(),
+            'likeCount': like_count,
+            'liked': liked,
+        }
+
     class Meta:
         model = Comment
         fields = [
@@ -77,8 +203,11 @@ class CommentSerializer(serializers.ModelSerializer):
             "comment",
             "contentType",
             "published",
-            "id"
+            "id",
+            "likeCount",
+            "liked"
         ]
+        list_serializer_class = LikeCountListSerializer
 
 class LikeSerializer(serializers.ModelSerializer):
     # type is only provided to satisfy API format
@@ -92,6 +221,15 @@ class LikeSerializer(serializers.ModelSerializer):
         updated_author = AuthorSerializer.extract_and_upcreate_author(validated_data, author_id=self.context.get('author_id'))
         return Like.objects.create(**validated_data, author=updated_author)
 
+    def fast_representation(self, instance):
+        # to_representation built directly from the instance, for lists
+        return {
+            'type': instance.get_api_type(),
+            'summary': instance.summary,
+            'author': AuthorSerializer.fast_representation(instance.author),
+            'object': instance.object,
+        }
+
     class Meta:
         model = Like
         fields = [
@@ -100,6 +238,7 @@ class LikeSerializer(serializers.ModelSerializer):
             "author",
             "object",
         ]
+        list_serializer_class = FastListSerializer
 
 class ImageUploadSerializer(serializers.Serializer):
     image = serializers.ImageField()
@@ -0,0 +1,50 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from authors.models import InboxObject
+
+from .models import Comment, Post, StreamItem
+
+
+# keep the materialized streams (StreamItem) up to date
+
+@receiver(post_save, sender=Post)
+def update_stream_on_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    StreamItem.sync_own_post(instance, created=created)
+
+
+@receiver(post_save, sender=InboxObject)
+def update_stream_on_inbox_save(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    # content_object is usually cached, since the inbox object is created with it
+    if instance.content_type_id == ContentType.objects.get_for_model(Post).id and instance.content_object:
+        StreamItem.add_inbox_post(instance.author_id, instance.content_object)
+
+
+@receiver(post_delete, sender=InboxObject)
+def update_stream_on_inbox_delete(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Post).id:
+        StreamItem.remove_inbox_post(instance.author_id, instance.object_id)
+
+
+# keep Post.comment_count up to date, with an UPDATE so concurrent comments are all counted
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    Post.objects.filter(pk=instance.post_id).update(comment_count=F('comment_count') + 1)
+    if Comment.post.is_cached(instance):
+        instance.post.comment_count += 1
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, **kwargs):
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+    if Comment.post.is_cached(instance) and instance.post.comment_count > 0:
+        instance.post.comment_count -= 1
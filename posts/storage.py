@@ -0,0 +1,25 @@
+"""
+Storage of the files of image posts (Post.image), pluggable with the POST_IMAGE_STORAGE setting.
+
+Images used to be saved base64-encoded in Post.content, which is still the format they are
+sent to other servers in, see Post.get_image_content.
+"""
+import mimetypes
+
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+
+
+def get_post_image_storage():
+    return get_storage_class(settings.POST_IMAGE_STORAGE)(**settings.POST_IMAGE_STORAGE_OPTIONS)
+
+
+def get_post_image_path(post, filename):
+    extension = mimetypes.guess_extension(post.get_image_mime_type()) or ''
+    return f"images/{post.author_id}/{post.id}{extension}"
+
+
+def get_image_derivative_path(derivative, filename):
+    post = derivative.post
+    extension = mimetypes.guess_extension(post.get_image_mime_type()) or ''
+    return f"images/{post.author_id}/{post.id}_{derivative.size}{extension}"
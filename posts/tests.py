@@ -1,15 +1,29 @@
+import base64
+import io
 import json
 import tempfile
 import uuid
+from io import StringIO
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.test import TestCase, Client
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from django.db.utils import IntegrityError
 
 from django.contrib.auth.models import User
-from authors.models import Author
+from authors.models import Author, InboxObject
+from authors.serializers import AuthorSerializer
 from authors.tests import client_with_auth
-from posts.models import Post, Comment, Like
+from nodes.models import Node
+from posts.models import Post, Comment, Like, StreamItem
+from posts.serializers import CommentSerializer, LikeSerializer, PostSerializer
 from PIL import Image
+from posts.images import process_pending_images
 
 # Create your tests here.
 client = APIClient() # the mock http client
@@ -42,6 +56,48 @@ class PostDetailTestCase(TestCase):
         self.assertEqual(content['content'], 'test_content')
         self.assertEqual(content['visibility'], 'PUBLIC')
 
+    def test_get_post_not_modified(self):
+        self.setup_objects()
+        url = f'/author/{self.author.id}/posts/{self.post.id}/'
+        res = self.client.get(url, format='json')
+        etag = res['ETag']
+        self.assertIn('private', res['Cache-Control'])
+
+        res = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b'')
+
+        # a new comment changes the response
+        comment = Comment.objects.create(post=self.post, author=self.author, comment="test_comment", content_type="text/plain")
+        res = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+        etag = res['ETag']
+
+        # and so does a like of the comment
+        comment_url = f'http://testserver/author/{self.author.id}/posts/{self.post.id}/comments/{comment.id}'
+        Like.objects.create(author=self.author, summary='like', object=comment_url)
+        res = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+
+        # anonymous responses of public posts can be cached by a proxy
+        res = APIClient().get(url, format='json')
+        self.assertIn('public', res['Cache-Control'])
+
+    def test_get_post_comments_src(self):
+        self.setup_objects()
+        Comment.objects.create(post=self.post, author=self.author, comment="test_comment", content_type="text/plain")
+        with mock.patch('nodes.client.node_client.request') as node_request:
+            res = self.client.get(f'/author/{self.author.id}/posts/{self.post.id}/', format='json')
+            node_request.assert_not_called()
+        content = json.loads(res.content)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(content['commentsSrc']['type'], 'comments')
+        self.assertEqual(content['commentsSrc']['count'], 1)
+        self.assertEqual(content['commentsSrc']['comments'][0]['comment'], 'test_comment')
+
     def test_get_post_not_exist(self):
         self.setup_objects()
         res = self.client.get(f'/author/{self.author.id}/posts/this-id-does-not-exist/', format='json')
@@ -309,6 +365,26 @@ class CommentListTestCase(TestCase):
         res = self.client.get(f'/author/{self.author.id}/posts/{self.post.id}/comments/?page=3&size=1', format='json')
         assert res.status_code == 404
 
+    def test_get_comments_cursor_paginated(self):
+        self.setup_objects()
+        res = self.client.get(f'/author/{self.author.id}/posts/{self.post.id}/comments/?cursor=&size=1', format='json')
+        content = json.loads(res.content)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("count", content)
+        self.assertIsNone(content["previous"])
+        self.assertEqual([comment["comment"] for comment in content["comments"]], ["test_comment2"])
+
+        res = self.client.get(content["next"], format='json')
+        content = json.loads(res.content)
+        self.assertEqual([comment["comment"] for comment in content["comments"]], ["test_comment1"])
+        self.assertIsNone(content["next"])
+        self.assertIsNotNone(content["previous"])
+
+    def test_get_comments_invalid_cursor(self):
+        self.setup_objects()
+        res = self.client.get(f'/author/{self.author.id}/posts/{self.post.id}/comments/?cursor=not-a-cursor', format='json')
+        self.assertEqual(res.status_code, 404)
+
     def test_get_comments_invalid_post(self):
         self.setup_objects()
         res = self.client.get(f'/author/{self.author.id}/posts/does-not-exist/comments/', format='json')
@@ -369,6 +445,52 @@ class CommentListTestCase(TestCase):
         self.assertEqual(len(Comment.objects.all()), 3)
         assert len(Author.objects.filter(url=self.payload["author"]["url"])) == 1
 
+    def test_comment_count_is_maintained(self):
+        self.setup_objects()
+        self.assertEqual(Post.objects.get(id=self.post.id).comment_count, 2)
+
+        self.comment1.delete()
+        self.assertEqual(Post.objects.get(id=self.post.id).comment_count, 1)
+
+        res = self.client.get(f'/author/{self.author.id}/posts/{self.post.id}/', format='json')
+        self.assertEqual(json.loads(res.content)['count'], 1)
+
+    def test_reconcile_comment_counts(self):
+        self.setup_objects()
+        Post.objects.filter(id=self.post.id).update(comment_count=10)
+
+        out = StringIO()
+        call_command('reconcile_comment_counts', stdout=out)
+        self.assertIn('fixed the comment count of 1 post(s)', out.getvalue())
+        self.assertEqual(Post.objects.get(id=self.post.id).comment_count, 2)
+
+
+class CommentCountTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('count_user', password='count_pass')
+        self.author = Author.objects.create(user=self.user, display_name='count author', is_internal=True)
+        self.post = Post.objects.create(author=self.author, title='title', content='content')
+        for i in range(3):
+            Comment.objects.create(post=self.post, author=self.author, comment=f'comment {i}')
+
+    def test_stale_save_keeps_comment_count(self):
+        stale_post = Post.objects.get(id=self.post.id)
+        Comment.objects.create(post=self.post, author=self.author, comment='one more')
+        stale_post.title = 'edited'
+        stale_post.save()
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.title, post.comment_count), ('edited', 4))
+
+    def test_share_has_no_comments(self):
+        self.client = client_with_auth(self.user, APIClient())
+        with mock.patch('posts.views.connector_service.notify_post'):
+            res = self.client.post(f'/author/{self.author.id}/posts/{self.post.id}/share/followers/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data['count'], 0)
+        self.assertEqual(Post.objects.get(url=res.data['url']).comment_count, 0)
+        self.assertEqual(Post.objects.get(id=self.post.id).comment_count, 3)
+
+
 class LikeTestCase(TestCase):
     def setup_objects(self):
         self.user = User.objects.create_superuser('test_username', 'test_email', 'test_pass')
@@ -483,6 +605,50 @@ class LikeTestCase(TestCase):
         )
         self.assertEqual(res.status_code, 404)
     
+    def test_like_target_is_resolved(self):
+        self.setup_objects()
+        post_url = f'http://testserver/author/{self.author.id}/posts/{self.post.id}'
+        Post.objects.filter(id=self.post.id).update(url=post_url)
+        comment_url = f'{post_url}/comments/{self.comment.id}/'
+        self.like1 = Like.objects.create(summary="post like", author=self.author, object=post_url + '/')
+        self.like2 = Like.objects.create(summary="comment like", author=self.author, object=comment_url)
+
+        self.assertEqual(self.like1.target, post_url)
+        self.assertEqual(self.like1.post_id, str(self.post.id))
+        self.assertIsNone(self.like1.comment)
+        self.assertEqual(self.like2.target, comment_url[:-1])
+        self.assertEqual(self.like2.comment_id, str(self.comment.id))
+        self.assertIsNone(self.like2.post)
+
+        # likes with or without the trailing slash are found
+        Like.objects.create(summary="post like", author=self.author2, object=post_url)
+        res = self.client.get(f'/author/{self.author.id}/posts/{self.post.id}/likes/', format="json")
+        self.assertEqual(len(json.loads(res.content)), 2)
+
+    def test_post_list_like_counts(self):
+        self.setup_objects()
+        Post.objects.filter(id=self.post.id).update(url=f'http://testserver/author/{self.author.id}/posts/{self.post.id}')
+        other_post = Post.objects.create(author=self.author, title="other", content="other",
+                                         url=f'http://testserver/author/{self.author.id}/posts/other')
+        self.setup_likes(f'http://testserver/author/{self.author.id}/posts/{self.post.id}/')
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(f'/author/{self.author.id}/posts/', format="json")
+        like_counts = {post['title']: (post['likeCount'], post['liked']) for post in json.loads(res.content)['items']}
+        self.assertEqual(like_counts, {'test_title': (2, True), 'other': (0, False)})
+
+        # the likes are counted once for the whole page
+        for i in range(3):
+            Post.objects.create(author=self.author, title=f"post {i}", content="content",
+                                url=f'http://testserver/author/{self.author.id}/posts/{i}')
+        with CaptureQueriesContext(connection) as more_queries:
+            self.client.get(f'/author/{self.author.id}/posts/', format="json")
+        self.assertEqual(len(queries), len(more_queries))
+
+        Like.objects.create(summary="like", author=self.author2, object=other_post.url)
+        res = self.client.get(f'/author/{self.author.id}/posts/{other_post.id}/', format="json")
+        self.assertEqual((json.loads(res.content)['likeCount'], json.loads(res.content)['liked']), (1, False))
+
     def test_setup_duplicate_like(self):
         self.setup_objects()
         try:
@@ -511,6 +677,13 @@ class ImageUploadTestCase(TestCase):
         self.client = client_with_auth(self.user, client)
         self.author = Author.objects.create(user=self.user, display_name=self.user.username)
 
+        # keep the uploaded images out of the project
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
         # https://stackoverflow.com/a/39775556
         image = Image.new('RGB', (60, 30), color = 'red')
         f = tempfile.NamedTemporaryFile(suffix='.png')
@@ -560,3 +733,253 @@ class ImageUploadTestCase(TestCase):
         self.assertEqual(Post.objects.get(author=self.author).url, res.json()["url"].replace('images', 'posts'))
         self.assertEqual(Post.objects.get(author=self.author).visibility, Post.Visibility.PRIVATE)
         self.assertEqual(Post.objects.get(author=self.author).unlisted, True)
+
+    def test_get_uploaded_image(self):
+        self.setup_objects()
+        with open(self.image_file.name, 'rb') as f:
+            res = self.client.post(f'/author/{self.author.id}/images/', {"image": f})
+        post = Post.objects.get(author=self.author)
+        self.assertEqual(post.content, "")
+        self.assertTrue(post.image.name.endswith('.png'))
+
+        res = self.client.get(f'/author/{self.author.id}/images/{post.id}/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'image/png')
+        with open(self.image_file.name, 'rb') as f:
+            image_bytes = f.read()
+        self.assertEqual(b''.join(res.streaming_content), image_bytes)
+
+        # local clients get the url of the image
+        res = self.client.get(f'/author/{self.author.id}/posts/{post.id}/')
+        self.assertEqual(json.loads(res.content)['content'], post.get_image_url())
+
+        # other servers still get the image as base64
+        node_client = APIClient()
+        node_client.force_authenticate(user=Node.objects.create(
+            host_url='http://foreign.example/', user=User.objects.create_user('foreign_node', password='pass')
+        ).user)
+        res = node_client.get(f'/author/{self.author.id}/posts/{post.id}/')
+        self.assertEqual(base64.b64decode(json.loads(res.content)['content']), image_bytes)
+
+    def test_get_image_not_modified(self):
+        self.setup_objects()
+        with open(self.image_file.name, 'rb') as f:
+            self.client.post(f'/author/{self.author.id}/images/', {"image": f})
+        post = Post.objects.get(author=self.author)
+
+        res = self.client.get(f'/author/{self.author.id}/images/{post.id}/')
+        self.assertIn('public', res['Cache-Control'])
+        res = self.client.get(f'/author/{self.author.id}/images/{post.id}/', HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+        res = self.client.get(f'/author/{self.author.id}/images/{post.id}/', HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_resized_image(self):
+        self.setup_objects()
+        with open(self.image_file.name, 'rb') as f:
+            self.client.post(f'/author/{self.author.id}/images/', {"image": f})
+        post = Post.objects.get(author=self.author)
+        url = f'/author/{self.author.id}/images/{post.id}/'
+
+        with self.settings(POST_IMAGE_SIZES={'thumbnail': 20, 'large': 1000}):
+            # served the original until the resized copies are created
+            res = self.client.get(url, {'size': 'thumbnail'})
+            self.assertEqual(Image.open(io.BytesIO(b''.join(res.streaming_content))).size, (60, 30))
+            self.assertIn('max-age=0', res['Cache-Control'])
+
+            call_command('process_images', '--once', stdout=StringIO())
+            res = self.client.get(url, {'size': 'thumbnail'})
+            self.assertEqual(res['Content-Type'], 'image/png')
+            self.assertIn(f'max-age={settings.PUBLIC_IMAGE_CACHE_MAX_AGE}', res['Cache-Control'])
+            self.assertEqual(Image.open(io.BytesIO(b''.join(res.streaming_content))).size, (20, 10))
+
+            # images are not enlarged
+            res = self.client.get(url, {'size': 'large'})
+            self.assertEqual(Image.open(io.BytesIO(b''.join(res.streaming_content))).size, (60, 30))
+
+            res = self.client.get(url, {'size': 'huge'})
+            self.assertEqual(res.status_code, 400)
+
+    def test_failing_image_is_not_processed_again(self):
+        self.setup_objects()
+        with open(self.image_file.name, 'rb') as f:
+            self.client.post(f'/author/{self.author.id}/images/', {"image": f})
+        post = Post.objects.get(author=self.author)
+
+        with mock.patch('posts.images.resize_image', side_effect=ValueError('unexpected')):
+            self.assertEqual(process_pending_images(), 1)
+        self.assertEqual(post.image_derivatives.count(), len(settings.POST_IMAGE_SIZES))
+        self.assertEqual(process_pending_images(), 0)
+
+    def test_store_post_images(self):
+        self.setup_objects()
+        post = Post.objects.create(author=self.author, title='image', content_type=Post.ContentType.IMAGE_PNG,
+                                   content=self.file_in_bytes.decode('ascii'))
+
+        out = StringIO()
+        call_command('store_post_images', stdout=out)
+        self.assertIn('moved 1 image(s)', out.getvalue())
+
+        post = Post.objects.get(id=post.id)
+        self.assertEqual(post.content, "")
+        self.assertEqual(post.get_image_content(), self.file_in_bytes.decode('ascii'))
+
+    def test_store_image_content_of_foreign_post(self):
+        self.setup_objects()
+        post = Post(author=self.author, title='image', content_type=Post.ContentType.IMAGE_PNG,
+                    content='data:image/png;base64,' + self.file_in_bytes.decode('ascii'))
+        self.assertTrue(post.store_image_content())
+        self.assertEqual(post.get_image_content(), self.file_in_bytes.decode('ascii'))
+
+        # invalid base64 is kept as it was received
+        post = Post(author=self.author, title='image', content_type=Post.ContentType.IMAGE_PNG, content='abc')
+        self.assertFalse(post.store_image_content())
+        self.assertEqual(post.content, 'abc')
+
+class AllPostsTestCase(TestCase):
+    def setup_objects(self):
+        self.user = User.objects.create_user('test_username', 'test_email', 'test_pass')
+        self.author = Author.objects.create(user=self.user, display_name=self.user.username, is_internal=True)
+        self.foreign_author = Author.objects.create(display_name='foreign', url='http://foreign.example/author/1')
+        for i in range(3):
+            Post.objects.create(author=self.author, title=f"local_{i}", content="content")
+        Post.objects.create(author=self.foreign_author, title="foreign", content="content")
+
+    def test_get_all_posts_only_local(self):
+        self.setup_objects()
+        res = client.get('/posts/', format='json')
+        content = json.loads(res.content)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(content['count'], 3)
+        self.assertTrue(all(post['title'].startswith('local_') for post in content['items']))
+
+    def test_get_all_posts_paginated(self):
+        self.setup_objects()
+        res = client.get('/posts/?page=2&size=2', format='json')
+        content = json.loads(res.content)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(content['items']), 1)
+        # newest first
+        self.assertEqual(content['items'][0]['title'], 'local_0')
+
+class StreamTestCase(TestCase):
+    def setup_objects(self):
+        self.user = User.objects.create_user('test_username', 'test_email', 'test_pass')
+        self.client = client_with_auth(self.user, APIClient())
+        self.author = Author.objects.create(user=self.user, display_name=self.user.username, is_internal=True)
+        self.other_author = Author.objects.create(display_name='other', url='http://foreign.example/author/1')
+
+        self.own_post = Post.objects.create(author=self.author, title="own", content="content")
+        self.unlisted_post = Post.objects.create(author=self.author, title="unlisted", content="content", unlisted=True)
+        self.inbox_post = Post.objects.create(author=self.other_author, title="inbox", content="content")
+        InboxObject.objects.create(author=self.author, content_object=self.inbox_post)
+        Post.objects.create(author=self.other_author, title="not sent", content="content")
+
+    def get_stream_titles(self, url=None):
+        res = self.client.get(url or f'/author/{self.author.id}/stream/', format='json')
+        self.assertEqual(res.status_code, 200)
+        return [post['title'] for post in res.json()['items']], res.json()
+
+    def test_stream_items_are_written(self):
+        self.setup_objects()
+        titles, _ = self.get_stream_titles()
+        self.assertEqual(titles, ['inbox', 'own'])
+
+    def test_stream_follows_unlisted_and_inbox_changes(self):
+        self.setup_objects()
+        self.unlisted_post.unlisted = False
+        self.unlisted_post.save()
+        InboxObject.objects.get(author=self.author).delete()
+        titles, _ = self.get_stream_titles()
+        self.assertEqual(sorted(titles), ['own', 'unlisted'])
+
+    def test_stream_cursor_pagination(self):
+        self.setup_objects()
+        for i in range(4):
+            Post.objects.create(author=self.author, title=f"post_{i}", content="content")
+
+        titles, content = self.get_stream_titles(f'/author/{self.author.id}/stream/?size=4')
+        self.assertEqual(titles, ['post_3', 'post_2', 'post_1', 'post_0'])
+        self.assertIsNone(content['previous'])
+
+        titles, content = self.get_stream_titles(content['next'])
+        self.assertEqual(titles, ['inbox', 'own'])
+        self.assertIsNone(content['next'])
+
+        titles, content = self.get_stream_titles(content['previous'])
+        self.assertEqual(titles, ['post_3', 'post_2', 'post_1', 'post_0'])
+
+    def test_stream_of_other_author_forbidden(self):
+        self.setup_objects()
+        res = self.client.get(f'/author/{self.other_author.id}/stream/', format='json')
+        self.assertEqual(res.status_code, 403)
+
+    def test_rebuild_streams(self):
+        self.setup_objects()
+        StreamItem.objects.all().delete()
+        call_command('rebuild_streams', self.author.id, stdout=StringIO())
+        titles, _ = self.get_stream_titles()
+        self.assertEqual(titles, ['inbox', 'own'])
+
+
+class FastSerializerTestCase(TestCase):
+    """
+    the fast path of the list serializers renders the same json as the DRF fields
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('fast_user', password='fast_pass')
+        self.author = Author.objects.create(user=self.user, display_name='fast author', github_url='https://github.com/fast',
+                                            url='http://testserver/author/fast/', host='http://testserver/')
+        foreign_url = 'http://foreign.example/author/foreign/'
+        self.foreign_author = Author.objects.create(id=foreign_url, url=foreign_url, host='http://foreign.example/',
+                                                    display_name='', profile_image='http://foreign.example/me.png', profile_color=None)
+
+        self.post = Post.objects.create(author=self.author, title='title', description='description', content='content',
+                                        url='http://testserver/author/a/posts/1', visibility=Post.Visibility.PUBLIC)
+        self.foreign_post = Post.objects.create(author=self.foreign_author, title='foreign', description='', content='# content',
+                                                content_type=Post.ContentType.MARKDOWN, url='http://foreign.example/author/foreign/posts/2/',
+                                                unlisted=True, is_github=True)
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.image_post = Post.objects.create(author=self.author, title='image', content='', content_type=Post.ContentType.IMAGE_PNG,
+                                              url='http://testserver/author/a/posts/3')
+        self.image_post.image.save('red.png', ContentFile(base64.b64decode(ImageUploadTestCase.file_in_bytes)))
+
+        self.comment = Comment.objects.create(author=self.foreign_author, post=self.post, comment='nice', url=f'{self.post.url}/comments/1')
+        Comment.objects.create(author=self.author, post=self.post, comment='**thanks**', content_type=Post.ContentType.MARKDOWN)
+        Like.objects.create(author=self.author, summary='fast author likes your post', object=self.foreign_post.url)
+        Like.objects.create(author=self.foreign_author, summary='likes your comment', object=self.comment.url)
+        self.request = mock.Mock(user=self.user)
+
+    def assertSameJson(self, serializer_class, items):
+        items = list(items)
+        self.assertTrue(items)
+        fast = JSONRenderer().render(serializer_class(items, many=True, context={'request': self.request}).data)
+        drf = JSONRenderer().render([serializer_class(item, context={'request': self.request}).data for item in items])
+        self.assertEqual(fast, drf)
+
+    def test_authors(self):
+        self.assertSameJson(AuthorSerializer, Author.objects.order_by('id'))
+
+    def test_posts(self):
+        self.assertSameJson(PostSerializer, Post.objects.select_related('author').order_by('published'))
+        # fresh instances, with enum choices and timezone aware datetimes not read from the database
+        self.assertSameJson(PostSerializer, [self.post, self.foreign_post, self.image_post])
+
+    def test_comments(self):
+        self.assertSameJson(CommentSerializer, Comment.objects.select_related('author').order_by('published'))
+
+    def test_likes(self):
+        self.assertSameJson(LikeSerializer, Like.objects.select_related('author').order_by('id'))
+
+    def test_list_endpoint(self):
+        res = client_with_auth(self.user, APIClient()).get(f'/author/{self.author.id}/posts/')
+        self.assertEqual(res.status_code, 200)
+        posts = {post.url: post for post in Post.objects.filter(author=self.author)}
+        expected = [PostSerializer(posts[item['url']], context={'request': self.request}).data for item in res.data['items']]
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(JSONRenderer().render(res.data['items']), JSONRenderer().render(expected))
@@ -1,32 +1,30 @@
 
-from nodes.models import Node
-import requests
+from nodes.resolver import resolve_node
+from nodes.client import node_client
 from rest_framework import exceptions
 
 def try_get(request_url):
     # try without the auth
     # can either be a local author being followed or foreign server does not require auth
-    response = requests.get(request_url)
+    response = node_client.get(request_url)
     
     if response.status_code != 200:
-        nodes = [x for x in Node.objects.all() if x.host_url in request_url]
-        if len(nodes) != 1:
+        node = resolve_node(request_url)
+        if node is None:
             raise exceptions.NotFound("cannot find the node from foreign author url")
 
-        node = nodes[0]
-        response = requests.get(request_url, auth=node.get_basic_auth_tuple())
+        response = node_client.get(request_url, node=node)
     return response
 
 def try_delete(request_url):
     # try without the auth
     # can either be a local author being followed or foreign server does not require auth
-    response = requests.get(request_url)
+    response = node_client.get(request_url)
     
     if response.status_code != 200:
-        nodes = [x for x in Node.objects.all() if x.host_url in request_url]
-        if len(nodes) != 1:
+        node = resolve_node(request_url)
+        if node is None:
             raise exceptions.NotFound("cannot find the node from foreign author url")
 
-        node = nodes[0]
-        response = requests.delete(request_url, auth=node.get_basic_auth_tuple())
+        response = node_client.delete(request_url, node=node)
     return response
\ No newline at end of file
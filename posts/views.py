@@ -5,8 +5,9 @@ from itertools import chain
 
 from django.http.response import FileResponse, HttpResponse
 from django.shortcuts import get_object_or_404, render
+from django.conf import settings
+from django.db.models import Count, Max, Q
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.query_utils import Q
 
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from drf_spectacular.types import OpenApiTypes
@@ -20,11 +21,13 @@ from drf_spectacular.utils import OpenApiExample, extend_schema
 from authors.models import Author, InboxObject
 from authors.serializers import AuthorSerializer
 from nodes.models import connector_service, Node
-from github.utils import get_github_activity
+from nodes.client import node_client
+from nodes.resolver import resolve_node
+from social_distance.utils import add_cache_headers, get_not_modified_response, make_etag
 
-from .models import Post, Comment, Like
+from .models import Post, Comment, Like, StreamItem
 from .serializers import *
-from .pagination import CommentsPagination, PostsPagination
+from .pagination import CommentsPagination, PostsPagination, StreamPagination
 
 
 import uuid
@@ -34,56 +37,91 @@ def get_author_and_post(author_id, post_id):
     try:
         author = Author.objects.get(pk=author_id)
         post = Post.objects.get(pk=post_id)
-        if (post.author.id != author.id):
+        if (post.author_id != author.id):
             error_msg = "this author is not the post's poster"
             raise exceptions.PermissionDenied(error_msg)
+        # already fetched
+        post.author = author
     except (Author.DoesNotExist, Post.DoesNotExist):
         error_msg = "Author or Post id does not exist"
         raise exceptions.NotFound(error_msg)
 
     return (author, post)
 
+def get_post_comments(post_id):
+    return Comment.objects.filter(
+        post_id=post_id
+    ).select_related('author').order_by('-published')
+
+def add_comments_page_urls(data, comments_url):
+    data["id"] = comments_url
+    data["post"] = comments_url.replace("/comments/", "")
+    return data
+
+def get_post_version(request, post, like_counts):
+    """
+    everything PostDetail.get's response depends on, without serializing the post and its comments.
+    like_counts are the post's count_likes, also used by the response
+    """
+    user_id = request.user.id if request.user.is_authenticated else None
+    # the comments and their likes in a single query, the joined likes don't change the Max of the comments
+    aggregates = {
+        'published': Max('published'), 'author_updated': Max('author__updated'),
+        'like_count': Count('likes'), 'last_like': Max('likes__id'),
+    }
+    if user_id:
+        aggregates['liked'] = Count('likes', filter=Q(likes__author__user_id=user_id))
+    comments = Comment.objects.filter(post=post).aggregate(**aggregates)
+    return (
+        post.id, post.updated, post.author.updated, post.comment_count, comments,
+        like_counts, user_id, request.query_params.dict()
+    )
+
+def get_comments_page(request, post_id, comments_url):
+    """
+    the comments of the post, paginated and formatted like the response of CommentList.get
+    """
+    paginator = CommentsPagination()
+    comments = paginator.paginate_queryset(get_post_comments(post_id), request)
+    response = paginator.get_paginated_response(CommentSerializer(comments, many=True, context={'request': request}).data)
+    return add_comments_page_urls(response.data, comments_url)
+
+@extend_schema(
+    responses=PostSerializer(many=True)
+)
 @api_view(['GET'])
 def get_all_posts(request):
     """
     ## Description:
-    Get all posts from this server
+    Get all posts from this server (paginated)
     ## Responses:
-    **200**: successful GET request with data
+    **200**: successful GET request with data <br>
+    **404**: if the page is out of range
     """
-    posts = Post.objects.all()
-    posts = list(filter(lambda x: x.author.is_internal, posts))
+    posts = Post.objects.filter(author__is_internal=True).select_related('author').order_by('-published')
 
-    return Response(PostSerializer(posts, many=True).data)
+    paginator = PostsPagination()
+    paginated_posts = paginator.paginate_queryset(posts, request)
+    return paginator.get_paginated_response(PostSerializer(paginated_posts, many=True, context={'request': request}).data)
 
 class StreamList(ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = PostSerializer
+    pagination_class = StreamPagination
 
     def get_queryset(self):
         """
-        return a list of posts consist of:
+        return the author's stream items, which point to:
         - posts created by the current author
         - posts sent to the author's inbox
+        - the author's github events, fetched in the background by the `poll_github` command
         """
-        # https://docs.djangoproject.com/en/3.2/ref/contrib/contenttypes/#methods-on-contenttype-instances
-        # the Post type, in content type representation
         author = get_object_or_404(Author, pk=self.kwargs.get('author_id'))
 
         if not author.user == self.request.user:
             raise exceptions.PermissionDenied("the logged in user cannot access other streams except that of itself")
 
-        post_content_type = ContentType.objects.get(app_label="posts", model="post")
-
-        inbox_posts = [inbox.content_object for inbox in InboxObject.objects.filter(author=author, content_type=post_content_type)]
-        own_posts = Post.objects.filter(author=author, unlisted=False)
-        github_activities = get_github_activity(author.github_url, author)
-
-        return sorted(
-            filter(lambda post: post is not None, chain(inbox_posts, own_posts, github_activities)),
-            key=lambda post: post.published,
-            reverse=True
-        )
+        return StreamItem.objects.filter(author=author).select_related('author', 'post__author', 'github_event')
 
     def get(self, request, *args, **kwargs):
         """
@@ -93,11 +131,15 @@ class StreamList(ListAPIView):
         * Author's own posts
         * Author's inbox
         * Author's github events (if github_url is provided)
+
+        Newest first, paginated with a cursor: follow the `next` and `previous` links in the response
         ## Responses:
         **200**: for successful GET request <br>
         **403**: if the author is not authenticated
         """
-        return super().list(request, *args, **kwargs)
+        stream_items = self.paginate_queryset(self.get_queryset())
+        posts = [stream_item.to_post() for stream_item in stream_items]
+        return self.get_paginated_response(self.get_serializer(posts, many=True).data)
 
 class PostDetail(APIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
@@ -120,16 +162,22 @@ class PostDetail(APIView):
         if post.visibility != Post.Visibility.PUBLIC and request.user != post.author.user:
             raise exceptions.PermissionDenied
 
-        serializer = PostSerializer(post, many=False, context={'author_id': author_id})
+        # liked depends on the user, so only anonymous responses are shared
+        public = post.visibility == Post.Visibility.PUBLIC and not request.user.is_authenticated
+        like_counts = count_likes([post], request)
+        etag = make_etag(*get_post_version(request, post, like_counts))
+        not_modified = get_not_modified_response(request, etag, public=public)
+        if not_modified:
+            return not_modified
+
+        serializer = PostSerializer(post, many=False, context={'author_id': author_id, 'request': request, 'like_counts': like_counts})
         response = serializer.data
-        # making an internal API call is not usually the best way to do this
-        # but currently only this solution works 
         try:
-            # need a try block for unit test because url is not built for testing purpose
-            response["commentsSrc"] = requests.get(response["comments"]).json()
-        except:
+            response["commentsSrc"] = get_comments_page(request, post.id, response["comments"])
+        except exceptions.NotFound:
+            # the requested comments page is out of range, leave out the comments
             pass
-        return Response(response)
+        return add_cache_headers(Response(response), etag, public=public)
     
     def post(self, request, author_id, post_id):
         """
@@ -232,7 +280,7 @@ class PostList(ListCreateAPIView):
             self.posts = Post.objects.filter(
                 author_id=author_id,
                 unlisted=False,
-            ).order_by('-published')
+            ).select_related('author').order_by('-published')
         except (KeyError, Author.DoesNotExist):
             error_msg = "Author id not found"
             return Response(error_msg, status=status.HTTP_404_NOT_FOUND)
@@ -275,15 +323,11 @@ class CommentList(ListCreateAPIView):
         post_id = kwargs.get("post_id")
         _, _ = get_author_and_post(author_id, post_id)
        
-        self.comments = Comment.objects.filter(
-            post_id=post_id
-        ).order_by('-published')
+        self.comments = get_post_comments(post_id)
  
         response = super().list(request, *args, **kwargs)
         # '?' excludes query parameter
-        request_url = request.build_absolute_uri('?')
-        response.data["id"] = request_url
-        response.data["post"] = request_url.replace("/comments/", "")
+        add_comments_page_urls(response.data, request.build_absolute_uri('?'))
         return response
 
     def post(self, request, author_id, post_id):
@@ -338,15 +382,14 @@ class CommentList(ListCreateAPIView):
         try:
             # notify if the post author is foreign
             if not post.author.is_internal:
-                nodes = [x for x in Node.objects.all() if x.host_url in post.author.url]
-                if len(nodes) != 1:
+                node = resolve_node(post.author.url)
+                if node is None:
                     raise exceptions.NotFound("cannot find the node from foreign author url")
-                node = nodes[0]
                 # send to {post.origin}/comments/
                 # print("POST comments: sending to {}".format(node.host_url))
                 origin_url = post.origin if post.origin[-1] != "/" else post.origin[:-1]
                 # print("POST comments: request data: {}".format(serializer.data))
-                res = requests.post(origin_url + '/comments/', json=serializer.data, auth=node.get_basic_auth_tuple())
+                res = node_client.post(origin_url + '/comments/', node=node, json=serializer.data)
                 # print("POST comments: response: {}".format(res.text))
         except:
             pass
@@ -377,8 +420,15 @@ class CommentDetail(APIView):
             error_msg = "Comment id is not valid"
             return Response(error_msg, status=status.HTTP_404_NOT_FOUND)
     
-        serializer = CommentSerializer(comment, many=False)
-        return Response(serializer.data)
+        user_id = request.user.id if request.user.is_authenticated else None
+        etag = make_etag(comment.id, comment.published, comment.author.updated, count_likes([comment], request), user_id)
+        public = post.visibility == Post.Visibility.PUBLIC and not request.user.is_authenticated
+        not_modified = get_not_modified_response(request, etag, public=public)
+        if not_modified:
+            return not_modified
+
+        serializer = CommentSerializer(comment, many=False, context={'request': request})
+        return add_cache_headers(Response(serializer.data), etag, public=public)
 
 
 class LikesPostList(APIView):
@@ -402,7 +452,7 @@ class LikesPostList(APIView):
             error_msg = "Author or Post id not found"
             return Response(error_msg, status=status.HTTP_404_NOT_FOUND)
 
-        likes = Like.objects.filter(Q(object=post.url) | Q(object=post.url[:-1]))
+        likes = Like.objects.filter(target=Like.get_target(post.url)).select_related('author')
         serializer = LikeSerializer(likes, many=True)
         return Response(serializer.data)
 
@@ -426,14 +476,14 @@ class LikesCommentList(APIView):
     
         try:
             comment = Comment.objects.get(pk=comment_id)
-            if comment.post.id != post.id:
+            if comment.post_id != post.id:
                 error_msg = "the comment id is not related to the post id"
                 return Response(error_msg, status=status.HTTP_403_FORBIDDEN)
         except:
             error_msg = "Comment id is not valid"
             return Response(error_msg, status=status.HTTP_404_NOT_FOUND)
 
-        likes = Like.objects.filter(Q(object=comment.url) | Q(object=comment.url[:-1]))
+        likes = Like.objects.filter(target=Like.get_target(comment.url)).select_related('author')
         serializer = LikeSerializer(likes, many=True)
         return Response(serializer.data)
 
@@ -455,7 +505,7 @@ class LikedList(APIView):
             error_msg = "Author not found"
             return Response(error_msg, status=status.HTTP_404_NOT_FOUND)
 
-        likes = Like.objects.filter(author=author)
+        likes = Like.objects.filter(author=author).select_related('author')
         serializer = LikeSerializer(likes, many=True)
         response = {
             "type": "liked",
@@ -520,8 +570,11 @@ def get_image(request, author_id, image_post_id):
     **[INTERNAL]** <br>
     ## Description:
     Used internally to get a image
+
+    `?size=thumbnail` (or another size in the POST_IMAGE_SIZES setting) returns a resized copy
     ## Responses:
     **200**: for successful GET request
+    **400**: if the size is not valid
     **403**: if user is not authenticated as author
     """
     author, post = get_author_and_post(author_id, image_post_id)
@@ -532,14 +585,37 @@ def get_image(request, author_id, image_post_id):
             raise exceptions.PermissionDenied('authentication required for this image')
         # TODO check if user has access to this image: friends of the author, author itself...
 
-    if not 'image' in post.content_type:
+    if not post.is_image():
         raise exceptions.NotFound
 
-    content = post.content
-    if type(content) == str:
-        content = content.encode('ascii')
-
-    return HttpResponse(base64.decodestring(content), content_type=post.content_type)
+    # a resized copy, the original is served until it's created by the process_images command
+    size = request.query_params.get('size')
+    image = post.image
+    last_modified = post.updated
+    if size:
+        if size not in settings.POST_IMAGE_SIZES:
+            raise exceptions.ParseError(f"size should be one of {', '.join(settings.POST_IMAGE_SIZES)}")
+        derivative = post.image_derivatives.filter(size=size).first()
+        if derivative:
+            image = derivative.image
+            last_modified = max(last_modified, derivative.created_at)
+
+    public = post.visibility == Post.Visibility.PUBLIC
+    etag = make_etag(post.id, image.name, post.updated)
+    cache_args = {'public': public, 'max_age': settings.PUBLIC_IMAGE_CACHE_MAX_AGE}
+    if size and not derivative:
+        # the original standing in for the resized copy, caches have to revalidate to get the copy once it exists
+        cache_args['max_age'] = 0
+    not_modified = get_not_modified_response(request, etag, last_modified, **cache_args)
+    if not_modified:
+        return not_modified
+
+    if image:
+        response = FileResponse(image.open('rb'), content_type=post.get_image_mime_type())
+    else:
+        # base64 content that is not moved to the image storage yet, see the store_post_images command
+        response = HttpResponse(base64.b64decode(post.content), content_type=post.get_image_mime_type())
+    return add_cache_headers(response, etag, last_modified, **cache_args)
 
 @api_view(['POST'])
 def upload_image(request, author_id):
@@ -581,9 +657,10 @@ def upload_image(request, author_id):
 
     if ser.is_valid():
         content_type = ser.validated_data['image'].content_type
-        image_data = base64.b64encode(ser.validated_data['image'].read()).decode('ascii')
 
-        image_post = Post(author=author, title='Uploaded Image', description='', content_type=content_type, content=image_data, visibility=ser.validated_data['visibility'], unlisted=ser.validated_data['unlisted'])
+        image_post = Post(author=author, title='Uploaded Image', description='', content_type=content_type, visibility=ser.validated_data['visibility'], unlisted=ser.validated_data['unlisted'])
+        # written to the image storage in chunks
+        image_post.store_image(ser.validated_data['image'])
         image_post.update_fields_with_request(request)
         return Response({'url': image_post.get_image_url()})
     
@@ -624,6 +701,8 @@ def share_post_friends(request, author_id, post_id):
     # duplicate the post
     shared_post = last_post
     shared_post.pk = None
+    # the copy has no comments yet
+    shared_post.comment_count = 0
     shared_post.save()
 
     # modify author to be current logged in author
@@ -674,6 +753,8 @@ def share_post_followers(request, author_id, post_id):
     # duplicate the post
     shared_post = last_post
     shared_post.pk = None
+    # the copy has no comments yet
+    shared_post.comment_count = 0
     shared_post.save()
 
     # modify author to be current logged in author
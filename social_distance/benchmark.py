@@ -0,0 +1,246 @@
+"""
+Load generation for the benchmark command.
+
+A Benchmark seeds local authors, foreign followers hosted on a StubPeer (see social_distance/stub_peer.py)
+and a node for the peer, then runs a random mix of operations through the test client:
+creating posts (and delivering them to the followers' inboxes), reading streams and inboxes,
+following foreign authors and liking posts. Every operation records its latency and number of queries.
+
+benchmark_serializers compares the DRF serializers of the list endpoints with their fast_representation.
+"""
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import quote
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authors.models import Author, Follow
+from authors.serializers import AuthorSerializer
+from nodes.delivery import process_jobs
+from nodes.models import Node
+from posts.models import Comment, Like, Post
+from posts.serializers import CommentSerializer, LikeSerializer, PostSerializer
+
+# relative weight of each operation in the mix
+DEFAULT_MIX = {
+    'create_post': 2,
+    'read_stream': 4,
+    'read_inbox': 2,
+    'follow': 1,
+    'like': 2,
+}
+
+# the host of the requests, "testserver" is not a valid url host for the serializers
+LOCAL_HOST = 'localhost'
+
+
+def percentile(values, percent):
+    """
+    nearest-rank percentile of the values
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class Benchmark:
+    def __init__(self, peer, num_authors=20, followers_per_author=10, posts_per_author=5, mix=None, seed=0, batch_inbox=False):
+        self.peer = peer
+        self.num_authors = num_authors
+        self.followers_per_author = followers_per_author
+        self.posts_per_author = posts_per_author
+        self.mix = mix or DEFAULT_MIX
+        self.random = random.Random(seed)
+        self.batch_inbox = batch_inbox
+        # {operation: [(seconds, number of queries, status code)]}
+        self.results = defaultdict(list)
+        self.elapsed = 0
+
+    def seed(self):
+        Node.objects.create(
+            name='stub peer', host_url=self.peer.url, username='stub', password='stub',
+            batch_inbox_url=f"{self.peer.url}inbox/" if self.batch_inbox else ""
+        )
+
+        self.authors = []
+        self.clients = {}
+        for i in range(self.num_authors):
+            user = User.objects.create_user(f'bench_{i}_{uuid.uuid4().hex[:8]}', password=uuid.uuid4().hex)
+            author = Author.objects.create(user=user, display_name=f'bench {i}', is_internal=True, host=f'http://{LOCAL_HOST}/')
+            author.url = f'http://{LOCAL_HOST}/author/{author.id}'
+            author.save()
+            self.authors.append(author)
+
+            client = APIClient(SERVER_NAME=LOCAL_HOST)
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+            self.clients[author.id] = client
+
+            for j in range(self.followers_per_author):
+                foreign_url = self.peer.author_url(f'follower-{i}-{j}')
+                follower = Author.objects.create(id=foreign_url, url=foreign_url, host=self.peer.url, display_name=f'follower {i}-{j}')
+                Follow.objects.create(actor=follower, object=author, status=Follow.FollowStatus.ACCEPTED, summary='follow')
+
+        for author in self.authors:
+            for _ in range(self.posts_per_author):
+                self.create_post(author)
+        self.results.clear()
+        self.following_count = 0
+
+    def record(self, operation, fn):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            status_code = fn()
+            elapsed = time.perf_counter() - started
+        self.results[operation].append((elapsed, len(queries), status_code))
+
+    def pick_author(self):
+        return self.random.choice(self.authors)
+
+    def create_post(self, author):
+        client = self.clients[author.id]
+        self.record('POST posts', lambda: client.post(f'/author/{author.id}/posts/', {
+            'title': 'benchmark post',
+            'description': '',
+            'contentType': 'text/plain',
+            'content': 'hello ' * 50,
+            'visibility': 'PUBLIC',
+            'unlisted': False,
+        }, format='json').status_code)
+        # the fan-out to the followers' inboxes, done by the deliver_posts worker
+        self.record('deliver posts', self.deliver_posts)
+
+    def deliver_posts(self):
+        process_jobs()
+        return 200
+
+    def read_stream(self, author):
+        self.record('GET stream', lambda: self.clients[author.id].get(f'/author/{author.id}/stream/?size=20').status_code)
+
+    def read_inbox(self, author):
+        self.record('GET inbox', lambda: self.clients[author.id].get(f'/author/{author.id}/inbox/?size=20').status_code)
+
+    def follow(self, author):
+        # a foreign author never followed before, fetched from the peer
+        self.following_count += 1
+        foreign_url = self.peer.author_url(f'followed-{self.following_count}')
+        client = self.clients[author.id]
+        self.record('POST following', lambda: client.post(f'/author/{author.id}/followings/{quote(foreign_url, safe="")}').status_code)
+
+    def like(self, author):
+        # picked with self.random, so a seed replays the same likes. the ids are random, published is the creation order
+        posts = Post.objects.exclude(author=author).exclude(likes__author=author).order_by('published', 'id')
+        count = posts.count()
+        if not count:
+            return
+        post = posts[self.random.randrange(count)]
+        like = {
+            'type': 'Like',
+            'summary': f'{author.display_name} likes your post',
+            'author': AuthorSerializer(author).data,
+            'object': post.url,
+        }
+        client = self.clients[author.id]
+        self.record('POST like (inbox)', lambda: client.post(f'/author/{post.author_id}/inbox/', like, format='json').status_code)
+
+    def run(self, num_operations):
+        operations = {
+            'create_post': self.create_post,
+            'read_stream': self.read_stream,
+            'read_inbox': self.read_inbox,
+            'follow': self.follow,
+            'like': self.like,
+        }
+        names = [name for name in self.mix if self.mix[name] > 0]
+        weights = [self.mix[name] for name in names]
+
+        started = time.perf_counter()
+        for _ in range(num_operations):
+            name = self.random.choices(names, weights)[0]
+            operations[name](self.pick_author())
+        self.elapsed = time.perf_counter() - started
+
+    def report(self):
+        """
+        the results per operation: count, errors, latency percentiles (ms), mean queries, and throughput (per second)
+        """
+        rows = []
+        for operation, results in sorted(self.results.items()):
+            latencies = [elapsed * 1000 for elapsed, _, _ in results]
+            rows.append({
+                'operation': operation,
+                'count': len(results),
+                'errors': sum(1 for _, _, status_code in results if not status_code or status_code >= 400),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'queries': sum(queries for _, queries, _ in results) / len(results),
+                'throughput': len(results) / self.elapsed if self.elapsed else 0,
+            })
+        return rows
+
+
+def get_serializer_pages(num_items):
+    """
+    {name: (serializer class, page of num_items unsaved objects)}, with the like counts of the posts and comments
+    """
+    now = timezone.now()
+    host = f'http://{LOCAL_HOST}/'
+    authors = [
+        Author(id=f'{host}author/{i}', url=f'{host}author/{i}', host=host, display_name=f'author {i}',
+               github_url=f'https://github.com/author{i}' if i % 2 else None)
+        for i in range(num_items)
+    ]
+    posts = [
+        Post(id=str(i), url=f'{authors[i].url}/posts/{i}', source=f'{authors[i].url}/posts/{i}', origin=f'{authors[i].url}/posts/{i}',
+             author=authors[i], title=f'post {i}', description='description', content='hello ' * 50, comment_count=i % 7, published=now)
+        for i in range(num_items)
+    ]
+    comments = [
+        Comment(id=str(i), url=f'{posts[i].url}/comments/{i}', post=posts[i], author=authors[-i], comment='comment ' * 10, published=now)
+        for i in range(num_items)
+    ]
+    likes = [
+        Like(author=authors[i], summary=f'author {i} likes your post', object=posts[-i].url)
+        for i in range(num_items)
+    ]
+    like_counts = {Like.get_target(obj.url): (i % 5, i % 2 == 0) for i, obj in enumerate(posts + comments)}
+    return {
+        'authors': (AuthorSerializer, authors),
+        'posts': (PostSerializer, posts),
+        'comments': (CommentSerializer, comments),
+        'likes': (LikeSerializer, likes),
+    }, like_counts
+
+
+def benchmark_serializers(num_items=1000, repeat=5):
+    """
+    best seconds to serialize and render a page of num_items authors, posts, comments and likes,
+    field by field with to_representation and with fast_representation: [{name, drf, fast, identical}]
+    """
+    pages, like_counts = get_serializer_pages(num_items)
+    renderer = JSONRenderer()
+    rows = []
+    for name, (serializer_class, items) in pages.items():
+        child = serializer_class(items, many=True, context={'like_counts': like_counts}).child
+        outputs = {}
+        timings = {}
+        for path, represent in [('drf', child.to_representation), ('fast', child.fast_representation)]:
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                outputs[path] = renderer.render([represent(item) for item in items])
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[path] = best
+        rows.append({'name': name, **timings, 'identical': outputs['drf'] == outputs['fast']})
+    return rows
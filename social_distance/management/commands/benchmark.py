@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from social_distance.benchmark import DEFAULT_MIX, Benchmark
+from social_distance.stub_peer import StubPeer
+
+
+def parse_mix(value):
+    # e.g. "create_post=2,read_stream=4"
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise CommandError(f"unknown operation {name!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = "Run a mixed workload against a throwaway copy of the database and a stub foreign server (see social_distance/benchmark.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=500, help="number of operations to run")
+        parser.add_argument('--authors', type=int, default=20, help="number of local authors")
+        parser.add_argument('--followers', type=int, default=10, help="foreign followers of each local author, on the stub server")
+        parser.add_argument('--posts', type=int, default=5, help="posts of each local author created before the run")
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                            help=f"weights of the operations, default: {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())}")
+        parser.add_argument('--peer-latency', type=float, default=0.02, help="mean seconds the stub server takes to respond")
+        parser.add_argument('--peer-error-rate', type=float, default=0.0, help="fraction of stub server responses that are 500s")
+        parser.add_argument('--batch-inbox', action='store_true', help="deliver posts through the stub server's batch inbox")
+        parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed runs the same operations")
+        parser.add_argument('--json', action='store_true', help="print the results as json")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # the benchmark writes a lot, so it runs on a test database created (and destroyed) for it
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with StubPeer(latency=options['peer_latency'], error_rate=options['peer_error_rate'], seed=options['seed']) as peer:
+                benchmark = Benchmark(
+                    peer,
+                    num_authors=options['authors'],
+                    followers_per_author=options['followers'],
+                    posts_per_author=options['posts'],
+                    mix=options['mix'],
+                    seed=options['seed'],
+                    batch_inbox=options['batch_inbox'],
+                )
+                benchmark.seed()
+                benchmark.run(options['operations'])
+                rows = benchmark.report()
+                peer_requests = dict(peer.requests)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'elapsed': benchmark.elapsed,
+                'operations': rows,
+                'peer_requests': {f"{method} {endpoint}": count for (method, endpoint), count in peer_requests.items()},
+            }, indent=2))
+            return
+
+        self.stdout.write(f"{'operation':<20} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'ops/s':>8}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['operation']:<20} {row['count']:>6} {row['errors']:>6} {row['p50']:>8.1f} {row['p95']:>8.1f} "
+                f"{row['p99']:>8.1f} {row['queries']:>8.1f} {row['throughput']:>8.1f}"
+            )
+        total = sum(row['count'] for row in rows)
+        self.stdout.write(f"\n{total} operations in {benchmark.elapsed:.2f}s ({total / benchmark.elapsed if benchmark.elapsed else 0:.1f}/s)")
+        self.stdout.write("stub server requests: " + ", ".join(f"{method} {endpoint}: {count}" for (method, endpoint), count in sorted(peer_requests.items())))
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from social_distance.benchmark import benchmark_serializers
+
+
+class Command(BaseCommand):
+    help = "Compare the DRF serializers of the list endpoints with their fast path (see social_distance/benchmark.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help="number of items per page")
+        parser.add_argument('--repeat', type=int, default=5, help="runs of each serializer, the best one is reported")
+        parser.add_argument('--json', action='store_true', help="print the results as json")
+
+    def handle(self, *args, **options):
+        rows = benchmark_serializers(num_items=options['items'], repeat=options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+
+        self.stdout.write(f"{options['items']} items per page, serialized and rendered to json")
+        self.stdout.write(f"{'page':<10} {'drf ms':>8} {'fast ms':>8} {'speedup':>8} {'identical':>10}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['name']:<10} {row['drf'] * 1000:>8.1f} {row['fast'] * 1000:>8.1f} "
+                f"{row['drf'] / row['fast']:>7.1f}x {'yes' if row['identical'] else 'NO':>10}"
+            )
@@ -0,0 +1,201 @@
+"""
+Request performance metrics.
+
+PerformanceMiddleware measures a fraction (PERFORMANCE_SAMPLE_RATE) of the requests: SQL queries and their time,
+requests to other servers (through nodes.client.node_client, e.g. foreign nodes and GitHub) and their time,
+the time spent rendering the response json, and the total time. The totals per view are served in the Prometheus
+text format by the /metrics/ endpoint (see social_distance/views.py). Measured responses to staff users
+(or to everyone with SERVER_TIMING_PUBLIC) also get a Server-Timing header.
+
+The totals are kept in memory, so each server process reports its own.
+"""
+import contextvars
+import hmac
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.renderers import JSONRenderer
+
+# upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# metrics of the request being handled, None if it's not measured
+_current_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.http_count = 0
+        self.http_time = 0.0
+        self.render_time = 0.0
+        self.total_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        # a database execute_wrapper, see https://docs.djangoproject.com/en/3.2/topics/db/instrumentation/
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_count += 1
+            self.db_time += time.perf_counter() - started
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def get_server_timing(self):
+        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing, durations in milliseconds
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_count} queries"',
+            f'http;dur={self.http_time * 1000:.1f};desc="{self.http_count} outbound requests"',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ])
+
+
+@contextmanager
+def track_outbound_request():
+    """
+    count the request to another server made in the block, if the current request is measured
+    """
+    metrics = _current_metrics.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.http_count += 1
+            metrics.http_time += time.perf_counter() - started
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+    the default json renderer, timing the rendering of measured requests
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        started = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            metrics.render_time += time.perf_counter() - started
+
+
+class MetricsRegistry:
+    """
+    totals of the measured requests, per (view, method, status)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.requests = defaultdict(lambda: {
+                'count': 0, 'duration': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+                'db_count': 0, 'db_time': 0.0, 'http_count': 0, 'http_time': 0.0, 'render_time': 0.0,
+            })
+
+    def observe(self, view, method, status_code, metrics: RequestMetrics):
+        with self._lock:
+            totals = self.requests[(view, method, str(status_code))]
+            totals['count'] += 1
+            totals['duration'] += metrics.total_time
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if metrics.total_time <= bound:
+                    totals['buckets'][i] += 1
+            totals['db_count'] += metrics.db_count
+            totals['db_time'] += metrics.db_time
+            totals['http_count'] += metrics.http_count
+            totals['http_time'] += metrics.http_time
+            totals['render_time'] += metrics.render_time
+
+    def render(self):
+        """
+        the totals in the Prometheus text format, https://prometheus.io/docs/instrumenting/exposition_formats/
+        """
+        counters = [
+            ('db_count', 'social_distance_db_queries_total', 'SQL queries run by the requests'),
+            ('db_time', 'social_distance_db_query_seconds_total', 'time spent in SQL queries'),
+            ('http_count', 'social_distance_outbound_requests_total', 'requests made to other servers'),
+            ('http_time', 'social_distance_outbound_request_seconds_total', 'time spent in requests to other servers'),
+            ('render_time', 'social_distance_render_seconds_total', 'time spent rendering the response json'),
+        ]
+        with self._lock:
+            requests = {key: {**totals, 'buckets': list(totals['buckets'])} for key, totals in self.requests.items()}
+
+        lines = [
+            '# HELP social_distance_request_duration_seconds time to handle the requests',
+            '# TYPE social_distance_request_duration_seconds histogram',
+        ]
+        for (view, method, status_code), totals in sorted(requests.items()):
+            labels = f'view="{view}",method="{method}",status="{status_code}"'
+            for bound, count in zip(DURATION_BUCKETS, totals['buckets']):
+                lines.append(f'social_distance_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'social_distance_request_duration_seconds_bucket{{{labels},le="+Inf"}} {totals["count"]}')
+            lines.append(f'social_distance_request_duration_seconds_sum{{{labels}}} {totals["duration"]:.6f}')
+            lines.append(f'social_distance_request_duration_seconds_count{{{labels}}} {totals["count"]}')
+
+        for field, name, description in counters:
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            for (view, method, status_code), totals in sorted(requests.items()):
+                lines.append(f'{name}{{view="{view}",method="{method}",status="{status_code}"}} {totals[field]:g}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    authenticates the scraper of /metrics/ with "Authorization: Bearer <METRICS_TOKEN>", as an anonymous user
+    """
+    def authenticate(self, request):
+        parts = get_authorization_header(request).split()
+        if not settings.METRICS_TOKEN or len(parts) != 2 or parts[0].lower() != b'bearer':
+            return None
+        if not hmac.compare_digest(parts[1], settings.METRICS_TOKEN.encode()):
+            # may still be a jwt
+            return None
+        return AnonymousUser(), None
+
+
+def get_view_name(request):
+    # the url pattern name, so the number of label values stays bounded
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name or match.url_name or 'unnamed') if match else 'unmatched'
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.PERFORMANCE_SAMPLE_RATE < 1 and random.random() >= settings.PERFORMANCE_SAMPLE_RATE:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            with connection.execute_wrapper(metrics.record_query):
+                response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        metrics.finish()
+
+        # the timings tell how the server works, not for every client to see
+        user = getattr(request, 'user', None)
+        if settings.SERVER_TIMING_PUBLIC or (user is not None and user.is_staff):
+            response['Server-Timing'] = metrics.get_server_timing()
+        registry.observe(get_view_name(request), request.method, response.status_code, metrics)
+        return response
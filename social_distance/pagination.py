@@ -1,15 +1,49 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import datetime
+import json
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 class PageSizePagination(PageNumberPagination):
     page_size_query_param = 'size' # use query param 'size'
     key = 'items'
     type = 'objects'
 
+    # passing the 'cursor' query param (empty for the first page) switches to keyset pagination,
+    # see KeysetPagination. No count is returned in that mode.
+    cursor_query_param = 'cursor'
+    # what the cursor mode paginates on. Defaults to (published, id) if the model has published, or the primary key.
+    cursor_ordering = None
+
     def __init__(self):
         super().__init__()
+        self.keyset = None
+
+    def get_cursor_ordering(self, queryset):
+        if self.cursor_ordering:
+            return self.cursor_ordering
+        field_names = [field.name for field in queryset.model._meta.get_fields()]
+        return ('-published', '-pk') if 'published' in field_names else ('-pk',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params and isinstance(queryset, QuerySet):
+            self.keyset = KeysetPagination()
+            self.keyset.ordering = self.get_cursor_ordering(queryset)
+            self.keyset.key = self.key
+            self.keyset.type = self.type
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
 
     def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
         response = {}
         # include the response type if it exist
         if hasattr(self, 'type'):
@@ -42,6 +76,164 @@ class PageSizePagination(PageNumberPagination):
                     'type': 'integer',
                     'example': 123,
                 },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'description': 'only in cursor mode, instead of page and count',
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                    'description': 'only in cursor mode, instead of page and count',
+                },
+                self.key: schema,
+            },
+        }
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates on the `ordering` fields, e.g. (published, id), instead of page numbers:
+    each page is a filter on the last (or first) item of the previous page, so no COUNT(*) or
+    OFFSET is needed, and a deep page costs the same as the first one.
+
+    The position is passed around as an opaque cursor in the `cursor` query param,
+    see `next` and `previous` in the response.
+    """
+    page_size_query_param = 'size'
+    cursor_query_param = 'cursor'
+    # all fields must be ordered in the same direction, and together be unique
+    ordering = ('-published', '-id')
+    key = 'items'
+    type = 'objects'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            # walk backward from the first item of the current page
+            ordering = [self.invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(ordering, position))
+
+        # fetch one more item to know if there's a page after this one
+        items = list(queryset[:self.page_size + 1])
+        has_more = len(items) > self.page_size
+        items = items[:self.page_size]
+        if reverse:
+            items.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = items
+        return items
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return page_size
+        except (KeyError, ValueError):
+            pass
+        return api_settings.PAGE_SIZE
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def get_position_filter(ordering, position):
+        """
+        the filter for items strictly after position in the given ordering, e.g. for ('-published', '-id'):
+        published < p OR (published = p AND id < i)
+        """
+        position_filter = Q()
+        for index in reversed(range(len(ordering))):
+            field = ordering[index].lstrip('-')
+            lookup = 'lt' if ordering[index].startswith('-') else 'gt'
+            equal_fields = {ordering[i].lstrip('-'): position[i] for i in range(index)}
+            position_filter |= Q(**equal_fields, **{f'{field}__{lookup}': position[index]})
+        return position_filter
+
+    def get_position(self, item):
+        return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, item, reverse):
+        values = [
+            {'d': value.isoformat()} if isinstance(value, datetime.datetime) else value
+            for value in self.get_position(item)
+        ]
+        data = json.dumps({'p': values, 'r': reverse}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """
+        returns (position, reverse) of the cursor in the request, position is None for the first page
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            position = [
+                parse_datetime(value['d']) if isinstance(value, dict) else value
+                for value in data['p']
+            ]
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return position, bool(data['r'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise exceptions.NotFound('invalid cursor')
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {}
+        if hasattr(self, 'type'):
+            response['type'] = self.type
+        response.update({
+            'size': self.page_size,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            self.key: data
+        })
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'type': {
+                    'type': 'string',
+                    'example': 'objects'
+                },
+                'size': {
+                    'type': 'integer',
+                    'example': 123,
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                },
                 self.key: schema,
             },
         }
@@ -17,23 +17,22 @@ import os
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
 
+# load what's in .env to environment vars, accessible via os.getenv
+load_dotenv()
+
 sentry_sdk.init(
     dsn="https://d5749eea89424b0dbe5cd88e3b8186c9@o1078280.ingest.sentry.io/6081879",
     integrations=[DjangoIntegration()],
 
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    # We recommend adjusting this value in production.
-    traces_sample_rate=1.0,
+    # fraction of the transactions traced for performance monitoring,
+    # requests are also measured by social_distance/metrics.py (see PERFORMANCE_SAMPLE_RATE)
+    traces_sample_rate=float(os.getenv('SENTRY_TRACES_SAMPLE_RATE', 0.1)),
 
     # If you wish to associate users to errors (assuming you are using
     # django.contrib.auth) you may enable sending PII data.
     send_default_pii=True
 )
 
-# load what's in .env to environment vars, accessible via os.getenv
-load_dotenv()
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -105,6 +104,11 @@ REST_FRAMEWORK = {
         # 'rest_framework.authentication.SessionAuthentication', # we don't use django built-in session, which imposes csrf
     ],
     'DEFAULT_PAGINATION_CLASS': 'social_distance.pagination.PageSizePagination',
+    # the json renderer times the serialization of the responses, see social_distance/metrics.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'social_distance.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'PAGE_SIZE': 5 # default number of items per page
 }
 
@@ -121,6 +125,8 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    # first, so it measures the whole request
+    'social_distance.metrics.PerformanceMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -200,7 +206,97 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = Path.joinpath(BASE_DIR, 'static')
 
+# Files of image posts, see posts/storage.py
+# the filesystem storage only suits a persistent disk, use e.g. a django-storages backend otherwise
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', Path.joinpath(BASE_DIR, 'media'))
+POST_IMAGE_STORAGE = os.getenv('POST_IMAGE_STORAGE', 'django.core.files.storage.FileSystemStorage')
+POST_IMAGE_STORAGE_OPTIONS = {}
+# resized copies of the images, served with get_image?size=<name>: {name: maximum width and height in pixels}
+POST_IMAGE_SIZES = {
+    'thumbnail': 150,
+    'small': 480,
+    'medium': 1080,
+}
+
+# seconds a CDN or proxy can cache public posts, authors and comments, see social_distance/utils.py add_cache_headers
+PUBLIC_CACHE_MAX_AGE = int(os.getenv('PUBLIC_CACHE_MAX_AGE', 60))
+# same for public images, which never change
+PUBLIC_IMAGE_CACHE_MAX_AGE = int(os.getenv('PUBLIC_IMAGE_CACHE_MAX_AGE', 86400))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# per process and bounded by default, set CACHE_BACKEND and CACHE_LOCATION to share it (e.g. redis)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'social-distance'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 1000)),
+        },
+    }
+}
+
+# Proxy cache, see nodes/proxy.py
+# seconds foreign objects are cached, unless set on their node
+PROXY_CACHE_TTL = int(os.getenv('PROXY_CACHE_TTL', 30))
+# seconds 404s, 5xx and unreachable servers are cached
+PROXY_NEGATIVE_CACHE_TTL = int(os.getenv('PROXY_NEGATIVE_CACHE_TTL', 10))
+
+# Foreign authors cache, see authors/remote.py
+# seconds before a cached foreign author is refreshed from its server
+REMOTE_AUTHOR_TTL = int(os.getenv('REMOTE_AUTHOR_TTL', 600))
+# number of threads refreshing stale foreign authors in the background
+REMOTE_AUTHOR_REFRESH_WORKERS = int(os.getenv('REMOTE_AUTHOR_REFRESH_WORKERS', 2))
+
+# Followings verification, see authors/followings.py
+# seconds between two checks of a following with the foreign server
+FOLLOWING_VERIFY_INTERVAL = int(os.getenv('FOLLOWING_VERIFY_INTERVAL', 3600))
+# seconds the worker waits for the foreign servers on each pass
+FOLLOWING_VERIFY_DEADLINE = float(os.getenv('FOLLOWING_VERIFY_DEADLINE', 20))
+# number of concurrent requests the worker sends to foreign servers
+FOLLOWING_VERIFY_WORKERS = int(os.getenv('FOLLOWING_VERIFY_WORKERS', 8))
+
+# most items accepted by the batch inbox (/inbox/) in a single request
+BATCH_INBOX_MAX_ITEMS = int(os.getenv('BATCH_INBOX_MAX_ITEMS', 1000))
+
+# Post delivery queue, see nodes/delivery.py
+# number of concurrent requests the worker sends to foreign inboxes
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 8))
+# number of jobs claimed by the worker on each pass
+DELIVERY_BATCH_SIZE = int(os.getenv('DELIVERY_BATCH_SIZE', 20))
+# a delivery is given up after this many failed attempts
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', 5))
+# seconds other workers skip the deliveries being sent, they are sent again after that if the worker died
+DELIVERY_CLAIM_TIMEOUT = int(os.getenv('DELIVERY_CLAIM_TIMEOUT', 300))
+
+# HTTP client used for every request to other nodes and GitHub, see nodes/client.py
+# keep-alive connections kept per host, should be at least DELIVERY_WORKERS
+NODE_CLIENT_POOL_SIZE = int(os.getenv('NODE_CLIENT_POOL_SIZE', 10))
+# seconds to wait for a connection, and for the response after connecting
+NODE_CLIENT_CONNECT_TIMEOUT = float(os.getenv('NODE_CLIENT_CONNECT_TIMEOUT', 3.05))
+NODE_CLIENT_READ_TIMEOUT = float(os.getenv('NODE_CLIENT_READ_TIMEOUT', 10))
+# retries on connection errors and 502/503/504, waiting backoff_factor * 2^n seconds in between
+NODE_CLIENT_RETRIES = int(os.getenv('NODE_CLIENT_RETRIES', 2))
+NODE_CLIENT_BACKOFF_FACTOR = float(os.getenv('NODE_CLIENT_BACKOFF_FACTOR', 0.3))
+
+# seconds nodes are cached by the node resolver (nodes/resolver.py), it's also cleared when a node changes in the same process
+NODE_RESOLVER_TTL = int(os.getenv('NODE_RESOLVER_TTL', 60))
+
+# Request metrics, see social_distance/metrics.py
+# fraction of the requests measured, in /metrics/
+PERFORMANCE_SAMPLE_RATE = float(os.getenv('PERFORMANCE_SAMPLE_RATE', 0.1))
+# measured responses have a Server-Timing header for staff users, or for everyone if set
+SERVER_TIMING_PUBLIC = os.getenv('SERVER_TIMING_PUBLIC', '').lower() in ('1', 'true', 'yes')
+# bearer token for /metrics/ (e.g. for a Prometheus scraper), staff users can always read it
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# GitHub activity poller, see github/utils.py
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com')
+# optional, raises the rate limit from 60 to 5000 requests per hour
+GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
+# seconds between two polls of the same author
+GITHUB_POLL_INTERVAL = int(os.getenv('GITHUB_POLL_INTERVAL', 300))
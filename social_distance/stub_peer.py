@@ -0,0 +1,151 @@
+"""
+A fake foreign server for the benchmark command and the tests, with configurable latency and error rate.
+
+It serves the endpoints that ConnectorService, the delivery worker and try_get call on other nodes:
+- GET  /author/<id>                        a generated author
+- GET  /author/<id>/followers/<follower>   {"result": true}
+- POST /author/<id>/inbox/                 accepts anything
+- POST /inbox/                             the batch inbox, see nodes/delivery.py
+
+and the GitHub API endpoint of the github poller (with GITHUB_API_URL set to the stub's url):
+- GET  /users/<username>/events            github_events[username], with an ETag
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AUTHOR_PATH = re.compile(r'^/author/(?P<author_id>[^/]+)/?$')
+FOLLOWER_PATH = re.compile(r'^/author/(?P<author_id>[^/]+)/followers/.+$')
+INBOX_PATH = re.compile(r'^(/author/[^/]+)?/inbox/?$')
+GITHUB_EVENTS_PATH = re.compile(r'^/users/(?P<username>[^/]+)/events$')
+
+
+class StubPeer:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=None, host='127.0.0.1', port=0):
+        # seconds, each response waits between half and one and a half times the latency
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # number of requests per (method, endpoint)
+        self.requests = Counter()
+        # {github username: the events served to the github poller}
+        self.github_events = {}
+        # unix time until which the github endpoint answers that the rate limit is used up
+        self.github_rate_limit_reset = None
+        self.server = ThreadingHTTPServer((host, port), self.get_handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def author_url(self, author_id):
+        return f"{self.url}author/{author_id}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='stub-peer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def draw(self):
+        """
+        (seconds to wait, whether to fail) for a request
+        """
+        with self.lock:
+            delay = self.latency * self.random.uniform(0.5, 1.5) if self.latency else 0
+            return delay, self.random.random() < self.error_rate
+
+    def respond_github_events(self, username, request_headers):
+        if self.github_rate_limit_reset:
+            return 'github events', 403, {'message': 'API rate limit exceeded'}, {
+                'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(self.github_rate_limit_reset)
+            }
+        events = self.github_events.get(username, [])
+        etag = '"%s"' % hashlib.sha1(json.dumps(events).encode()).hexdigest()
+        if request_headers.get('If-None-Match') == etag:
+            return 'github events', 304, None, {'ETag': etag}
+        return 'github events', 200, events, {'ETag': etag}
+
+    def respond(self, method, path, request_headers={}):
+        """
+        (endpoint name, status code, json, headers) of a request
+        """
+        path = path.split('?')[0]
+        match = GITHUB_EVENTS_PATH.match(path)
+        if method == 'GET' and match:
+            return self.respond_github_events(match.group('username'), request_headers)
+        match = AUTHOR_PATH.match(path)
+        if method == 'GET' and match:
+            author_url = self.author_url(match.group('author_id'))
+            return 'author', 200, {
+                'type': 'author',
+                'id': author_url,
+                'url': author_url,
+                'host': self.url,
+                'displayName': f"stub {match.group('author_id')}"[:30],
+                'github': None,
+            }, {}
+        if method == 'GET' and FOLLOWER_PATH.match(path):
+            return 'follower', 200, {'result': True}, {}
+        if method == 'POST' and INBOX_PATH.match(path):
+            return 'inbox', 200, {}, {}
+        return 'other', 404, {'detail': 'Not found.'}, {}
+
+    def get_handler_class(self):
+        peer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+
+                endpoint, status_code, data, headers = peer.respond(method, self.path, self.headers)
+                with peer.lock:
+                    peer.requests[(method, endpoint)] += 1
+                delay, fail = peer.draw()
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    status_code, data, headers = 500, {'detail': 'stub peer error'}, {}
+
+                # a 304 has no body
+                body = json.dumps(data).encode() if status_code != 304 else b''
+                self.send_response(status_code)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,53 @@
+"""
+Test helpers checking that the queries of an endpoint are served by an index, see social_distance/tests.py
+"""
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+
+
+def explain(sql, params=()):
+    """
+    the query plan of the sql on the test database, as text
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            # rows are (id, parent, notused, detail)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+        if connection.vendor == 'postgresql':
+            # the test tables are tiny, so postgres would rather scan them. ask for the plan it has when they are not.
+            # tests run in a transaction, SET LOCAL ends with it
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + sql, params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+class QueryPlanTestMixin:
+    """
+    assertions on the query plans of the queries run by a test client request (or any callable)
+    """
+    def get_table_queries(self, fn, table):
+        with CaptureQueriesContext(connection) as queries:
+            fn()
+        return [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].lstrip().upper().startswith('SELECT') and f'FROM "{table}"' in query['sql']
+        ], queries.captured_queries
+
+    def assertUsesIndex(self, fn_or_queryset, table, index_name):
+        """
+        assert that a query on the table, run by fn, uses the index.
+        fn can be a queryset, which is evaluated
+        """
+        if isinstance(fn_or_queryset, QuerySet):
+            queryset = fn_or_queryset
+            fn_or_queryset = lambda: list(queryset)
+
+        table_queries, all_queries = self.get_table_queries(fn_or_queryset, table)
+        if not table_queries:
+            self.fail(f"no query on {table}, queries:\n" + '\n'.join(query['sql'] for query in all_queries))
+
+        plans = [(sql, explain(sql)) for sql in table_queries]
+        if not any(index_name in plan for _, plan in plans):
+            self.fail(f"no query on {table} uses {index_name}:\n" + '\n\n'.join(f"{sql}\n-> {plan}" for sql, plan in plans))
@@ -1,5 +1,18 @@
-from django.test import TestCase
+import re
+from urllib.parse import quote
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authors.models import Author, Follow, InboxObject
+from posts.models import Comment, Post
+from .benchmark import Benchmark, benchmark_serializers, percentile
+from .metrics import registry
+from .stub_peer import StubPeer
+from .testing import QueryPlanTestMixin
 
 client = APIClient() # the mock http client
 
@@ -52,3 +65,147 @@ class AuthTestCase(TestCase):
         self.assertEqual(res.data['author']['github'], payload['github_url'])
         self.assertEqual(res.status_code, 200)
 
+
+class IndexUsageTestCase(QueryPlanTestMixin, TestCase):
+    """
+    the main query of the hot endpoints is served by an index, see social_distance/testing.py
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('index_user', password='pass')
+        self.author = Author.objects.create(id='index_author', url='http://testserver/author/index_author',
+                                            display_name='index author', user=self.user, is_internal=True)
+        self.follower = Author.objects.create(id='index_follower', url='http://foreign.example/author/index_follower',
+                                              display_name='follower')
+        Follow.objects.create(actor=self.follower, object=self.author, status=Follow.FollowStatus.ACCEPTED)
+        self.post = Post.objects.create(author=self.author, title='title', content='content')
+        Comment.objects.create(author=self.follower, post=self.post, comment='comment')
+        InboxObject.objects.create(author=self.author, content_object=self.post)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.author_url = f'/author/{self.author.id}'
+
+    def test_post_list_uses_index(self):
+        self.assertUsesIndex(lambda: self.client.get(f'{self.author_url}/posts/'), 'posts_post', 'post_author_listed_idx')
+
+    def test_all_posts_uses_index(self):
+        self.assertUsesIndex(lambda: self.client.get('/posts/'), 'posts_post', 'post_published_idx')
+
+    def test_comment_list_uses_index(self):
+        self.assertUsesIndex(lambda: self.client.get(f'{self.author_url}/posts/{self.post.id}/comments/'),
+                             'posts_comment', 'comment_post_published_idx')
+
+    def test_stream_uses_index(self):
+        self.assertUsesIndex(lambda: self.client.get(f'{self.author_url}/stream/'), 'posts_streamitem', 'stream_author_published_idx')
+
+    def test_follower_list_uses_index(self):
+        self.assertUsesIndex(lambda: self.client.get(f'{self.author_url}/followers/'), 'authors_author', 'follow_object_status_idx')
+
+    def test_inbox_object_lookup_uses_index(self):
+        self.assertUsesIndex(InboxObject.objects.filter(author=self.author, post=self.post), 'authors_inboxobject', 'inbox_author_object_idx')
+
+    def test_author_url_lookup_uses_index(self):
+        self.assertUsesIndex(Author.objects.filter(url=self.follower.url), 'authors_author', 'authors_author_url_')
+
+
+class BenchmarkTestCase(TestCase):
+    def test_percentile(self):
+        self.assertEqual(percentile(list(range(1, 101)), 50), 50)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_benchmark_runs_every_operation(self):
+        with StubPeer() as peer:
+            benchmark = Benchmark(peer, num_authors=2, followers_per_author=2, posts_per_author=1)
+            benchmark.seed()
+            benchmark.run(30)
+            rows = {row['operation']: row for row in benchmark.report()}
+            requests = dict(peer.requests)
+
+        self.assertEqual(set(rows), {'GET inbox', 'GET stream', 'POST following', 'POST like (inbox)', 'POST posts', 'deliver posts'})
+        self.assertFalse(any(row['errors'] for row in rows.values()))
+        # the posts were delivered to the followers on the stub server, and followed authors fetched from it
+        self.assertGreater(requests[('POST', 'inbox')], 0)
+        self.assertEqual(requests[('GET', 'author')], rows['POST following']['count'])
+
+    def test_fast_serializers_render_the_same_json(self):
+        # the speedup is reported by the benchmark_serializers command
+        rows = benchmark_serializers(num_items=100, repeat=1)
+        self.assertEqual([row['name'] for row in rows], ['authors', 'posts', 'comments', 'likes'])
+        for row in rows:
+            self.assertTrue(row['identical'], row['name'])
+
+
+@override_settings(PERFORMANCE_SAMPLE_RATE=1)
+class PerformanceMetricsTestCase(TestCase):
+    def setUp(self):
+        registry.clear()
+        cache.clear()
+        self.user = User.objects.create_user('metrics_user', password='pass', is_staff=True)
+        self.author = Author.objects.create(id='metrics_author', url='http://testserver/author/metrics_author',
+                                            display_name='metrics author', user=self.user, is_internal=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def get_timings(self, res):
+        """
+        {metric: (duration in ms, description)} of the Server-Timing header
+        """
+        return {
+            match.group('name'): (float(match.group('dur')), match.group('desc'))
+            for match in re.finditer(r'(?P<name>\w+);dur=(?P<dur>[\d.]+)(;desc="(?P<desc>[^"]*)")?', res['Server-Timing'])
+        }
+
+    def test_server_timing_header(self):
+        res = self.client.get(f'/author/{self.author.id}/')
+        self.assertEqual(res.status_code, 200)
+        timings = self.get_timings(res)
+        self.assertEqual(set(timings), {'db', 'http', 'render', 'total'})
+        self.assertNotEqual(timings['db'][1], '0 queries')
+        self.assertEqual(timings['http'][1], '0 outbound requests')
+        self.assertGreater(timings['total'][0], 0)
+
+    def test_outbound_requests_are_counted(self):
+        with StubPeer() as peer:
+            res = self.client.get(f'/proxy/{quote(peer.author_url("someone"), safe="")}/')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.get_timings(res)['http'][1], '1 outbound requests')
+
+    def test_server_timing_header_is_only_for_staff(self):
+        self.assertFalse(APIClient().get(f'/author/{self.author.id}/').has_header('Server-Timing'))
+        self.assertIn('_count{view="author-detail",method="GET",status="200"} 1', registry.render())
+        with self.settings(SERVER_TIMING_PUBLIC=True):
+            self.assertTrue(APIClient().get(f'/author/{self.author.id}/').has_header('Server-Timing'))
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        res = self.client.get(f'/author/{self.author.id}/')
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(res.has_header('Server-Timing'))
+        self.assertEqual(registry.render().count('_count{'), 0)
+
+    @override_settings(METRICS_TOKEN='scraper-token')
+    def test_metrics_endpoint(self):
+        self.client.get(f'/author/{self.author.id}/')
+        self.client.get(f'/author/{self.author.id}/')
+
+        self.assertEqual(APIClient().get('/metrics/').status_code, 403)
+        # not staff
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+
+        scraper = APIClient()
+        scraper.credentials(HTTP_AUTHORIZATION='Bearer scraper-token')
+        res = scraper.get('/metrics/')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        body = res.content.decode()
+        labels = 'view="author-detail",method="GET",status="200"'
+        self.assertIn(f'social_distance_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'social_distance_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertRegex(body, rf'social_distance_db_queries_total{{{labels}}} [1-9]')
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
@@ -0,0 +1,223 @@
+"""
+Query budgets of the API endpoints.
+
+Each endpoint is requested against a seeded database and must stay under a fixed number of SQL queries,
+whatever the size of the page, so N+1 regressions fail here. The fixtures are scaled by PERF_SCALE:
+1 is the realistic size (1k authors, 10k posts, 50k comments and inbox items), the default keeps the suite fast.
+
+    PERF_SCALE=1 python manage.py test social_distance.tests_performance
+
+Not covered: the endpoints that request other servers (proxy, the authors of a node), and following detail,
+which has no GET. Setting PERF_MAX_RENDER_SECONDS also checks the time to render each json response,
+wall-clock time depends too much on the machine to be checked by default.
+"""
+import base64
+import io
+import os
+import re
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authors.models import Author, Follow, InboxObject
+from nodes.models import Node
+from posts.models import Comment, Like, Post, StreamItem
+
+PERF_SCALE = float(os.getenv('PERF_SCALE', 0.02))
+# seconds the rendering of a json response may take, not checked if unset
+PERF_MAX_RENDER_SECONDS = float(os.environ['PERF_MAX_RENDER_SECONDS']) if os.getenv('PERF_MAX_RENDER_SECONDS') else None
+# items per page requested from the list endpoints
+PAGE_SIZE = 50
+
+HOST = 'http://testserver'
+
+
+def scaled(count, minimum):
+    return max(minimum, int(count * PERF_SCALE))
+
+
+class QueryBudgetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        num_authors = scaled(1000, 20)
+        num_posts = scaled(10000, 200)
+        num_comments = scaled(50000, 1000)
+        num_inbox_items = scaled(50000, 1000)
+
+        cls.user = User.objects.create_user('perf_user', password='perf_pass')
+        authors = [
+            Author(id=f'perf_{i}', url=f'{HOST}/author/perf_{i}', host=f'{HOST}/', display_name=f'author {i}',
+                   is_internal=i % 2 == 0, user=cls.user if i == 0 else None)
+            for i in range(num_authors)
+        ]
+        Author.objects.bulk_create(authors)
+        cls.author = authors[0]
+
+        posts = []
+        for i in range(num_posts):
+            url = f'{HOST}/author/{authors[i % num_authors].id}/posts/perf_post_{i}'
+            posts.append(Post(id=f'perf_post_{i}', url=url, source=url, origin=url, author=authors[i % num_authors],
+                              title=f'post {i}', content='content', unlisted=i % 10 == 9))
+        Post.objects.bulk_create(posts)
+        # the author's first post gets half of the comments and likes
+        cls.post = posts[0]
+
+        image = io.BytesIO()
+        Image.new('RGB', (60, 30)).save(image, format='PNG')
+        cls.image_post = Post(id='perf_image', url=f'{HOST}/author/{cls.author.id}/posts/perf_image', author=cls.author,
+                              title='image', content_type=Post.ContentType.IMAGE_PNG, unlisted=True,
+                              content=base64.b64encode(image.getvalue()).decode('ascii'))
+        # bulk_create doesn't move the content to the image storage
+        Post.objects.bulk_create([cls.image_post])
+
+        comments = []
+        for i in range(num_comments):
+            post = cls.post if i % 2 == 0 else posts[i % num_posts]
+            comments.append(Comment(id=f'perf_comment_{i}', url=f'{post.url}/comments/perf_comment_{i}', post=post,
+                                    author=authors[i % num_authors], comment='comment'))
+        Comment.objects.bulk_create(comments)
+        Post.reconcile_comment_counts()
+        cls.comment = comments[0]
+
+        likes = []
+        for i, author in enumerate(authors):
+            for liked in [cls.post, cls.comment, posts[(i + 1) % num_posts]]:
+                likes.append(Like(author=author, summary='like', object=liked.url, target=Like.get_target(liked.url),
+                                  post=liked if isinstance(liked, Post) else None, comment=liked if isinstance(liked, Comment) else None))
+        Like.objects.bulk_create(likes, ignore_conflicts=True)
+        # the primary keys are not set by bulk_create on every database
+        likes = list(Like.objects.order_by('id'))
+
+        follows = [
+            Follow(id=f'perf_follower_{i}', actor=author, object=cls.author, summary='follow',
+                   status=Follow.FollowStatus.ACCEPTED if i % 2 else Follow.FollowStatus.PENDING)
+            for i, author in enumerate(authors[1:])
+        ] + [
+            Follow(id=f'perf_following_{i}', actor=cls.author, object=author, summary='follow', status=Follow.FollowStatus.ACCEPTED)
+            for i, author in enumerate(authors[1:PAGE_SIZE + 1])
+        ]
+        Follow.objects.bulk_create(follows)
+
+        content_types = {model: ContentType.objects.get_for_model(model) for model in [Post, Like, Follow]}
+        inbox_objects = []
+        for i in range(num_inbox_items):
+            obj = [posts[i % num_posts], likes[i % len(likes)], follows[i % (num_authors - 1)]][i % 3]
+            inbox_objects.append(InboxObject(id=f'perf_inbox_{i}', author=cls.author,
+                                             content_type=content_types[type(obj)], object_id=str(obj.pk)))
+        InboxObject.objects.bulk_create(inbox_objects)
+        cls.inbox_object = inbox_objects[0]
+
+        # bulk_create sends no signals, so the stream is filled by hand
+        stream_posts = {obj.object_id for obj in inbox_objects if obj.content_type == content_types[Post]}
+        StreamItem.objects.bulk_create(
+            [StreamItem(author=cls.author, kind=StreamItem.Kind.INBOX, post_id=post_id, published=cls.post.published) for post_id in stream_posts] +
+            [StreamItem(author=cls.author, kind=StreamItem.Kind.OWN, post=post, published=post.published)
+             for post in posts if post.author_id == cls.author.id and not post.unlisted]
+        )
+
+        Node.objects.bulk_create([Node(name=f'node {i}', host_url=f'http://node{i}.example/') for i in range(PAGE_SIZE)])
+        cls.node = Node.objects.order_by('host_url').first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.author_url = f'/author/{self.author.id}'
+        self.post_url = f'{self.author_url}/posts/{self.post.id}'
+
+    def format_queries(self, queries):
+        """
+        the query log, with the repeated query shapes (usually an N+1) first
+        """
+        shapes = Counter(re.sub(r"'[^']*'|\b\d+\b", '?', query['sql']) for query in queries)
+        repeated = [f"{count}x {shape}" for shape, count in shapes.most_common() if count > 1]
+        return '\n'.join([
+            'repeated queries:', *(repeated or ['none']),
+            '', 'all queries:', *(f"[{query['time']}s] {query['sql']}" for query in queries),
+        ])
+
+    def assertQueryBudget(self, url, max_queries, status_code=200):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status_code, res.content[:500])
+        if len(queries) > max_queries:
+            self.fail(f"GET {url} ran {len(queries)} queries, the budget is {max_queries}\n" + self.format_queries(queries.captured_queries))
+        if PERF_MAX_RENDER_SECONDS is not None and hasattr(res, 'accepted_renderer'):
+            started = time.perf_counter()
+            res.accepted_renderer.render(res.data, res.accepted_media_type, res.renderer_context)
+            elapsed = time.perf_counter() - started
+            self.assertLess(elapsed, PERF_MAX_RENDER_SECONDS, f"GET {url} took {elapsed:.3f}s to render")
+        return res
+
+    def test_author_list(self):
+        self.assertQueryBudget(f'/authors/?size={PAGE_SIZE}', 3)
+
+    def test_author_detail(self):
+        self.assertQueryBudget(f'{self.author_url}/', 2)
+
+    def test_all_posts(self):
+        self.assertQueryBudget(f'/posts/?size={PAGE_SIZE}', 4)
+
+    def test_post_list(self):
+        res = self.assertQueryBudget(f'{self.author_url}/posts/?size={PAGE_SIZE}', 5)
+        self.assertTrue(res.data['items'])
+
+    def test_post_detail(self):
+        self.assertQueryBudget(f'{self.post_url}/', 8)
+
+    def test_comment_list(self):
+        res = self.assertQueryBudget(f'{self.post_url}/comments/?size={PAGE_SIZE}', 7)
+        self.assertEqual(len(res.data['comments']), PAGE_SIZE)
+
+    def test_comment_detail(self):
+        self.assertQueryBudget(f'{self.post_url}/comments/{self.comment.id}/', 9)
+
+    def test_post_likes(self):
+        self.assertQueryBudget(f'{self.post_url}/likes/', 4)
+
+    def test_comment_likes(self):
+        self.assertQueryBudget(f'{self.post_url}/comments/{self.comment.id}/likes/', 6)
+
+    def test_liked(self):
+        res = self.assertQueryBudget(f'{self.author_url}/liked/', 3)
+        self.assertGreater(len(res.data['items']), 1)
+
+    def test_image(self):
+        self.assertQueryBudget(f'{self.author_url}/images/{self.image_post.id}/', 3)
+
+    def test_followers(self):
+        res = self.assertQueryBudget(f'{self.author_url}/followers/?size={PAGE_SIZE}', 4)
+        self.assertGreater(len(res.data['items']), 1)
+
+    def test_follower_detail(self):
+        follower = Follow.objects.filter(object=self.author, status=Follow.FollowStatus.ACCEPTED).first().actor
+        self.assertQueryBudget(f'{self.author_url}/followers/{follower.url}', 3)
+
+    def test_followings(self):
+        res = self.assertQueryBudget(f'{self.author_url}/followings/?size={PAGE_SIZE}', 5)
+        self.assertEqual(len(res.data['items']), min(PAGE_SIZE, len(self.author.followings.all())))
+
+    def test_inbox(self):
+        res = self.assertQueryBudget(f'{self.author_url}/inbox/?size={PAGE_SIZE}', 9)
+        self.assertEqual(len(res.data['items']), PAGE_SIZE)
+
+    def test_inbox_detail(self):
+        self.assertQueryBudget(f'{self.author_url}/inbox/{self.inbox_object.id}/', 5)
+
+    def test_stream(self):
+        res = self.assertQueryBudget(f'{self.author_url}/stream/?size={PAGE_SIZE}', 5)
+        self.assertEqual(len(res.data['items']), PAGE_SIZE)
+
+    def test_nodes(self):
+        self.assertQueryBudget(f'/nodes/?size={PAGE_SIZE}', 3)
+
+    def test_node_detail(self):
+        self.assertQueryBudget(f'/nodes/{self.node.pk}/', 2)
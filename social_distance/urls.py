@@ -18,11 +18,11 @@ from django.urls import path, include
 from rest_framework_simplejwt.views import TokenRefreshView
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from authors.views import proxy
+from authors.views import BatchInboxView, proxy
 
 from posts.views import get_all_posts
 
-from .views import register, login, token_refresh
+from .views import register, login, token_refresh, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -37,11 +37,13 @@ urlpatterns = [
     path('authors/', include('authors.urls_authors')),
     path('author/', include('authors.urls_author')),
     path('proxy/<path:object_url>/', proxy, name='social-proxy'),
+    path('inbox/', BatchInboxView.as_view(), name='batch-inbox'),
 
     path('posts/', get_all_posts, name='all-posts'),
 
     # other stuff
     path('nodes/', include('nodes.urls')),
+    path('metrics/', metrics, name='metrics'),
 
     # root
     path('schema/', SpectacularAPIView.as_view(), name='open-schema'),
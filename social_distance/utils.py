@@ -1,5 +1,49 @@
+import hashlib
+import json
 import random
 
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
 def random_profile_color():
     return random.choice(["#39BAE6", "#FFB454", "#59C2FF", "#AAD94C", "#95E6CB", "#F07178", "#FF8F40", "#E6B673", "#D2A6FF", "#F29668", "#7FD962", "#73B8FF", "#F26D78", "#6C5980"]
 )
+
+def get_url_variants(url):
+    # authors are looked up by url with or without the trailing slash
+    return [url, url[:-1] if url.endswith('/') else url + '/']
+
+# HTTP caching of GET endpoints, see e.g. posts.views.PostDetail.get
+
+def make_etag(*parts):
+    """
+    a strong ETag from everything the response body depends on
+    """
+    return quote_etag(hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest())
+
+def get_not_modified_response(request, etag, last_modified=None, **cache_args):
+    """
+    a 304 response if the client's copy (If-None-Match / If-Modified-Since) is still current, otherwise None,
+    so the body only needs to be built when it's actually sent.
+    cache_args are passed to add_cache_headers.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    return add_cache_headers(response, etag, last_modified, **cache_args) if response else None
+
+def add_cache_headers(response, etag, last_modified=None, public=False, max_age=None):
+    """
+    public responses can be cached by a CDN or proxy for max_age seconds (PUBLIC_CACHE_MAX_AGE by default),
+    others only by the client itself, and have to be revalidated every time.
+    """
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if public:
+        patch_cache_control(response, public=True, max_age=settings.PUBLIC_CACHE_MAX_AGE if max_age is None else max_age)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Authorization'])
+    return response
@@ -1,5 +1,7 @@
 from django.contrib.auth import authenticate
-from rest_framework.decorators import api_view
+from django.http import HttpResponse
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.decorators import api_view, authentication_classes
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework import status
@@ -9,6 +11,7 @@ from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 
 from django.contrib.auth.backends import AllowAllUsersModelBackend
 
+from social_distance.metrics import MetricsTokenAuthentication, registry
 from social_distance.models import DynamicSettings
 
 from .serializers import CommonAuthenticateSerializer, RegisterSerializer
@@ -106,3 +109,18 @@ def login(request):
             return Response("please wait for the admin to approve and activate your account", status=status.HTTP_403_FORBIDDEN)
         return Response(CommonAuthenticateSerializer(user).data)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@extend_schema(exclude=True)
+@api_view(['GET'])
+@authentication_classes([MetricsTokenAuthentication, BasicAuthentication, JWTAuthentication])
+def metrics(request):
+    """
+    ## Description:  
+    **[INTERNAL]** request metrics in the Prometheus text format, see social_distance/metrics.py  
+    ## Responses:  
+    **200**: for staff users, or with the METRICS_TOKEN as a bearer token <br>
+    **403**: otherwise
+    """
+    if not isinstance(request.successful_authenticator, MetricsTokenAuthentication) and not request.user.is_staff:
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')